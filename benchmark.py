@@ -0,0 +1,374 @@
+import numpy as np
+
+import argparse, json, os, platform, shutil, subprocess, sys, tempfile, time
+
+# Performance benchmarks that run without the real dataset.
+#
+# make_fixture writes a small synthetic dataset laid out like the IDMT one:
+# dataset/monophonic/Samples/<fxType>/<fileID>.wav for the clean notes and a
+# few effects, plus matching fileData.csv and effectData.csv. The benchmarks
+# then time dataset creation, frame extraction and model inference on it and
+# write the results to JSON, so numbers from two versions of the code can be
+# compared with --compare.
+#
+# Import benchmarks time importing the headless modules in a fresh interpreter,
+# as a pool worker would, against the budgets in IMPORT_BUDGETS. They also list
+# any of HEAVY_MODULES an import pulled in, those should only load when a
+# function that needs them is called.
+#
+# Example:
+#   python benchmark.py --output before.json
+#   python benchmark.py --output after.json --compare before.json
+#   python benchmark.py --imports-only
+
+# (fxType name, fxTypeID, fxSettingID, genre) of the synthetic effects
+FIXTURE_EFFECTS = [
+    ("Distortion", 41, 1, "Metal"),
+    ("Overdrive", 42, 1, " Rock"),
+    ("EQ", 12, 1, "Rock & Roll"),
+]
+
+DATA_TYPES = ["scale", "random", "pentatonic"]
+
+# Seconds a fresh interpreter may take to import each module used by dataset,
+# evaluation and render workers, numpy included
+IMPORT_BUDGETS = {
+    "catalog": 0.3,
+    "filters": 0.6,
+    "model_utils": 0.75,
+    "data": 0.75,
+    "evaluation": 0.75,
+    "shards": 0.75,
+    "render": 0.3,
+}
+
+# Dependencies the modules above must not import when they are loaded
+HEAVY_MODULES = ["matplotlib", "sklearn", "pandas", "scipy.signal", "librosa.core", "tensorflow"]
+
+# Writes the synthetic dataset into root/dataset.
+#
+# Input:
+#   root - String
+#       Folder to create the dataset folder in.
+#   sr - Integer - Default 44100
+#       Sampling rate of the wav files, the same as the IDMT recordings.
+#   note_seconds - Float - Default 2.0
+#       Length of every note.
+#   frets - Integer - Default 13
+#       Frets per string, 0 to frets - 1.
+#   seed - Integer - Default 0
+def make_fixture(root, sr=44100, note_seconds=2.0, frets=13, seed=0):
+    import pandas as pd
+    import soundfile as sf
+
+    samples_path = os.path.join(root, "dataset", "monophonic", "Samples")
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(note_seconds * sr)) / sr
+    rows = []
+
+    for fx_name, fx_type, fx_setting, _ in [("NoFX", 11, 1, None)] + FIXTURE_EFFECTS:
+        os.makedirs(os.path.join(samples_path, fx_name), exist_ok=True)
+
+        for string in range(1, 7):
+            for fret in range(frets):
+                file_id = "G61-%d%02d%02d-%d-%d" % (string, fret, fx_type, fx_setting, len(rows) + 1)
+
+                # Decaying tone at the pitch of the note, after a short silence
+                # so trimming has something to remove
+                f0 = 82.41 * 2 ** (((string - 1) * 5 + fret) / 12)
+                note = 0.5 * np.sin(2 * np.pi * f0 * t) * np.exp(-2 * t) + 0.001 * rng.standard_normal(len(t))
+                note = np.concatenate([np.zeros(sr // 20), note[:-(sr // 20)]])
+                note = _apply_effect(fx_name, note)
+
+                sf.write(os.path.join(samples_path, fx_name, file_id + ".wav"), note.astype(np.float32), sr)
+                rows.append({
+                    "fileID": file_id, "instrumentSetting": 9, "playStyle": 3,
+                    "midi": 40 + (string - 1) * 5 + fret, "string": string, "fret": fret,
+                    "fxGroup": 1, "fxType": fx_type, "fxSetting": fx_setting, "fileTag": 1,
+                })
+
+    effects = [{
+        "fxName": "synthetic", "fxNameID": 1, "fxType": fx_name, "fxTypeID": fx_type,
+        "fxSetting": "default", "fxSettingID": fx_setting, "genre": genre, "paramName": "[]", "paramID": "[]",
+    } for fx_name, fx_type, fx_setting, genre in FIXTURE_EFFECTS]
+
+    pd.DataFrame(rows).to_csv(os.path.join(root, "dataset", "fileData.csv"), index=False)
+    pd.DataFrame(effects).to_csv(os.path.join(root, "dataset", "effectData.csv"), index=False)
+
+# Runs all benchmarks. Must be called with the fixture root as working
+# directory, the dataset code uses paths relative to it.
+#
+# Input:
+#   durations - List of Integer
+#       Dataset durations in seconds.
+#   frames - List of Integer
+#       Frame sizes for the dataset and inference benchmarks.
+#   sr - Integer
+#       Sampling rate the dataset is built at.
+#   repeat - Integer
+#       Times each benchmark is run, the median is reported.
+#   inference_seconds - List of Float - Default [5.0]
+#       Lengths of audio the inference benchmarks process.
+#
+# Output:
+#   results - List of dict
+#       One entry per benchmark with its name, parameters and timings.
+def run_benchmarks(durations, frames, sr, repeat, inference_seconds=(5.0,)):
+    import data
+    import model_utils
+
+    effect_data_path = os.path.join("dataset", "effectData.csv")
+    file_data_path = os.path.join("dataset", "fileData.csv")
+    results = []
+
+    # Decode path first, so store and cache benchmarks below cannot help it
+    for duration in durations:
+        for data_type in DATA_TYPES:
+            results.append(_measure("create_data", {"type": data_type, "duration": duration, "source": "decode"}, repeat,
+                                    data.create_data, "Metal", effect_data_path, file_data_path, mu_comp=False, srate=sr,
+                                    duration=duration, type=data_type, cache=False, store=False, seed=0))
+
+    from sample_store import build_store
+
+    start = time.perf_counter()
+    build_store([os.path.join("dataset", "monophonic", "Samples")], sr)
+    results.append({"name": "build_store", "params": {"sr": sr}, "seconds": time.perf_counter() - start, "runs": 1})
+
+    for duration in durations:
+        for data_type in DATA_TYPES:
+            results.append(_measure("create_data", {"type": data_type, "duration": duration, "source": "store"}, repeat,
+                                    data.create_data, "Metal", effect_data_path, file_data_path, mu_comp=False, srate=sr,
+                                    duration=duration, type=data_type, cache=False, seed=0))
+
+    for duration in durations:
+        signal, wet = data.create_data("Metal", effect_data_path, file_data_path, mu_comp=False, srate=sr,
+                                       duration=duration, type="random", seed=0)
+
+        for frame in frames:
+            size_training = int(len(signal) / frame * 0.8)
+            size_test = int(len(signal) / frame * 0.2)
+            params = {"duration": duration, "frame": frame}
+
+            results.append(_measure("create_dataset", params, repeat, model_utils.create_dataset,
+                                    signal, wet, size_training, size_test, frame, sr, 0.2, seed=0))
+            results.append(_measure("create_sequential_dataset", params, repeat, model_utils.create_sequential_dataset,
+                                    signal, wet, size_training, size_test, frame, sr, seed=0))
+
+            dry_test = model_utils.split_segments(signal, wet, sr, 0.2)[1]
+            results.append(_measure("prepare_audio_seq", params, repeat, lambda: np.ascontiguousarray(
+                model_utils.prepare_audio_seq(dry_test, 0, frame))))
+
+    results.extend(_inference_benchmarks(frames, sr, repeat, inference_seconds))
+
+    return results
+
+# Times importing every module in a fresh interpreter.
+#
+# Input:
+#   repeat - Integer
+#       Imports per module, the median is reported.
+#   budgets - dict - Default IMPORT_BUDGETS
+#       Module name -> seconds its import may take.
+#
+# Output:
+#   results - List of dict
+#       One entry per module with the import time, its budget, the peak RSS in
+#       MB after the import and the HEAVY_MODULES it loaded.
+def import_benchmarks(repeat, budgets=IMPORT_BUDGETS):
+    results = []
+
+    for module, budget in budgets.items():
+        runs = [_import_module(module) for _ in range(repeat)]
+        results.append({
+            "name": "import", "params": {"module": module},
+            "seconds": float(np.median([run["seconds"] for run in runs])), "runs": repeat,
+            "budget_seconds": budget,
+            "rss_mb": max(run["rss_mb"] for run in runs),
+            "heavy_modules": runs[0]["heavy_modules"],
+        })
+
+    return results
+
+# Import benchmarks that took longer than their budget or loaded heavy modules.
+def over_budget(results):
+    return [entry for entry in results if entry["name"] == "import" and
+            (entry["seconds"] > entry["budget_seconds"] or entry["heavy_modules"])]
+
+# Prints how each benchmark in new changed against old.
+def compare(old_results, new_results):
+    old = {_key(entry): entry["seconds"] for entry in old_results}
+
+    for entry in new_results:
+        key = _key(entry)
+        if key in old and old[key] > 0:
+            print("{:<70} {:>9.4f}s -> {:>9.4f}s  x{:.2f}".format(key, old[key], entry["seconds"], old[key] / entry["seconds"]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dataset creation and inference on a synthetic dataset.")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file the results are written to, machine specific so it is git ignored")
+    parser.add_argument("--compare", help="Earlier results to compare against")
+    parser.add_argument("--fixture-dir", help="Reuse or keep the synthetic dataset in this folder")
+    parser.add_argument("--durations", type=int, nargs="+", default=[10, 30])
+    parser.add_argument("--frames", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--sr", type=int, default=22050)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--inference-seconds", type=float, nargs="+", default=[5.0], help="Audio lengths for the inference benchmarks")
+    parser.add_argument("--imports-only", action="store_true", help="Only run the import benchmarks, exit with 1 if one is over budget")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    results = import_benchmarks(args.repeat)
+
+    if args.imports_only:
+        _report(output, results, args.compare)
+        sys.exit(1 if over_budget(results) else 0)
+
+    root = os.path.abspath(args.fixture_dir) if args.fixture_dir else tempfile.mkdtemp(prefix="benchmark_")
+
+    if not os.path.exists(os.path.join(root, "dataset", "fileData.csv")):
+        make_fixture(root)
+
+    # The store is rebuilt by the benchmarks, a stale one would skip decoding
+    shutil.rmtree(os.path.join(root, "dataset", "store"), ignore_errors=True)
+
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        results += run_benchmarks(args.durations, args.frames, args.sr, args.repeat, args.inference_seconds)
+    finally:
+        os.chdir(cwd)
+        if not args.fixture_dir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    _report(output, results, args.compare)
+
+# -----------------------------------------------------------------------
+# Helper functions below are designed to be used only in this module.
+
+def _report(output, results, compare_path):
+    report = {"meta": _meta(), "results": results}
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for entry in results:
+        print("{:<70} {:>9.4f}s".format(_key(entry), entry["seconds"]))
+
+    for entry in over_budget(results):
+        print("Over budget: import %s took %.3fs of %.3fs, loaded %s" % (
+            entry["params"]["module"], entry["seconds"], entry["budget_seconds"], ", ".join(entry["heavy_modules"]) or "nothing heavy"))
+
+    if compare_path:
+        with open(compare_path) as f:
+            compare(json.load(f)["results"], results)
+
+def _apply_effect(fx_name, note):
+    if fx_name == "Distortion":
+        return np.tanh(8 * note) * 0.6
+    if fx_name == "Overdrive":
+        return np.tanh(3 * note) * 0.7
+    if fx_name == "EQ":
+        return np.convolve(note, [0.5, 0.3, 0.2], mode="same")
+    return note
+
+# Median time of repeat calls, after one untimed call that absorbs imports
+# and other first-call costs
+def _measure(name, params, repeat, function, *args, **kwargs):
+    function(*args, **kwargs)
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        runs.append(time.perf_counter() - start)
+
+    return {"name": name, "params": params, "seconds": float(np.median(runs)), "runs": repeat}
+
+# Real-time factor of the notebook model at every frame size and audio
+# length, for the windowed keras and numpy predictors and the streaming engine
+def _inference_benchmarks(frames, sr, repeat, inference_seconds):
+    import tensorflow as tf
+
+    import model_utils
+    import numpy_lstm
+    from streaming_inference import StatefulEngine, real_time_factor
+
+    results = []
+    rng = np.random.default_rng(0)
+    clips = [rng.uniform(-0.5, 0.5, int(sr * seconds)).astype(np.float32) for seconds in inference_seconds]
+
+    for frame in frames:
+        tf.keras.backend.clear_session()
+        model = tf.keras.Sequential(name="benchmark")
+        model.add(tf.keras.layers.Input(shape=(frame, 1)))
+        model.add(tf.keras.layers.LSTM(16, activation='tanh', return_sequences=True, name='layer1benchmark'))
+        model.add(tf.keras.layers.LSTM(16, activation='tanh', return_sequences=False, name='layer2benchmark'))
+        model.add(tf.keras.layers.Dense(1))
+
+        model_dir = tempfile.mkdtemp()
+        model.save(os.path.join(model_dir, "benchmark.keras"))
+        numpy_model = numpy_lstm.load_model(os.path.join(model_dir, "benchmark.keras"))
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+        # Warm up so tracing the predict function is not counted
+        model.predict(np.zeros((4096, frame), dtype=np.float32), batch_size=4096, verbose=0)
+
+        for seconds, audio in zip(inference_seconds, clips):
+            prepared_audio = model_utils.prepare_audio_seq(audio[None, :], 0, frame)
+            predictors = [
+                ("keras", lambda: model.predict(prepared_audio, batch_size=4096, verbose=0)),
+                ("numpy", lambda: numpy_model.predict(prepared_audio, batch_size=4096)),
+            ]
+
+            for backend, predict in predictors:
+                entry = _measure("inference", {"backend": backend, "frame": frame, "seconds": seconds}, repeat, predict)
+                entry["real_time_factor"] = entry["seconds"] / seconds
+                results.append(entry)
+
+    # The streaming engine does not depend on the frame size
+    engine = StatefulEngine(model)
+    for seconds, audio in zip(inference_seconds, clips):
+        factors = [real_time_factor(engine, audio, sr) for _ in range(repeat)]
+        results.append({"name": "inference", "params": {"backend": "streaming", "seconds": seconds},
+                        "seconds": float(np.median(factors)) * seconds, "runs": repeat,
+                        "real_time_factor": float(np.median(factors))})
+
+    return results
+
+# Imports a module in a fresh interpreter started in this folder, so nothing
+# the benchmark itself imported is counted
+def _import_module(module):
+    probe = (
+        "import json, resource, sys, time\n"
+        "start = time.perf_counter()\n"
+        "import %s\n"
+        "seconds = time.perf_counter() - start\n"
+        "print(json.dumps({'seconds': seconds,\n"
+        "                  'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,\n"
+        "                  'heavy_modules': [name for name in %r if name in sys.modules]}))\n"
+    ) % (module, HEAVY_MODULES)
+
+    completed = subprocess.run([sys.executable, "-c", probe], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def _key(entry):
+    params = ", ".join("%s=%s" % item for item in sorted(entry["params"].items()))
+    return "%s(%s)" % (entry["name"], params)
+
+def _meta():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import numpy as np
+
+import os
+
+# Typed, indexed view of fileData.csv and effectData.csv.
+#
+# The CSVs are read once per process (see load_catalog) and the numeric columns
+# are converted to integers. Notes are indexed by
+# (playStyle, instrumentSetting, fxType, fxSetting, string, fret), and every
+# genre gets an explicit table pairing each clean note with its effect version,
+# matched by note identity rather than by row order.
+
+# Columns of fileData.csv that hold integer ids
+FILE_INT_COLUMNS = ["instrumentSetting", "playStyle", "midi", "string", "fret",
+                    "fxGroup", "fxType", "fxSetting", "fileTag"]
+
+# Columns of effectData.csv that hold integer ids
+EFFECT_INT_COLUMNS = ["fxNameID", "fxTypeID", "fxSettingID"]
+
+# Columns that identify the same note across the effect folders
+NOTE_IDENTITY = ["playStyle", "instrumentSetting", "string", "fret", "midi"]
+
+# fxType of the clean (NoFX) recordings
+CLEAN_FX_TYPE = 11
+
+class SampleCatalog:
+
+    # Input:
+    #   effect_data_path - String
+    #       Path to effect data csv file.
+    #   file_data_path - String
+    #       Path to file data csv file.
+    def __init__(self, effect_data_path, file_data_path):
+        self.effects = _read_typed(effect_data_path, EFFECT_INT_COLUMNS)
+        self.files = _read_typed(file_data_path, FILE_INT_COLUMNS)
+
+        # (playStyle, instrumentSetting, fxType, fxSetting) -> rows, and the same
+        # with (string, fret) added, each list in file order
+        self._group_index = _build_index(self.files, ["playStyle", "instrumentSetting", "fxType", "fxSetting"])
+        self._note_index = _build_index(self.files, ["playStyle", "instrumentSetting", "fxType", "fxSetting", "string", "fret"])
+        self._pairs = {}
+        self._pair_index = {}
+
+    # Row of effectData.csv for a genre, or None if the genre is unknown.
+    def effect(self, genre):
+        rows = self.effects[self.effects.genre == genre]
+
+        if rows.empty:
+            return None
+
+        return rows.iloc[0]
+
+    # Rows of fileData.csv for a setting, optionally a single string and fret.
+    # A fxSetting of None matches every setting of the fxType.
+    def lookup(self, play_style, instrument, fx_type, fx_setting=None, string=None, fret=None):
+        if fx_setting is None:
+            settings = [key[3] for key in self._group_index if key[:3] == (play_style, instrument, fx_type)]
+            rows = [self.lookup(play_style, instrument, fx_type, s, string, fret) for s in settings]
+            return np.sort(np.concatenate(rows)) if rows else np.zeros(0, dtype=int)
+
+        if string is None:
+            return self._group_index.get((play_style, instrument, fx_type, fx_setting), np.zeros(0, dtype=int))
+
+        return self._note_index.get((play_style, instrument, fx_type, fx_setting, string, fret), np.zeros(0, dtype=int))
+
+    # Table pairing every clean note with the same note played through the
+    # effect of a genre. Built once per genre.
+    #
+    # Output:
+    #   pairs - pd.DataFrame
+    #       Columns cleanID, effectID, string, fret, midi, in the order of the
+    #       clean notes in fileData.csv.
+    def pairs(self, genre, play_style=3, instrument=9):
+        key = (genre, play_style, instrument)
+
+        if key not in self._pairs:
+            effect = self.effect(genre)
+            if effect is None:
+                return None
+
+            clean = self.files.iloc[self.lookup(play_style, instrument, CLEAN_FX_TYPE)]
+            wet = self.files.iloc[self.lookup(play_style, instrument, effect.fxTypeID, effect.fxSettingID)]
+            self._pairs[key] = _pair_notes(clean, wet)
+            self._pair_index[key] = _build_index(self._pairs[key], ["string", "fret"])
+
+        return self._pairs[key]
+
+    # Pairs of a genre restricted to a set of (string, fret) notes, kept in
+    # the same order as in pairs.
+    def note_pairs(self, genre, notes, play_style=3, instrument=9):
+        pairs = self.pairs(genre, play_style, instrument)
+        if pairs is None:
+            return None
+
+        index = self._pair_index[(genre, play_style, instrument)]
+        rows = [index[note] for note in notes if note in index]
+        rows = np.sort(np.concatenate(rows)) if rows else np.zeros(0, dtype=int)
+
+        return pairs.iloc[rows]
+
+_catalogs = {}
+
+# Returns the catalog for a pair of CSVs, reading them only the first time or
+# when either file changed since.
+def load_catalog(effect_data_path, file_data_path):
+    key = (os.path.abspath(effect_data_path), os.path.abspath(file_data_path))
+    stamp = (os.path.getmtime(effect_data_path), os.path.getmtime(file_data_path))
+
+    if key not in _catalogs or _catalogs[key][0] != stamp:
+        _catalogs[key] = (stamp, SampleCatalog(effect_data_path, file_data_path))
+
+    return _catalogs[key][1]
+
+# -----------------------------------------------------------------------
+# Helper functions below are designed to be used only in this module.
+
+# pandas is imported on first use, workers that never build a catalog skip it
+def _read_typed(path, int_columns):
+    import pandas as pd
+
+    df = pd.read_csv(path)
+
+    for column in int_columns:
+        if column in df:
+            df[column] = pd.to_numeric(df[column], errors="coerce").fillna(-1).astype(np.int32)
+
+    return df
+
+def _build_index(df, columns):
+    groups = df.groupby(columns, sort=False).indices
+    return {tuple(int(v) for v in key): np.sort(rows) for key, rows in groups.items()}
+
+# Matches clean and effect notes on NOTE_IDENTITY. Repeated recordings of the
+# same note are matched in order of appearance.
+def _pair_notes(clean, wet):
+    import pandas as pd
+
+    clean = clean.assign(occurrence=clean.groupby(NOTE_IDENTITY).cumcount(), order=np.arange(len(clean)))
+    wet = wet.assign(occurrence=wet.groupby(NOTE_IDENTITY).cumcount())
+
+    pairs = clean.merge(wet[NOTE_IDENTITY + ["occurrence", "fileID"]],
+                        on=NOTE_IDENTITY + ["occurrence"], suffixes=("", "_effect"))
+    pairs = pairs.sort_values("order")
+
+    return pd.DataFrame({
+        "cleanID": pairs.fileID.to_numpy(),
+        "effectID": pairs.fileID_effect.to_numpy(),
+        "string": pairs.string.to_numpy(),
+        "fret": pairs.fret.to_numpy(),
+        "midi": pairs.midi.to_numpy(),
+    })
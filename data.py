@@ -1,8 +1,14 @@
-import librosa as lib
 import numpy as np
-import pandas as pd
 
 import os, random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog import load_catalog
+from filters import FIRFilter, filter_audio
+from note_cache import NoteCache, decode_note
+from profiling import profiled, stage
+from sample_store import open_store
 
 # Combines files from the dataset to create input expected for the LSTM.
 #
@@ -24,6 +30,27 @@ import os, random
 #           Options: scale, random, pentatonic
 #   incl_poly - Boolean - Default True
 #       Choose to include polyphonic sounds in output.
+#   cache - Boolean or NoteCache - Default True
+#       Cache decoded notes on disk so later builds skip decoding. True uses
+#       the shared cache in dataset/cache/notes, False always decodes.
+#   store - Boolean or SampleStore - Default True
+#       Read notes and their trim boundaries from a store made by
+#       sample_store.py. True uses dataset/store when it holds srate, and
+#       falls back to the cache otherwise.
+#   compact - Boolean - Default False
+#       Return mu's law codes as int8 instead of int64, 8x smaller. The codes
+#       are the same, -128 to 127. Audio without compression is float32
+#       either way.
+#   seed - Integer - Default None
+#       Seed for the note choices. None uses the global random module, so
+#       random.seed still applies.
+#   workers - Integer - Default None
+#       Number of threads decoding notes ahead of assembly. None uses up to 8,
+#       1 decodes serially. The output is the same either way.
+#   filters - np.array or List of np.array - Default None
+#       FIR taps applied to both the clean and effect audio before mu's law
+#       compression, e.g. filters.notebook_filters(). A list is applied in
+#       series, see filters.py.
 #
 # Output:
 #   clean_audio - np.array
@@ -31,154 +58,349 @@ import os, random
 #   effect_audio - np.array
 #       Long audio with applied effect to be used as training and 
 #       testing output.
-def create_data(genre, effect_data_path, file_data_path, mu_comp=True, srate=22050, duration=120, type="scale", incl_poly=False):
+@profiled("data.create_data")
+def create_data(genre, effect_data_path, file_data_path, mu_comp=True, srate=22050, duration=120, type="scale", incl_poly=False, cache=True, store=True, compact=False, seed=None, workers=None, filters=None):
+    notes = _note_pairs(genre, effect_data_path, file_data_path, mu_comp, srate, duration, type, incl_poly, cache, store, seed, workers)
+
+    if (notes is None):
+        return [], []
+
+    # A single chunk spanning the whole duration, preallocated up front
+    max_length = duration * srate
+    empty = np.zeros(0, dtype=np.float32)
+    clean_audio, effect_audio = next(_assemble_chunks(notes, max_length, max_length), (empty, empty))
+
+    if (filters is not None):
+        with stage("data.filter"):
+            clean_audio = filter_audio(clean_audio, filters)
+            effect_audio = filter_audio(effect_audio, filters)
+
+    if (mu_comp == True):
+        clean_audio = _mu_compress(clean_audio, compact)
+        effect_audio = _mu_compress(effect_audio, compact)
+
+    return clean_audio, effect_audio
+
+# Creates the audio of several genres from the same clean notes, so their
+# models can be trained together on one clean input.
+#
+# Input:
+#   genres - List of String
+#       Genre names, as for create_data.
+#   Rest same as create_data. Every genre is built with the same seed, one is
+#   drawn from the random module when none is given.
+#
+# Output:
+#   clean_audio - np.array
+#       Clean audio shared by every genre.
+#   effect_audio - List of np.array
+#       Audio with the effect of each genre applied, in the order of genres.
+#
+# Raises ValueError when a genre picks different clean notes than the first,
+# which happens when its effect is missing some of the notes.
+def create_multi_genre_data(genres, effect_data_path, file_data_path, mu_comp=True, srate=22050, duration=120, type="scale", cache=True, store=True, compact=False, seed=None, workers=None, filters=None):
+    if seed is None:
+        seed = random.getrandbits(64)
+
+    clean_audio = None
+    effect_audio = []
+
+    for genre in genres:
+        clean, effect = create_data(genre, effect_data_path, file_data_path, mu_comp, srate, duration, type, cache=cache,
+                                    store=store, compact=compact, seed=seed, workers=workers, filters=filters)
+
+        if (clean_audio is None):
+            clean_audio = clean
+        elif (not np.array_equal(clean, clean_audio)):
+            raise ValueError("%s does not have the same clean notes as %s, train its model on its own" % (genre, genres[0]))
+
+        effect_audio.append(effect)
+
+    return clean_audio, effect_audio
+
+# Same as create_data, but yields the audio in fixed-size chunks instead of
+# returning it all at once, so long datasets never have to be held in memory.
+#
+# Input:
+#   Same as create_data, plus:
+#   chunk_size - Integer - Default None
+#       Number of samples in each chunk. Defaults to 5 seconds of audio.
+#
+# Filters carry their state from chunk to chunk, so the filtered chunks join
+# up to the same audio create_data returns.
+#
+# Output (yielded per chunk):
+#   clean_chunk - np.array
+#       Next chunk_size samples of the clean audio. The last chunk may be
+#       shorter.
+#   effect_chunk - np.array
+#       Matching chunk of the audio with applied effect.
+def create_data_chunks(genre, effect_data_path, file_data_path, mu_comp=True, srate=22050, duration=120, type="scale", incl_poly=False, cache=True, store=True, compact=False, seed=None, workers=None, chunk_size=None, filters=None):
+    notes = _note_pairs(genre, effect_data_path, file_data_path, mu_comp, srate, duration, type, incl_poly, cache, store, seed, workers)
+
+    if (notes is None):
+        return
+
+    if (chunk_size is None):
+        chunk_size = srate * 5
+
+    if (filters is not None):
+        clean_filter = FIRFilter(filters)
+        effect_filter = FIRFilter(filters)
+
+    for clean_chunk, effect_chunk in _assemble_chunks(notes, duration * srate, chunk_size):
+        if (filters is not None):
+            with stage("data.filter"):
+                clean_chunk = clean_filter.process(clean_chunk)
+                effect_chunk = effect_filter.process(effect_chunk)
+
+        if (mu_comp == True):
+            clean_chunk = _mu_compress(clean_chunk, compact)
+            effect_chunk = _mu_compress(effect_chunk, compact)
+
+        yield clean_chunk, effect_chunk
+
+# -----------------------------------------------------------------------
+# Helper function below are designed to be used only in this module.
+
+# mu's law codes, as int8 when compact. Filtering can push peaks slightly
+# past full scale, those are clipped since mu_compress only takes [-1, 1].
+@profiled("data.mu_compress")
+def _mu_compress(audio, compact):
+    import librosa as lib
+
+    codes = lib.mu_compress(np.clip(audio, -1.0, 1.0), mu=255)
+    return codes.astype(np.int8) if compact else codes
+
+_cache = None
+
+# Shared note cache, created on first use.
+def _default_cache():
+    global _cache
+
+    if _cache is None:
+        _cache = NoteCache()
+
+    return _cache
+
+# Loads the notes of a genre, decoding them in a thread pool ahead of use.
+class _NoteLoader:
+
+    def __init__(self, clean_path, effect_path, srate, mu_comp, cache, store, workers):
+        self.clean_path = clean_path
+        self.effect_path = effect_path
+        self.srate = srate
+        self.mu_comp = mu_comp
+        self.cache = cache
+        self.store = store
+        self.workers = min(8, os.cpu_count() or 1) if workers is None else workers
+
+    # Loads a single note, from the sample store or through the note cache
+    # when either is given.
+    def load(self, audio_path, file_id):
+        if self.store and file_id in self.store:
+            with stage("data.load_store") as s:
+                note = self.store.load(file_id)
+                s.add_array(note)
+                return note
+
+        file = os.path.join(audio_path, file_id + ".wav")
+
+        if self.cache:
+            with stage("data.load_cache") as s:
+                note = self.cache.load(file, file_id, self.srate, self.mu_comp)
+                s.add_array(note)
+                return note
+
+        return decode_note(file, self.srate)
+
+    def load_pair(self, clean_id, effect_id):
+        return self.load(self.clean_path, clean_id), self.load(self.effect_path, effect_id)
+
+    # Start and end of a clean note without leading and trailing silence.
+    def trim_bounds(self, note, file_id):
+        if self.store and file_id in self.store:
+            return self.store.trim_bounds(file_id)
+
+        with stage("data.trim"):
+            import librosa as lib
+            _, indexes = lib.effects.trim(note)
+            return indexes
+
+    # Calls load on every item in a thread pool, keeping a bounded number of
+    # items in flight, and yields the results in the order of the items.
+    # Items are only drawn from the iterator as earlier ones are handed out.
+    def prefetch(self, load, items):
+        if self.workers <= 1:
+            for item in items:
+                yield load(*item)
+            return
+
+        read_ahead = 2 * self.workers
+        pool = ThreadPoolExecutor(self.workers)
+        pending = deque()
+
+        try:
+            for item in items:
+                pending.append(pool.submit(load, *item))
+
+                if len(pending) >= read_ahead:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+# Looks up the notes for a genre and returns a generator of (clean, effect)
+# note pairs in the order they should be played. Returns None if the genre or
+# type could not be found.
+def _note_pairs(genre, effect_data_path, file_data_path, mu_comp, srate, duration, type, incl_poly, cache, store, seed, workers):
     mono_sample_path = os.path.join("dataset", "monophonic", "Samples")
 
     if incl_poly == True:
         print("Polymphonic not currently supported. Ignoring param.")
     
-    effect_df = pd.read_csv(effect_data_path)
-    file_df = pd.read_csv(file_data_path)
-
-    effect_df = effect_df[( effect_df.genre == genre)].iloc[0]
+    with stage("data.catalog"):
+        sample_catalog = load_catalog(effect_data_path, file_data_path)
+    effect = sample_catalog.effect(genre)
 
-    if (effect_df.empty):
+    if (effect is None):
         print("Genre could not be found, double check string format.")
-        return [], []
+        return None
 
     clean_path = os.path.join(mono_sample_path, "NoFX")
-    effect_path = os.path.join(mono_sample_path, effect_df.fxType)
+    effect_path = os.path.join(mono_sample_path, effect.fxType)
 
     # For both, use picking for play style and instrument 9 (the stratocaster)
-    # Only grab files that match the genre given
-    file_effect_df = file_df[
-        ( file_df.playStyle == 3 ) &
-        ( file_df.instrumentSetting == 9 ) &
-        ( file_df.fxType == effect_df.fxTypeID ) &
-        ( file_df.fxSetting == effect_df.fxSettingID )
-    ]
+    # Each clean note is paired with the same note played through the genre's effect
+    pairs = sample_catalog.pairs(genre, play_style=3, instrument=9)
 
-    # Only select no effect
-    file_clean_df = file_df[
-        ( file_df.playStyle == 3 ) &
-        ( file_df.instrumentSetting == 9 ) &
-        ( file_df.fxType == 11 )
-    ]
+    if (cache == True):
+        cache = _default_cache()
+
+    if (store == True):
+        store = open_store(srate)
+
+    # The random module itself when no seed is given, so random.seed still applies
+    rng = random if seed is None else random.Random(seed)
+    loader = _NoteLoader(clean_path, effect_path, srate, mu_comp, cache, store, workers)
 
     if (type == "scale"):
         # Duration / 2 makes sure a scale of specified duration is guaranteed.
         # 2 is used because the dataset notes are all 2 second durations.
-        start = random.randint(0, (len(file_clean_df) - (int) (duration / 2)))
+        start = rng.randint(0, (len(pairs) - (int) (duration / 2)))
 
-        clean_audio = _create_scale(clean_path, file_clean_df, srate, duration, start)
-        effect_audio = _create_scale(effect_path, file_effect_df, srate, duration, start)
+        return _create_scale(loader, pairs, start)
     elif (type == "random"):
-        clean_audio, effect_audio = _create_random(clean_path, effect_path, file_clean_df, file_effect_df, srate, duration)
+        return _create_random(loader, pairs, rng)
     elif (type == "pentatonic"):
-        clean_audio, effect_audio = _create_pentatonic(clean_path, effect_path, file_clean_df, file_effect_df, srate, duration)
-    else:
-        print("Type not found. Select from: scale, random, pentatonic.")
-        clean_audio, effect_audio = []
+        return _create_pentatonic(loader, sample_catalog, genre, rng)
 
-    if (mu_comp == True):
-        clean_audio = lib.mu_compress(clean_audio, mu=255)
-        effect_audio = lib.mu_compress(effect_audio, mu=255)
+    print("Type not found. Select from: scale, random, pentatonic.")
+    return None
 
-    return clean_audio, effect_audio
+# Writes note pairs into preallocated float32 buffers, yielding a pair of
+# buffers each time chunk_size samples are filled. Stops after max_length
+# samples, or earlier if the notes run out.
+def _assemble_chunks(notes, max_length, chunk_size):
+    chunk_size = min(chunk_size, max_length)
+    clean_chunk = np.empty(chunk_size, dtype=np.float32)
+    effect_chunk = np.empty(chunk_size, dtype=np.float32)
+    filled = 0
+    total = 0
 
-# -----------------------------------------------------------------------
-# Helper function below are designed to be used only in this module.
+    for clean_note, effect_note in notes:
+        note_length = min(len(clean_note), max_length - total)
+        position = 0
 
-# Picks a random starting note, then puts notes in order up to a duration.
-def _create_scale(audio_path, file_df, srate, duration, start):
-    audio = []
+        while position < note_length:
+            with stage("data.assemble"):
+                size = min(chunk_size - filled, note_length - position)
+                clean_chunk[filled:filled + size] = clean_note[position:position + size]
 
-    max_length = duration * srate
+                # Keep notes aligned even if the effect version is a bit shorter
+                effect_part = effect_note[position:position + size]
+                effect_chunk[filled:filled + len(effect_part)] = effect_part
+                effect_chunk[filled + len(effect_part):filled + size] = 0.0
 
-    for _, row in file_df[start:].iterrows():
-        file = os.path.join(audio_path, row.fileID + ".wav")
-        note, _ = lib.load(file, sr=srate)
+            filled += size
+            position += size
 
-        audio = np.hstack([audio, note])
+            if (filled == chunk_size):
+                yield clean_chunk, effect_chunk
+                clean_chunk = np.empty(chunk_size, dtype=np.float32)
+                effect_chunk = np.empty(chunk_size, dtype=np.float32)
+                filled = 0
 
-        if (len(audio) >= max_length):
-            return audio
+        total += note_length
 
-    return audio
+        if (total >= max_length):
+            break
 
-# Chooses a random file each time till the duration of audio is achieved.
-def _create_random(clean_path, effect_path, file_clean_df, file_effect_df, srate, duration):
-    clean_audio = []
-    effect_audio = []
+    if (filled > 0):
+        yield clean_chunk[:filled], effect_chunk[:filled]
 
-    max_length = duration * srate
+# Picks a random starting note, then puts notes in order up to a duration.
+def _create_scale(loader, pairs, start):
+    ids = zip(pairs.cleanID.iloc[start:], pairs.effectID.iloc[start:])
 
-    while len(clean_audio) < max_length:
-        index = random.randint(0, len(file_clean_df) - 1)
+    return loader.prefetch(loader.load_pair, ids)
+
+# Chooses a random file each time till the duration of audio is achieved.
+def _create_random(loader, pairs, rng):
+    clean_ids = pairs.cleanID.tolist()
+    effect_ids = pairs.effectID.tolist()
 
-        clean_file = os.path.join(clean_path, file_clean_df.iloc[index].fileID + ".wav")
-        effect_file = os.path.join(effect_path, file_effect_df.iloc[index].fileID + ".wav")
+    # Random choices are drawn in the same order as when loading one note at a
+    # time, so the result does not depend on how many notes are loaded ahead
+    def choices():
+        while True:
+            index = rng.randint(0, len(clean_ids) - 1)
+            yield clean_ids[index], effect_ids[index], rng.randint(1, 4)
 
-        clean, _ = lib.load(clean_file, sr=srate)
-        effect, _ = lib.load(effect_file, sr=srate)
+    def load(clean_id, effect_id, divisor):
+        clean, effect = loader.load_pair(clean_id, effect_id)
 
         # Create random duration
-        note_length = (int) (len(clean) / random.randint(1, 4))
+        note_length = (int) (len(clean) / divisor)
 
         # Remove leading and trailing silence in a predictable manner
-        clean, indexes = lib.effects.trim(clean)
+        indexes = loader.trim_bounds(clean, clean_id)
+        clean = clean[indexes[0]:indexes[1]]
         effect = effect[indexes[0]:indexes[1]]
 
-        clean_note = process_note(clean, note_length, srate)
-        effect_note = process_note(effect, note_length, srate)
+        clean_note = process_note(clean, note_length, loader.srate)
+        effect_note = process_note(effect, note_length, loader.srate)
 
-        clean_audio = np.hstack([clean_audio, clean_note])
-        effect_audio = np.hstack([effect_audio, effect_note])
+        return clean_note, effect_note
 
-    return clean_audio, effect_audio
+    return loader.prefetch(load, choices())
 
 # Creates a solo-like tune based on a pentatonic scale.
 # Chooses a random starting value on the low E string from the files, then maps out 
 # the appropriate pentatonic scale.
 # From that scale it chooses random notes to create the audio up to the duration.
-def _create_pentatonic(clean_path, effect_path, file_clean_df, file_effect_df, srate, duration):
+def _create_pentatonic(loader, sample_catalog, genre, rng):
 
     # 9 because dataset goes up to fret 12 on each string and we want whole scale
-    start_fret = random.randint(0, 9)
-
-    file_clean_df = file_clean_df[
-        ((file_clean_df.string) == 1 & (file_clean_df.fret == start_fret)) |
-        ((file_clean_df.string == 1) & (file_clean_df.fret == start_fret + 3)) |
-        ((file_clean_df.string == 2) & (file_clean_df.fret == start_fret)) |
-        ((file_clean_df.string == 2) & (file_clean_df.fret == start_fret + 2)) |
-        ((file_clean_df.string == 3) & (file_clean_df.fret == start_fret)) |
-        ((file_clean_df.string == 3) & (file_clean_df.fret == start_fret + 2)) |
-        ((file_clean_df.string == 4) & (file_clean_df.fret == start_fret)) |
-        ((file_clean_df.string == 4) & (file_clean_df.fret == start_fret + 2)) |
-        ((file_clean_df.string == 5) & (file_clean_df.fret == start_fret)) |
-        ((file_clean_df.string == 5) & (file_clean_df.fret == start_fret + 3)) |
-        ((file_clean_df.string == 6) & (file_clean_df.fret == start_fret)) |
-        ((file_clean_df.string == 6) & (file_clean_df.fret == start_fret + 3))
-    ]
-
-    file_effect_df = file_effect_df[
-        ((file_effect_df.string == 1) & (file_effect_df.fret == start_fret)) |
-        ((file_effect_df.string == 1) & (file_effect_df.fret == start_fret + 3)) |
-        ((file_effect_df.string == 2) & (file_effect_df.fret == start_fret)) |
-        ((file_effect_df.string == 2) & (file_effect_df.fret == start_fret + 2)) |
-        ((file_effect_df.string == 3) & (file_effect_df.fret == start_fret)) |
-        ((file_effect_df.string == 3) & (file_effect_df.fret == start_fret + 2)) |
-        ((file_effect_df.string == 4) & (file_effect_df.fret == start_fret)) |
-        ((file_effect_df.string == 4) & (file_effect_df.fret == start_fret + 2)) |
-        ((file_effect_df.string == 5) & (file_effect_df.fret == start_fret)) |
-        ((file_effect_df.string == 5) & (file_effect_df.fret == start_fret + 3)) |
-        ((file_effect_df.string == 6) & (file_effect_df.fret == start_fret)) |
-        ((file_effect_df.string == 6) & (file_effect_df.fret == start_fret + 3))
+    start_fret = rng.randint(0, 9)
+
+    # (string, fret) of every note in the scale
+    notes = [
+        (1, start_fret), (1, start_fret + 3),
+        (2, start_fret), (2, start_fret + 2),
+        (3, start_fret), (3, start_fret + 2),
+        (4, start_fret), (4, start_fret + 2),
+        (5, start_fret), (5, start_fret + 3),
+        (6, start_fret), (6, start_fret + 3),
     ]
+    pairs = sample_catalog.note_pairs(genre, notes, play_style=3, instrument=9)
 
-    return _create_random(clean_path, effect_path, file_clean_df, file_effect_df, srate, duration)
+    return _create_random(loader, pairs, rng)
 
 # Cleans up notes and changes their duration.
+@profiled("data.process_note")
 def process_note(note, note_length, srate):
     fade_length = (int) (srate * 0.1)
     fade_curve = np.linspace(1.0, 0.0, fade_length)
@@ -0,0 +1,363 @@
+import numpy as np
+import scipy.fft
+
+import functools, time
+
+import model_utils
+from profiling import profiled, stage
+
+# Metrics for scoring model output against the wet audio.
+#
+# segment_metrics scores every row of a (segments, samples) batch at once and
+# batch_metrics scores the batch as a whole, both in a single vectorized pass.
+# MetricAccumulator gives the same whole-signal numbers for audio that arrives
+# in chunks, such as long renders, keeping only a handful of running sums.
+#
+# All metrics match the ones in model_utils on the same audio: ESR, normalized
+# ESR and EN-MAE normalize by the highest sample, not the highest magnitude.
+# R2 is computed over all samples pooled together.
+#
+# SpectralEvaluator adds multi-resolution STFT distances, which follow what is
+# heard more closely than sample errors: spectral convergence and the L1
+# distance of log magnitudes, averaged over several FFT sizes, and their sum
+# (mr_stft). The STFTs of the reference audio are computed once per resolution
+# and kept, so ranking N models on the same wet_test costs one reference
+# transform plus one transform of every model's output.
+
+METRICS = ["esr", "normalized_esr", "mae", "r2", "en_mae"]
+
+SPECTRAL_METRICS = ["spectral_convergence", "log_magnitude_l1", "mr_stft"]
+
+# (n_fft, hop) pairs of the spectral metrics
+RESOLUTIONS = [(512, 128), (1024, 256), (2048, 512)]
+
+# Scores every segment of a batch separately.
+#
+# Input:
+#   true - np.array
+#       (segments, samples) target audio, or any array whose last axis is time.
+#   predicted - np.array
+#       Model output of the same shape.
+#
+# Output:
+#   metrics - dict
+#       One array per name in METRICS, with a value for every segment.
+@profiled("evaluation.segment_metrics")
+def segment_metrics(true, predicted):
+    return _metrics(true, predicted, axis=-1)
+
+# Scores a whole batch as one signal. Gives the same values as
+# model_utils.esr, normalized_esr and energy_normalized_mae on the batch.
+#
+# Output:
+#   metrics - dict
+#       One float per name in METRICS.
+@profiled("evaluation.batch_metrics")
+def batch_metrics(true, predicted):
+    return {name: float(value) for name, value in _metrics(true, predicted, axis=None).items()}
+
+# Running version of batch_metrics for audio scored chunk by chunk.
+#
+# EN-MAE divides by the peaks of the whole signals before taking differences,
+# so it can only be accumulated when both peaks are known up front. Without
+# them en_mae is reported as nan. Normalized ESR does not have that problem,
+# it is rebuilt from the running sums once the peaks are known.
+class MetricAccumulator:
+
+    # Input:
+    #   true_peak - Float - Default None
+    #       Highest sample of the whole target audio, for EN-MAE.
+    #   predicted_peak - Float - Default None
+    #       Highest sample of the whole model output, for EN-MAE.
+    def __init__(self, true_peak=None, predicted_peak=None):
+        self.true_peak = true_peak
+        self.predicted_peak = predicted_peak
+
+        self.count = 0
+        self.true_mean = 0.0
+        self.true_m2 = 0.0
+        self.sum_true_sq = 0.0
+        self.sum_pred_sq = 0.0
+        self.sum_cross = 0.0
+        self.sum_error_sq = 0.0
+        self.sum_abs_error = 0.0
+        self.sum_en_error = 0.0
+        self.true_max = -np.inf
+        self.pred_max = -np.inf
+
+    # Adds the next chunk of audio, chunks can have any shape and length.
+    def update(self, true, predicted):
+        true = np.asarray(true, dtype=np.float64).ravel()
+        predicted = np.asarray(predicted, dtype=np.float64).ravel()
+
+        if true.size == 0:
+            return
+
+        error = true - predicted
+
+        # Mean and spread of the target combined chunk by chunk (Chan et al.),
+        # which keeps R2 accurate over hours of audio
+        count = true.size
+        mean = true.mean()
+        m2 = np.sum(np.square(true - mean))
+        total = self.count + count
+        delta = mean - self.true_mean
+        self.true_m2 += m2 + delta * delta * self.count * count / total
+        self.true_mean += delta * count / total
+        self.count = total
+
+        self.sum_true_sq += np.dot(true, true)
+        self.sum_pred_sq += np.dot(predicted, predicted)
+        self.sum_cross += np.dot(true, predicted)
+        self.sum_error_sq += np.dot(error, error)
+        self.sum_abs_error += np.sum(np.abs(error))
+        self.true_max = max(self.true_max, true.max())
+        self.pred_max = max(self.pred_max, predicted.max())
+
+        if self.true_peak is not None and self.predicted_peak is not None:
+            self.sum_en_error += np.sum(np.abs(true / self.true_peak - predicted / self.predicted_peak))
+
+    # Metrics of everything added so far.
+    #
+    # Output:
+    #   metrics - dict
+    #       One float per name in METRICS.
+    def result(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            a, b = self.true_max, self.pred_max
+            normalized_error = self.sum_true_sq / (a * a) - 2 * self.sum_cross / (a * b) + self.sum_pred_sq / (b * b)
+
+            if self.true_peak is not None and self.predicted_peak is not None:
+                en_mae = self.sum_en_error / self.count
+            else:
+                en_mae = np.nan
+
+            return {
+                "esr": float(self.sum_error_sq / self.sum_true_sq),
+                "normalized_esr": float(normalized_error / (self.sum_true_sq / (a * a))),
+                "mae": float(self.sum_abs_error / self.count),
+                "r2": float(1.0 - self.sum_error_sq / self.true_m2),
+                "en_mae": float(en_mae),
+            }
+
+# Magnitude STFTs of a batch of segments, all computed in one FFT call.
+# Frames are centered and zero padded like librosa.stft, with a hann window.
+#
+# Input:
+#   segments - np.array
+#       (segments, samples) audio, or a single signal.
+#   n_fft - Integer
+#   hop - Integer
+#
+# Output:
+#   magnitude - np.array
+#       (segments, frames, n_fft // 2 + 1) float32 magnitudes.
+def stft_magnitude(segments, n_fft, hop):
+    segments = np.atleast_2d(np.asarray(segments, dtype=np.float32))
+    padded = np.pad(segments, ((0, 0), (n_fft // 2, n_fft // 2)))
+
+    frames = np.lib.stride_tricks.sliding_window_view(padded, n_fft, axis=-1)[:, ::hop]
+    spectrum = scipy.fft.rfft(frames * _window(n_fft), axis=-1, workers=-1)
+
+    return np.abs(spectrum).astype(np.float32)
+
+# Multi-resolution STFT distances to a fixed set of reference segments.
+#
+# Example:
+#   spectral = evaluation.SpectralEvaluator(wet_test)
+#   ranking = spectral.rank({"keras": keras_output, "int8": int8_output})
+class SpectralEvaluator:
+
+    # Input:
+    #   reference - np.array
+    #       (segments, samples) target audio, e.g. wet_test.
+    #   resolutions - List of (Integer, Integer) - Default RESOLUTIONS
+    #       (n_fft, hop) of every STFT.
+    #   batch_segments - Integer - Default 16
+    #       Segments transformed per FFT call, bounds the memory of a call.
+    def __init__(self, reference, resolutions=RESOLUTIONS, batch_segments=16):
+        self.reference = np.asarray(reference, dtype=np.float32)
+        self.resolutions = [tuple(resolution) for resolution in resolutions]
+        self.batch_segments = batch_segments
+
+        # Resolution -> reference magnitudes, log magnitudes and energy per segment
+        self._cache = {}
+        self._index = None
+
+    # The same evaluator restricted to some of the reference segments. The
+    # reference STFTs are shared, so they are still computed only once.
+    #
+    # Input:
+    #   index - np.array
+    #       Rows of the reference to keep, e.g. the chosen test segments.
+    def subset(self, index):
+        index = np.asarray(index)
+        if self._index is not None:
+            index = self._index[index]
+
+        subset = SpectralEvaluator.__new__(SpectralEvaluator)
+        subset.reference = self.reference
+        subset.resolutions = self.resolutions
+        subset.batch_segments = self.batch_segments
+        subset._cache = self._cache
+        subset._index = index
+        return subset
+
+    # Scores model output against the reference.
+    #
+    # Input:
+    #   predicted - np.array
+    #       (segments, samples) model output, one row per reference segment.
+    #
+    # Output:
+    #   overall - dict
+    #       One float per name in SPECTRAL_METRICS over all segments together.
+    #   per_segment - dict
+    #       One array per name in SPECTRAL_METRICS, with a value for every segment.
+    @profiled("evaluation.spectral_score")
+    def score(self, predicted):
+        predicted = np.asarray(predicted, dtype=np.float32)
+        index = np.arange(len(self.reference)) if self._index is None else self._index
+
+        if predicted.shape != (len(index), self.reference.shape[1]):
+            raise ValueError("Predicted audio of shape %s does not match the reference %s" %
+                             (predicted.shape, (len(index), self.reference.shape[1])))
+
+        overall = {"spectral_convergence": 0.0, "log_magnitude_l1": 0.0}
+        per_segment = {"spectral_convergence": np.zeros(len(index)), "log_magnitude_l1": np.zeros(len(index))}
+
+        for resolution in self.resolutions:
+            magnitude, log_magnitude, energy = self._reference_spectra(resolution)
+            error_sq = np.zeros(len(index))
+            log_error = np.zeros(len(index))
+
+            for start in range(0, len(index), self.batch_segments):
+                rows = index[start:start + self.batch_segments]
+
+                with stage("evaluation.stft"):
+                    predicted_magnitude = stft_magnitude(predicted[start:start + self.batch_segments], *resolution)
+
+                error_sq[start:start + len(rows)] = np.sum(np.square(magnitude[rows] - predicted_magnitude), axis=(1, 2))
+                log_error[start:start + len(rows)] = np.sum(np.abs(log_magnitude[rows] - _log(predicted_magnitude)), axis=(1, 2))
+
+            values = magnitude[0].size
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                per_segment["spectral_convergence"] += np.sqrt(error_sq / energy[index])
+                per_segment["log_magnitude_l1"] += log_error / values
+                overall["spectral_convergence"] += float(np.sqrt(np.sum(error_sq) / np.sum(energy[index])))
+                overall["log_magnitude_l1"] += float(np.sum(log_error) / (values * len(index)))
+
+        for metrics in [overall, per_segment]:
+            for name in ["spectral_convergence", "log_magnitude_l1"]:
+                metrics[name] /= len(self.resolutions)
+            metrics["mr_stft"] = metrics["spectral_convergence"] + metrics["log_magnitude_l1"]
+
+        return overall, per_segment
+
+    # Scores several models and sorts them from best to worst.
+    #
+    # Input:
+    #   predictions - dict
+    #       Name -> (segments, samples) output of a model.
+    #   metric - String - Default "mr_stft"
+    #       Name in SPECTRAL_METRICS to sort by, lower is better.
+    #
+    # Output:
+    #   ranking - List of (String, dict)
+    #       Name and overall scores of every model, best first.
+    def rank(self, predictions, metric="mr_stft"):
+        ranking = [(name, self.score(predicted)[0]) for name, predicted in predictions.items()]
+        return sorted(ranking, key=lambda item: item[1][metric])
+
+    # -------------------------------------------------------------------
+    # Helper functions below are designed to be used only in this class.
+
+    # STFTs of the whole reference at one resolution, computed on first use
+    def _reference_spectra(self, resolution):
+        if resolution not in self._cache:
+            with stage("evaluation.reference_stft"):
+                magnitude = np.concatenate([stft_magnitude(self.reference[start:start + self.batch_segments], *resolution)
+                                            for start in range(0, len(self.reference), self.batch_segments)])
+                energy = np.sum(np.square(magnitude, dtype=np.float64), axis=(1, 2))
+                self._cache[resolution] = (magnitude, _log(magnitude), energy)
+
+        return self._cache[resolution]
+
+# Predicts every test segment with a frame model and scores the output.
+#
+# Input:
+#   model
+#       Model with a predict(features, batch_size) method taking frames
+#       from model_utils.prepare_audio_seq, keras or numpy_lstm.
+#   dry_segments - np.array
+#       (segments, samples) clean test audio, e.g. dry_test.
+#   wet_segments - np.array
+#       Matching target audio, e.g. wet_test.
+#   frame - Integer
+#       Size of frame (in samples) the model expects.
+#   batch_size - Integer - Default 4096
+#   spectral - SpectralEvaluator - Default None
+#       Evaluator with wet_segments as its reference, adds the
+#       SPECTRAL_METRICS to the results.
+#
+# Output:
+#   overall - dict
+#       batch_metrics of all segments together.
+#   per_segment - dict
+#       segment_metrics of every segment.
+#   inference_time - Float
+#       Seconds spent predicting.
+def evaluate_model(model, dry_segments, wet_segments, frame, batch_size=4096, spectral=None):
+    predicted = np.empty(np.shape(wet_segments), dtype=np.float32)
+    inference_time = 0.0
+
+    for i in range(len(dry_segments)):
+        start = time.perf_counter()
+        to_predict = model_utils.prepare_audio_seq(dry_segments, i, frame=frame)
+        with stage("model.predict"):
+            predicted[i] = np.reshape(model.predict(to_predict, batch_size=batch_size), -1)
+        inference_time += time.perf_counter() - start
+
+    overall, per_segment = batch_metrics(wet_segments, predicted), segment_metrics(wet_segments, predicted)
+
+    if spectral is not None:
+        spectral_overall, spectral_per_segment = spectral.score(predicted)
+        overall.update(spectral_overall)
+        per_segment.update(spectral_per_segment)
+
+    return overall, per_segment, inference_time
+
+# -----------------------------------------------------------------------
+# Helper functions below are designed to be used only in this module.
+
+def _metrics(true, predicted, axis):
+    true = np.asarray(true, dtype=np.float64)
+    predicted = np.asarray(predicted, dtype=np.float64)
+    keep = axis is not None
+
+    error = true - predicted
+    sum_error_sq = np.sum(np.square(error), axis=axis)
+    sum_true_sq = np.sum(np.square(true), axis=axis)
+
+    true_norm = true / np.max(true, axis=axis, keepdims=keep)
+    pred_norm = predicted / np.max(predicted, axis=axis, keepdims=keep)
+    centered = true - np.mean(true, axis=axis, keepdims=keep)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "esr": sum_error_sq / sum_true_sq,
+            "normalized_esr": np.sum(np.square(true_norm - pred_norm), axis=axis) / np.sum(np.square(true_norm), axis=axis),
+            "mae": np.mean(np.abs(error), axis=axis),
+            "r2": 1.0 - sum_error_sq / np.sum(np.square(centered), axis=axis),
+            "en_mae": np.mean(np.abs(true_norm - pred_norm), axis=axis),
+        }
+
+# Periodic hann window, the same as scipy.signal.get_window("hann", n_fft)
+@functools.lru_cache(maxsize=8)
+def _window(n_fft):
+    return np.hanning(n_fft + 1)[:-1].astype(np.float32)
+
+# Log magnitude with a floor, so silent bins do not give -inf
+def _log(magnitude):
+    return np.log(np.maximum(magnitude, 1e-7))
@@ -0,0 +1,118 @@
+import numpy as np
+import scipy.fft
+
+import functools
+
+# FIR filtering for the dataset pipeline and model output.
+#
+# FIRFilter convolves audio with FIR taps by overlap-save: the audio is cut
+# into blocks, each block is multiplied with the filter spectrum in the
+# frequency domain, and the last len(taps) - 1 input samples are carried over
+# to the next block. Filter spectra are computed once per FFT size and cached.
+# Chunks can be fed one after another, so a whole corpus is filtered in one
+# pass with constant memory, and the result is the same as
+# scipy.signal.lfilter(taps, 1, audio) over the joined audio.
+#
+# Several filters in a list are applied in series by combining their taps
+# into one filter, so the cascade still costs a single pass.
+#
+# The notebooks' highpass and lowpass are available from notebook_filters.
+#
+# Example:
+#   import filters
+#   signal, wet = data.create_data("Metal", effect_data_path, file_data_path,
+#                                  filters=filters.notebook_filters())
+#   predicted = filters.filter_audio(predicted, filters.lowpass())
+
+class FIRFilter:
+
+    # Input:
+    #   taps - np.array or List of np.array
+    #       FIR taps, or several filters applied in series.
+    #   block_size - Integer - Default None
+    #       Output samples per FFT block, defaults to at least 16 times the
+    #       filter length.
+    def __init__(self, taps, block_size=None):
+        self.taps = combine_taps(taps)
+        self.overlap = len(self.taps) - 1
+
+        if block_size is None:
+            block_size = max(4096, 16 * len(self.taps))
+
+        self.n_fft = scipy.fft.next_fast_len(block_size + self.overlap, real=True)
+        self.block_size = self.n_fft - self.overlap
+        self._spectrum = _spectrum(self.taps.tobytes(), self.n_fft)
+        self._history = None
+
+    # Filters the next chunk of audio.
+    #
+    # Input:
+    #   chunk - np.array
+    #       Audio with time on the last axis. Every row of a (segments,
+    #       samples) array is an independent stream.
+    #
+    # Output:
+    #   filtered - np.array
+    #       float32, same shape as the chunk.
+    def process(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float32)
+
+        if self._history is None or self._history.shape[:-1] != chunk.shape[:-1]:
+            self._history = np.zeros(chunk.shape[:-1] + (self.overlap,), dtype=np.float32)
+
+        buffer = np.concatenate([self._history, chunk], axis=-1)
+        length = chunk.shape[-1]
+        filtered = np.empty_like(chunk)
+
+        for start in range(0, length, self.block_size):
+            end = min(start + self.block_size, length)
+            block = buffer[..., start:end + self.overlap]
+
+            spectrum = scipy.fft.rfft(block, n=self.n_fft, axis=-1) * self._spectrum
+            filtered[..., start:end] = scipy.fft.irfft(spectrum, n=self.n_fft, axis=-1)[..., self.overlap:self.overlap + end - start]
+
+        self._history = buffer[..., buffer.shape[-1] - self.overlap:].copy()
+        return filtered
+
+    # Clears the carried samples, call before starting a new stream.
+    def reset(self):
+        self._history = None
+
+# Filters a whole signal, or every row of a (segments, samples) array
+# separately, starting from silence.
+def filter_audio(audio, taps, block_size=None):
+    return FIRFilter(taps, block_size).process(audio)
+
+# Taps of several filters applied in series, as one filter.
+def combine_taps(taps):
+    if np.isscalar(taps[0]):
+        return np.asarray(taps, dtype=np.float64)
+
+    combined = np.ones(1)
+    for filter_taps in taps:
+        combined = np.convolve(combined, np.asarray(filter_taps, dtype=np.float64))
+
+    return combined
+
+# Highpass from the notebooks, emphasizes high frequency information.
+def highpass(numtaps=91, cutoff=0.015):
+    import scipy.signal
+    return scipy.signal.firwin(numtaps, cutoff, width=None, window='hamming', pass_zero='highpass')
+
+# Lowpass from the notebooks, avoids aliasing artifacts.
+def lowpass(numtaps=41, cutoff=0.92):
+    import scipy.signal
+    return scipy.signal.firwin(numtaps, cutoff, width=None, window='hamming', pass_zero='lowpass')
+
+# The highpass followed by the lowpass, as the notebooks apply them.
+def notebook_filters():
+    return [highpass(), lowpass()]
+
+# -----------------------------------------------------------------------
+# Helper functions below are designed to be used only in this module.
+
+# Spectrum of the taps for an FFT size, shared by every filter with the same taps
+@functools.lru_cache(maxsize=32)
+def _spectrum(taps_bytes, n_fft):
+    taps = np.frombuffer(taps_bytes, dtype=np.float64)
+    return scipy.fft.rfft(taps, n=n_fft).astype(np.complex64)
@@ -0,0 +1,348 @@
+import numpy as np
+import tensorflow as tf
+
+import argparse, os, time
+
+import data
+
+# GAN training for the effect models, moved out of gan_main_training.ipynb.
+#
+# The notebook loop fed one frame per train_step from Python slices and built
+# the generator and discriminator inputs with tf.concat on every step. Here the
+# audio is cut into frames in one vectorized step, shuffled and batched by a
+# prefetched tf.data pipeline, and every call of the XLA compiled training
+# function runs steps_per_call batches. The last batch of an epoch is padded to
+# the full batch size and masked out of the losses, so no frames are dropped
+# and the batch shape never changes.
+#
+# The generator takes the noise followed by a dry frame and returns the wet
+# frame, and the discriminator judges (wet, dry) pairs. The notebook trained
+# the generator on the wet frames and then applied it to dry ones, the roles
+# now match how apply_effect uses it.
+#
+# Example:
+#   python gan_training.py --genre Metal --epochs 25 --compare
+
+# Length of the noise vector given to the generator
+NOISE_DIM = 100
+
+# Registered so saved models holding it load with tf.keras.models.load_model
+@tf.keras.utils.register_keras_serializable(package="gan_training")
+class Generator(tf.keras.models.Model):
+
+    # Input:
+    #   frame - Integer
+    #       Samples generated per call.
+    def __init__(self, frame, **kwargs):
+        super(Generator, self).__init__(**kwargs)
+        self.frame = frame
+        self.dense1 = tf.keras.layers.Dense(256, activation='relu')
+        self.dense2 = tf.keras.layers.Dense(512, activation='relu')
+        self.dense3 = tf.keras.layers.Dense(frame, activation='tanh')
+
+    def call(self, inputs):
+        x = self.dense1(inputs)
+        x = self.dense2(x)
+        return self.dense3(x)
+
+    def get_config(self):
+        return {"name": self.name, "trainable": self.trainable, "frame": self.frame}
+
+@tf.keras.utils.register_keras_serializable(package="gan_training")
+class Discriminator(tf.keras.models.Model):
+    def __init__(self, **kwargs):
+        super(Discriminator, self).__init__(**kwargs)
+        self.dense1 = tf.keras.layers.Dense(512, activation='relu')
+        self.dense2 = tf.keras.layers.Dense(256, activation='relu')
+        self.dense3 = tf.keras.layers.Dense(1, activation='sigmoid')
+
+    def call(self, inputs):
+        x = self.dense1(inputs)
+        x = self.dense2(x)
+        return self.dense3(x)
+
+def generate_noise(batch_size, noise_dim=NOISE_DIM):
+    return tf.random.normal([batch_size, noise_dim])
+
+# Cuts audio into consecutive frames, zero padding the last one.
+#
+# Input:
+#   audio - np.array
+#       1D audio.
+#   frame - Integer
+#       Samples per frame.
+#   hop - Integer - Default None
+#       Samples between frame starts, defaults to frame (no overlap).
+#
+# Output:
+#   frames - np.array
+#       (frames, frame) float32, every sample of the audio is in a frame.
+def frame_audio(audio, frame, hop=None):
+    hop = hop or frame
+    audio = np.asarray(audio, dtype=np.float32)
+    count = max(1, -(-(len(audio) - frame) // hop) + 1)
+
+    padded = np.zeros((count - 1) * hop + frame, dtype=np.float32)
+    padded[:len(audio)] = audio
+
+    return np.lib.stride_tricks.sliding_window_view(padded, frame)[::hop]
+
+# Shuffled batches of (dry, wet, mask) for GANTrainer.
+#
+# Input:
+#   dry, wet - np.array
+#       Aligned 1D clean and effect audio, e.g. features_train and targets_train.
+#   frame - Integer
+#   batch_size - Integer
+#       Frames per training step.
+#   steps_per_call - Integer
+#       Batches stacked into each element.
+#   hop - Integer - Default None
+#       See frame_audio.
+#   seed - Integer - Default 0
+#
+# Output:
+#   dataset - tf.data.Dataset
+#       Elements of (steps, batch_size, frame) dry and wet frames and a
+#       (steps, batch_size) mask that is 0 for the padding in the last batch.
+#       The last element of an epoch can hold fewer steps.
+def training_dataset(dry, wet, frame, batch_size, steps_per_call, hop=None, seed=0):
+    dry_frames = frame_audio(dry, frame, hop)
+    wet_frames = frame_audio(wet, frame, hop)
+    count = len(dry_frames)
+
+    dataset = tf.data.Dataset.from_tensor_slices((dry_frames, wet_frames, np.ones(count, dtype=np.float32)))
+    dataset = dataset.shuffle(count, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+
+    # Pad the ragged last batch up to batch_size, its mask stays 0 for the padding
+    def pad(dry_batch, wet_batch, mask):
+        missing = batch_size - tf.shape(mask)[0]
+        return (tf.pad(dry_batch, [[0, missing], [0, 0]]), tf.pad(wet_batch, [[0, missing], [0, 0]]),
+                tf.pad(mask, [[0, missing]]))
+
+    dataset = dataset.map(pad, num_parallel_calls=tf.data.AUTOTUNE)
+    dataset = dataset.batch(steps_per_call)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+class GANTrainer:
+
+    # Input:
+    #   frame - Integer
+    #       Samples per frame, the generator output size.
+    #   noise_dim - Integer - Default NOISE_DIM
+    #   learning_rate - Float - Default 1e-4
+    #   steps_per_call - Integer - Default 16
+    #       Training steps run inside each compiled call.
+    #   jit_compile - Boolean - Default True
+    #       Compile the training steps with XLA.
+    def __init__(self, frame, noise_dim=NOISE_DIM, learning_rate=1e-4, steps_per_call=16, jit_compile=True):
+        self.frame = frame
+        self.noise_dim = noise_dim
+        self.steps_per_call = steps_per_call
+
+        self.generator = Generator(frame)
+        self.discriminator = Discriminator()
+        self.generator(tf.zeros((1, noise_dim + frame)))
+        self.discriminator(tf.zeros((1, 2 * frame)))
+
+        self.generator_optimizer = tf.keras.optimizers.Adam(learning_rate)
+        self.discriminator_optimizer = tf.keras.optimizers.Adam(learning_rate)
+        self.generator_optimizer.build(self.generator.trainable_variables)
+        self.discriminator_optimizer.build(self.discriminator.trainable_variables)
+
+        self._train_steps = tf.function(self._steps, jit_compile=jit_compile)
+
+    # Trains on aligned dry and wet audio.
+    #
+    # Input:
+    #   dry, wet - np.array
+    #       1D clean and effect audio, e.g. features_train and targets_train.
+    #   epochs - Integer
+    #   batch_size - Integer - Default 64
+    #       Frames per training step. The notebook loop used 1.
+    #   hop - Integer - Default None
+    #       See frame_audio, a hop below frame gives overlapping frames.
+    #   seed - Integer - Default 0
+    #   verbose - Boolean - Default True
+    #
+    # Output:
+    #   history - dict
+    #       Per epoch generator_loss, discriminator_loss and seconds.
+    def train(self, dry, wet, epochs, batch_size=64, hop=None, seed=0, verbose=True):
+        dataset = training_dataset(dry, wet, self.frame, batch_size, self.steps_per_call, hop, seed)
+        history = {"generator_loss": [], "discriminator_loss": [], "seconds": []}
+
+        for epoch in range(epochs):
+            start = time.perf_counter()
+            losses = [self._train_steps(*element) for element in dataset]
+            gen_loss, disc_loss = (float(loss) for loss in losses[-1])
+            seconds = time.perf_counter() - start
+
+            history["generator_loss"].append(gen_loss)
+            history["discriminator_loss"].append(disc_loss)
+            history["seconds"].append(seconds)
+
+            if verbose:
+                print('Time for epoch %d is %.4f sec, generator loss %.4f, discriminator loss %.4f' % (
+                    epoch + 1, seconds, gen_loss, disc_loss))
+
+        return history
+
+    # -------------------------------------------------------------------
+    # Helper functions below are designed to be used only in this class.
+
+    # Runs one training step for every batch of a dataset element and returns
+    # the losses of the last one
+    def _steps(self, dry, wet, mask):
+        gen_loss = disc_loss = tf.constant(0.0)
+
+        for step in tf.range(tf.shape(dry)[0]):
+            gen_loss, disc_loss = self._step(dry[step], wet[step], mask[step])
+
+        return gen_loss, disc_loss
+
+    def _step(self, dry, wet, mask):
+        noise = generate_noise(tf.shape(dry)[0], self.noise_dim)
+
+        with tf.GradientTape() as gen_tape, tf.GradientTape() as disc_tape:
+            generated = self.generator(tf.concat([noise, dry], axis=1), training=True)
+
+            real_output = self.discriminator(tf.concat([wet, dry], axis=1), training=True)
+            fake_output = self.discriminator(tf.concat([generated, dry], axis=1), training=True)
+
+            gen_loss = _masked_cross_entropy(tf.ones_like(fake_output), fake_output, mask)
+            disc_loss_real = _masked_cross_entropy(tf.ones_like(real_output), real_output, mask)
+            disc_loss_fake = _masked_cross_entropy(tf.zeros_like(fake_output), fake_output, mask)
+            disc_loss = disc_loss_real + disc_loss_fake
+
+        gradients_of_generator = gen_tape.gradient(gen_loss, self.generator.trainable_variables)
+        gradients_of_discriminator = disc_tape.gradient(disc_loss, self.discriminator.trainable_variables)
+
+        self.generator_optimizer.apply_gradients(zip(gradients_of_generator, self.generator.trainable_variables))
+        self.discriminator_optimizer.apply_gradients(zip(gradients_of_discriminator, self.discriminator.trainable_variables))
+
+        return gen_loss, disc_loss
+
+# Applies a trained generator to audio.
+#
+# Input:
+#   generator - Generator
+#   audio - np.array
+#       1D dry audio of any length.
+#   frame - Integer
+#       Samples per frame the generator was trained with.
+#   noise - np.array - Default None
+#       Noise vector used for every frame, a new one is drawn when None.
+#   batch_size - Integer - Default 4096
+#       Frames per generator call.
+#
+# Output:
+#   generated - np.array
+#       One output sample per input sample, the tail is not dropped.
+def apply_effect(generator, audio, frame, noise=None, batch_size=4096):
+    frames = frame_audio(audio, frame)
+
+    if noise is None:
+        noise = generate_noise(1).numpy()
+    noise = np.repeat(np.asarray(noise, dtype=np.float32).reshape(1, -1), len(frames), axis=0)
+
+    inputs = np.concatenate([noise, frames], axis=1)
+    generated = np.concatenate([generator(inputs[i:i + batch_size], training=False).numpy()
+                                for i in range(0, len(inputs), batch_size)])
+
+    return generated.reshape(-1)[:len(audio)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the GAN effect model and report epochs per minute.")
+    parser.add_argument("--genre", default="Metal")
+    parser.add_argument("--effect-data", default=os.path.join("dataset", "effectData.csv"))
+    parser.add_argument("--file-data", default=os.path.join("dataset", "fileData.csv"))
+    parser.add_argument("--sr", type=int, default=22050)
+    parser.add_argument("--duration", type=int, default=30)
+    parser.add_argument("--frame", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=64, help="Frames per training step")
+    parser.add_argument("--steps-per-call", type=int, default=16)
+    parser.add_argument("--epochs", type=int, default=25)
+    parser.add_argument("--test-ratio", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", action="store_true", help="Also time one epoch of the notebook training loop")
+    parser.add_argument("--save", help="Save the trained generator, e.g. dataset/models/Metal_generator.keras")
+    args = parser.parse_args()
+
+    signal, wet = data.create_data(args.genre, args.effect_data, args.file_data, mu_comp=False, srate=args.sr,
+                                   duration=args.duration, type="random", seed=args.seed)
+
+    # Same split as the notebook
+    train_length = int(len(signal) * (1 - args.test_ratio))
+    features_train, features_test = signal[:train_length], signal[train_length:]
+    targets_train, targets_test = wet[:train_length], wet[train_length:]
+
+    trainer = GANTrainer(args.frame, steps_per_call=args.steps_per_call)
+    history = trainer.train(features_train, targets_train, args.epochs, args.batch_size, seed=args.seed)
+
+    # The first epoch includes compiling
+    seconds = np.median(history["seconds"][1:] or history["seconds"])
+    print("Compiled pipeline: {:.3f} s per epoch, {:.1f} epochs per minute".format(seconds, 60 / seconds))
+
+    predicted = apply_effect(trainer.generator, features_test, args.frame)
+    print("Test MAE {:.4f} on {} samples".format(np.mean(np.abs(predicted - targets_test)), len(predicted)))
+
+    if args.compare:
+        notebook_seconds = _notebook_epoch(GANTrainer(args.frame), features_train, targets_train, args.frame)
+        print("Notebook loop: {:.3f} s per epoch, {:.2f} epochs per minute ({:.0f}x slower)".format(
+            notebook_seconds, 60 / notebook_seconds, notebook_seconds / seconds))
+
+    if args.save:
+        trainer.generator.save(args.save)
+
+# -----------------------------------------------------------------------
+# Helper functions below are designed to be used only in this module.
+
+# Cross entropy averaged over the rows the mask keeps. The discriminator ends
+# in a sigmoid but is scored from logits, as in the notebook.
+def _masked_cross_entropy(labels, logits, mask):
+    losses = tf.keras.losses.binary_crossentropy(labels, logits, from_logits=True)
+    return tf.reduce_sum(losses * mask) / tf.maximum(tf.reduce_sum(mask), 1.0)
+
+# Times one epoch of the training loop from gan_main_training.ipynb, one
+# frame per step sliced and concatenated in Python
+def _notebook_epoch(trainer, dry, wet, frame):
+    generator, discriminator = trainer.generator, trainer.discriminator
+    generator_optimizer, discriminator_optimizer = trainer.generator_optimizer, trainer.discriminator_optimizer
+    cross_entropy = tf.keras.losses.BinaryCrossentropy(from_logits=True)
+
+    @tf.function
+    def train_step(audio, effects):
+        noise = generate_noise(tf.shape(audio)[0])
+
+        with tf.GradientTape() as gen_tape, tf.GradientTape() as disc_tape:
+            generated_audio = generator(tf.concat([noise, effects], axis=1), training=True)
+
+            real_output = discriminator(tf.concat([audio, effects], axis=1), training=True)
+            fake_output = discriminator(tf.concat([generated_audio, effects], axis=1), training=True)
+
+            gen_loss = cross_entropy(tf.ones_like(fake_output), fake_output)
+            disc_loss = (cross_entropy(tf.ones_like(real_output), real_output) +
+                         cross_entropy(tf.zeros_like(fake_output), fake_output))
+
+        gradients_of_generator = gen_tape.gradient(gen_loss, generator.trainable_variables)
+        gradients_of_discriminator = disc_tape.gradient(disc_loss, discriminator.trainable_variables)
+
+        generator_optimizer.apply_gradients(zip(gradients_of_generator, generator.trainable_variables))
+        discriminator_optimizer.apply_gradients(zip(gradients_of_discriminator, discriminator.trainable_variables))
+
+        return gen_loss, disc_loss
+
+    # Trace outside the timing
+    train_step([dry[:frame]], [wet[:frame]])
+
+    start = time.perf_counter()
+    for i in range(0, len(dry), frame):
+        if dry[i:i + frame].size == frame and wet[i:i + frame].size == frame:
+            train_step([dry[i:i + frame]], [wet[i:i + frame]])
+
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import numpy as np
+import tensorflow as tf
+
+import model_utils
+
+# Streaming training input for the LSTM models.
+#
+# Instead of materializing every training frame up front like
+# model_utils.create_dataset, the dataset below reads the frames of each batch
+# from the dry and wet segments as it is requested. The segments are never
+# copied, so they can be memory mapped, e.g. a shard from shards.load_shard cut
+# with model_utils.segment_audio, and hours of audio train with only the
+# batches being prepared in memory. Offsets are drawn from a generator seeded
+# with (seed, step), so a given seed always produces the same batches no matter
+# how many batches are prepared in parallel.
+
+# Builds an endless tf.data.Dataset of (features, targets) batches.
+#
+# Input:
+#   dry_segments - np.array
+#       (segments, samples) clean audio, for example dry_train from
+#       model_utils.split_segments, or a memory mapped shard. int8 mu's law
+#       codes are kept as they are and only cast to float32 batch by batch.
+#   wet_segments - np.array
+#       Matching (segments, samples) audio with applied effect.
+#   frame - Integer
+#       Size of frame (in samples) fed to the model.
+#   batch_size - Integer
+#       Number of frames in each batch.
+#   sequential - Boolean - Default False
+#       Take consecutive frames through the segments instead of random ones.
+#   seed - Integer - Default 0
+#       Seed for the frame offsets.
+#   segments - np.array - Default None
+#       Indices of the segments to draw frames from, e.g. the training part of
+#       a shard. Defaults to every segment.
+#
+# Output:
+#   dataset - tf.data.Dataset
+#       Yields (batch_size, frame) features and (batch_size,) targets, the same
+#       layout as create_dataset. Use with steps_per_epoch in model.fit.
+def streaming_dataset(dry_segments, wet_segments, frame, batch_size, sequential=False, seed=0, segments=None):
+    segment_size = dry_segments.shape[1]
+    windows_per_segment = segment_size - frame - 1
+
+    if segments is None:
+        segments = np.arange(len(dry_segments))
+    segments = np.asarray(segments, dtype=np.int64)
+
+    # Sequential mode walks all windows in order, starting at a seeded offset
+    total_windows = len(segments) * windows_per_segment
+    start_window = int(np.random.default_rng(seed).integers(0, total_windows))
+
+    def read_batch(step):
+        if sequential:
+            window = (start_window + int(step) * batch_size + np.arange(batch_size)) % total_windows
+            segment_index = segments[window // windows_per_segment]
+            starts = window % windows_per_segment
+        else:
+            rng = np.random.default_rng([seed, int(step)])
+            segment_index = segments[rng.integers(0, len(segments), batch_size)]
+            starts = rng.integers(0, windows_per_segment, batch_size)
+
+        # Only the frames of this batch are read from the segments
+        return model_utils.gather_frames(dry_segments, wet_segments, frame, segment_index, starts)
+
+    def make_batch(step):
+        features, targets = tf.numpy_function(read_batch, [step], [tf.float32, tf.float32])
+        features.set_shape((batch_size, frame))
+        targets.set_shape((batch_size,))
+        return features, targets
+
+    dataset = tf.data.Dataset.counter()
+    dataset = dataset.map(make_batch, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+# Number of batches per epoch so that an epoch covers as many frames as
+# the notebooks' create_dataset call (one frame per frame-long stretch of audio).
+# With segments given, only those segments are counted.
+def steps_per_epoch(dry_segments, frame, batch_size, segments=None):
+    count = len(dry_segments) if segments is None else len(segments)
+    return max(1, int(count * dry_segments.shape[1] / frame / batch_size))
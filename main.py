@@ -1,8 +1,11 @@
 import xml.sax
 import glob 
 import os
+import json
+import argparse
 import pandas as pd
-from XMLtest import FileHandler
+from concurrent.futures import ProcessPoolExecutor
+from xmlHandler import FileHandler
 import xml.etree.ElementTree as ET
 
 """
@@ -42,6 +45,14 @@ effect_table_creation: This function uses xml.etree to help us extract the exact
            Parameters: path, path to the given file
 """
 def effect_table_creation(path):
+    create_csv(effect_parse_xml(path), "effectData.csv")
+"""
+effect_parse_xml: Extracts the effect data from a single xml file, as used by
+                  effect_table_creation
+      Parameters: path, path to the given file
+          return: Dictionary with the effect data of the file
+"""
+def effect_parse_xml(path):
     tree = ET.parse(path)
     root = tree.getroot()
     effectDict = {'fxName':[], 'fxNameID':[], 'fxType':[], 'fxTypeID':[], 'fxSetting':[],
@@ -116,7 +127,7 @@ def effect_table_creation(path):
             
         effectDict['genre'].append(genre)
             
-    create_csv(effectDict, "effectData.csv")
+    return effectDict
 """
 effect_xml_files: Main function is to produce a list of the first 3 files in each
                   Genre folder, this is done because the first 3 files contain all
@@ -136,22 +147,80 @@ def effect_xml_file(root):
         
     return fnameList
         
+"""
+build_index: Creates a CSV from the data of many xml files. Files are parsed in
+             a process pool and the CSV is written in one go. The parsed data
+             and modification time of each file is kept in a .index.json file
+             next to the CSV, so later runs only parse files that changed and
+             rerunning never duplicates rows.
+ Parameters: paths, list of xml files to include
+             parse, function turning one xml file into a dictionary of columns
+             csvName, name of the CSV file to write
+             workers, number of processes, None uses every core
+     return: Number of files that had to be parsed
+"""
+def build_index(paths, parse, csvName, workers=None):
+    state_filename = csvName + ".index.json"
+    state = {}
+
+    if os.path.exists(state_filename):
+        with open(state_filename) as f:
+            state = json.load(f)
+
+    # Drop files that no longer exist, parse the new and changed ones
+    paths = sorted(paths)
+    stamps = {path: file_stamp(path) for path in paths}
+    state = {path: entry for path, entry in state.items() if path in stamps}
+    changed = [path for path in paths if path not in state or state[path]["stamp"] != stamps[path]]
+
+    if changed:
+        with ProcessPoolExecutor(workers) as pool:
+            for path, data in zip(changed, pool.map(parse, changed, chunksize=16)):
+                state[path] = {"stamp": stamps[path], "data": data}
+
+    frames = [pd.DataFrame(state[path]["data"]) for path in paths]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    # Write through temporary files so an interrupted run leaves the old files intact
+    df.to_csv(csvName + ".tmp", index=False)
+    with open(state_filename + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(csvName + ".tmp", csvName)
+    os.replace(state_filename + ".tmp", state_filename)
+
+    return len(changed)
+"""
+file_stamp: Modification time and size of a file, used to detect changes
+ Parameters: path, path to the file
+     return: List of modification time in nanoseconds and size in bytes
+"""
+def file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+        
 def main():
-    root = "dataset/monophonic/Lists"
-    fnames = glob.glob(f"{root}/*/*.xml")
-    path = ""
+    parser = argparse.ArgumentParser(description="Index the IDMT-SMT dataset into fileData.csv and effectData.csv")
+    parser.add_argument("--poly", action="store_true", help="Also index dataset/polyphonic/Lists")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    roots = ["dataset/monophonic/Lists"]
+    if args.poly:
+        roots.append("dataset/polyphonic/Lists")
+
+    fnames = []
+    fnameList = []
+    for root in roots:
+        fnames.extend(glob.glob(f"{root}/*/*.xml"))
+        fnameList.extend(effect_xml_file(root))
     
     # Collect the data for all the files in IDMT-SMT dataset
-    for file in fnames:
-        path = file
-        fileData = file_parse_xml(path)
-        create_csv(fileData, "fileData.csv") 
-        
-    fnameList = effect_xml_file(root)
+    parsed = build_index(fnames, file_parse_xml, "fileData.csv", args.workers)
+    print("fileData.csv: parsed %d of %d xml files" % (parsed, len(fnames)))
     
     # Collect the data for all the effects in IDMT-SMT dataset
-    for filePath in fnameList:
-        effect_table_creation(filePath)
+    parsed = build_index(fnameList, effect_parse_xml, "effectData.csv", args.workers)
+    print("effectData.csv: parsed %d of %d xml files" % (parsed, len(fnameList)))
         
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,62 +1,24 @@
-import matplotlib.pyplot as plt
 import numpy as np
-import librosa
-from sklearn import metrics
-from sklearn.model_selection import train_test_split
+from numpy.lib.stride_tricks import sliding_window_view
 
 import random
 
+from filters import filter_audio
+from profiling import profiled, stage
+
 # Code based on GuitarLSTM by Keith Bloemer:
 # https://github.com/GuitarML/GuitarLSTM
-
-# Plotting Functions
-
-def plot_waveform(s, title):
-    plt.figure(figsize=(14, 3))
-    plt.plot(s)
-    plt.title(title)
-    plt.show()
-
-# Simple function to plot three waveforms for comparing
-def compare_waveforms(original, predicted, true_output, title, start, stop):
-    plt.figure(figsize=(16,6))
-    plt.plot(original[start:stop])
-    plt.plot(predicted[start:stop])
-    plt.plot(true_output[start:stop])
-    plt.legend(['original', 'predicted', 'true output'])
-    plt.title(title)
-    plt.show()
-
-# Viewing spectrograms set to showing hz with no mel or log scale, to inspect high frequencies.
-def plot_spectrogram_hz(s,sr,title, style):
-    D = librosa.stft(s)
-    DdB = librosa.amplitude_to_db(abs(D))
-    plt.figure(figsize=(14, 6))
-    librosa.display.specshow(DdB[0:1800], sr=sr, x_axis='time', y_axis=style)
-    plt.title(title)
-    plt.show()
-
-# Plots prediction results to compare with input
-def plot_result(trainY, testY, train_predict, test_predict):
-    actual = np.append(trainY, testY)
-    predictions = np.append(train_predict, test_predict)
-    rows = len(actual)
-    plt.figure(figsize=(15, 6), dpi=80)
-    plt.plot(range(rows), actual, alpha=0.3, color='blue')
-    plt.plot(range(rows), predictions, alpha=0.3, color='green')
-    plt.axvline(x=len(trainY), color='r')
-    plt.legend(['Actual', 'Predictions'])
-    plt.xlabel('Time in samples')
-    plt.ylabel('')
-    plt.title('Actual and Predicted Values. The Red Line Separates The Training And Test Examples')
-    plt.show()
+#
+# Nothing here imports matplotlib, librosa or sklearn when the module is
+# loaded, so headless dataset and render workers start quickly. The plotting
+# functions are in plotting.py.
 
 # Metrics Functions
 
 def energy_normalized_mae(true, predicted):
     y_true = true / np.max(true)
     y_pred = predicted / np.max(predicted)
-    return metrics.mean_absolute_error(y_true, y_pred)
+    return np.mean(np.abs(y_true - y_pred))
 
 def esr(true, predicted):
     return np.sum(np.square(np.abs(true-predicted))) / np.sum(np.square(np.abs(true)))
@@ -69,143 +31,223 @@ def normalized_esr(true, predicted):
 
 # Data Segmentation Functions
 
-# Change data to format expected by the model
-# Non-sequential version
-def create_dataset(input_file, output_file, size_training, size_test, frame, sr, test_ratio):
-    signal = input_file
-    wet = output_file
-    
-    # Creating the foundation of the dataset by splitting the whole audio into 5 seconds segments
+# Splits audio into consecutive segments of segment_size samples.
+# Returns a (segments, segment_size) view of the audio, dropping the incomplete tail.
+# A dtype of None keeps the audio's own type, e.g. int8 mu's law codes.
+def segment_audio(audio, segment_size, dtype=np.float32):
+    audio = np.asarray(audio, dtype=dtype)
+    count = audio.size // segment_size
+    return audio[:count * segment_size].reshape(count, segment_size)
+
+# View of every frame-long window in each segment, shape (segments, windows, frame).
+# Nothing is copied, window i of a segment starts at sample i of that segment.
+def frame_segments(segments, frame):
+    return sliding_window_view(segments, frame, axis=-1)
+
+# Draws random (segment, window start) pairs for size frames.
+def random_frame_indices(segment_count, segment_size, frame, size, rng):
+    segment_index = rng.integers(0, segment_count, size)
+    starts = rng.integers(0, segment_size - frame - 1, size)
+    return segment_index, starts
+
+# Picks frames_per_segment consecutive window starts from a random offset in every segment.
+def sequential_frame_indices(segment_count, segment_size, frame, frames_per_segment, rng):
+    frames_per_segment = max(0, min(frames_per_segment, segment_size - 2 * frame))
+    offsets = rng.integers(0, segment_size - frames_per_segment - 2 * frame + 1, segment_count)
+
+    segment_index = np.repeat(np.arange(segment_count), frames_per_segment)
+    starts = (offsets[:, None] + frame + np.arange(frames_per_segment)).ravel()
+    return segment_index, starts
+
+# Copies the selected frames out of the segments, this is the only place frames
+# are materialized so callers can do it one batch at a time.
+# Each target is the wet sample aligned with the last sample of its frame.
+def gather_frames(dry_segments, wet_segments, frame, segment_index, starts, dtype=np.float32):
+    with stage("model_utils.gather_frames") as s:
+        windows = frame_segments(dry_segments, frame)
+        features = np.asarray(windows[segment_index, starts], dtype=dtype)
+        targets = np.asarray(wet_segments[segment_index, starts + frame - 1], dtype=dtype)
+        s.add_array(features)
+        s.add_array(targets)
+        return features, targets
+
+# Splits the audio into 5 second segments, then into training and testing segments
+# output_file can also be a list of wet signals, one per genre, which are
+# stacked on a last axis: (segments, samples, genres).
+@profiled("model_utils.split_segments")
+def split_segments(input_file, output_file, sr, test_ratio, dtype=np.float32):
     segment_size = sr * 5
-    dry_segments = np.zeros((int(signal.size/segment_size), segment_size))
-    wet_segments = np.zeros((int(signal.size/segment_size), segment_size))
-    counter = 0
-
-    for i in range(0, signal.size-segment_size-1, segment_size):          
-        dry_segment = signal[i:i+segment_size]
-        wet_segment = wet[i:i+segment_size]
-        dry_segments[counter,:], wet_segments[counter,:] = dry_segment, wet_segment
-        counter+= 1
+    dry_segments = segment_audio(input_file, segment_size, dtype)
 
-    if test_ratio != 1.0:
-        # Splitting the segments into the training and testing set
-        dry_train, dry_test, wet_train, wet_test = train_test_split(dry_segments, wet_segments, test_size=test_ratio, random_state=5)
+    if isinstance(output_file, list):
+        wet_segments = np.stack([segment_audio(wet, segment_size, dtype) for wet in output_file], axis=-1)
     else:
-        dry_test = dry_segments
-        wet_test = wet_segments
+        wet_segments = segment_audio(output_file, segment_size, dtype)
 
-    # Creating the training set (randomly pulling frames and target value from all segments in train set)
-    features_train = np.zeros((size_training, frame))
-    targets_train = np.zeros((size_training))
-    counter = 0
+    if test_ratio != 1.0:
+        from sklearn.model_selection import train_test_split
+        return train_test_split(dry_segments, wet_segments, test_size=test_ratio, random_state=5)
+
+    empty = dry_segments[:0]
+    return empty, dry_segments, empty, wet_segments
+
+# Random generator for the dataset functions, seeded from the random module
+# unless a seed is given so random.seed keeps results reproducible.
+def _rng(seed):
+    if seed is None:
+        seed = random.getrandbits(64)
+    return np.random.default_rng(seed)
+
+# Filters the dry and wet audio when filters are given, output_file can be a
+# list of wet signals
+def _apply_filters(input_file, output_file, filters):
+    if filters is None:
+        return input_file, output_file
+
+    with stage("model_utils.filter"):
+        if isinstance(output_file, list):
+            return filter_audio(input_file, filters), [filter_audio(wet, filters) for wet in output_file]
+        return filter_audio(input_file, filters), filter_audio(output_file, filters)
 
-    for i in range(size_training):
-        random_index = random.randint(0,dry_train.shape[0]-1)
-        dry_slice = dry_train[random_index]
-        wet_slice = wet_train[random_index]
-        random_start = random.randint(0,segment_size-frame-2)
-        features = dry_slice[random_start:random_start+frame]
-        target = wet_slice[random_start+frame-1]
+# Change data to format expected by the model
+# Non-sequential version
+# Segments, features and targets are float32. With dtype=None they keep the
+# type of the input audio instead, so int8 codes from data.create_data(...,
+# compact=True) stay int8 and are only converted to float by the model itself.
+# filters are FIR taps (or a list of them, see filters.py) applied to both
+# files before segmenting, e.g. filters.notebook_filters().
+# output_file can also be a list of wet signals, see create_multi_genre_dataset.
+@profiled("model_utils.create_dataset")
+def create_dataset(input_file, output_file, size_training, size_test, frame, sr, test_ratio, seed=None, dtype=np.float32, filters=None):
+    rng = _rng(seed)
+    input_file, output_file = _apply_filters(input_file, output_file, filters)
+    dry_train, dry_test, wet_train, wet_test = split_segments(input_file, output_file, sr, test_ratio, dtype)
+    segment_size = sr * 5
 
-        features_train[counter,:], targets_train[counter] = features, target
-        counter += 1
+    # Creating the training set (randomly pulling frames and target value from all segments in train set)
+    if size_training > 0:
+        indices = random_frame_indices(dry_train.shape[0], segment_size, frame, size_training, rng)
+    else:
+        indices = (np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+    features_train, targets_train = gather_frames(dry_train, wet_train, frame, *indices, dtype)
 
     # Creating the testing set (randomly puling frames and target value from segments in test set)
-    features_test = np.zeros((size_test, frame))
-    targets_test = np.zeros((size_test))
-    counter = 0
-
-    for i in range(size_test):
-        random_index = random.randint(0,dry_test.shape[0]-1)
-        dry_slice = dry_test[random_index]
-        wet_slice = wet_test[random_index]
-        random_start = random.randint(0,segment_size-frame-2)
-        features = dry_slice[random_start:random_start+frame]
-        target = wet_slice[random_start+frame-1]
-
-        features_test[counter,:], targets_test[counter] = features, target
-        counter += 1
+    indices = random_frame_indices(dry_test.shape[0], segment_size, frame, size_test, rng)
+    features_test, targets_test = gather_frames(dry_test, wet_test, frame, *indices, dtype)
 
     return dry_test, wet_test, features_train, features_test, targets_train, targets_test
 
 # Change data to format expected by the model
-# Sequential version
-def create_sequential_dataset(input_file, output_file, size_training, size_test, frame, sr): 
-    signal = input_file
-    wet = output_file
-    
-    # Creating the foundation of the dataset by splitting the whole audio into 5 seconds segments
+# Sequential version, dtype and filters work as in create_dataset
+# The notebook splits 80/20, test_ratio changes that.
+@profiled("model_utils.create_sequential_dataset")
+def create_sequential_dataset(input_file, output_file, size_training, size_test, frame, sr, seed=None, dtype=np.float32, filters=None, test_ratio=0.2):
+    rng = _rng(seed)
+    input_file, output_file = _apply_filters(input_file, output_file, filters)
+    dry_train, dry_test, wet_train, wet_test = split_segments(input_file, output_file, sr, test_ratio, dtype)
     segment_size = sr * 5
-    dry_segments = np.zeros((int(signal.size/segment_size), segment_size))
-    wet_segments = np.zeros((int(signal.size/segment_size), segment_size))
-    counter = 0
-
-    for i in range(0, signal.size-segment_size-1, segment_size):
-                
-        dry_segment = signal[i:i+segment_size]
-        
-        wet_segment = wet[i:i+segment_size]
-
-        dry_segments[counter,:], wet_segments[counter,:] = dry_segment, wet_segment
-        counter+= 1
-
-    # Splitting the segments into the training and testing set
-    dry_train, dry_test, wet_train, wet_test = train_test_split(dry_segments, wet_segments, test_size=0.2, random_state=5)
 
     # Creating the training set (pulling frames in sequence from training and testing segments)
     train_frames_pr_segment = int(size_training / dry_train.shape[0])
     test_frames_pr_segment = int(size_test / dry_test.shape[0])
 
-    features_train = np.zeros((size_training, frame))
-    targets_train = np.zeros((size_training))
-    counter = 0
+    indices = sequential_frame_indices(dry_train.shape[0], segment_size, frame, train_frames_pr_segment, rng)
+    features_train, targets_train = gather_frames(dry_train, wet_train, frame, *indices, dtype)
 
-    for i in range(0,dry_train.shape[0]):
-        dry_segment = dry_train[i]
-        wet_segment = wet_train[i]
-        random_start = random.randint(0,dry_segment.size-train_frames_pr_segment-frame-1)
+    # Creating the testing set (sequentiually pulling frames and target value from segments in test set)
+    indices = sequential_frame_indices(dry_test.shape[0], segment_size, frame, test_frames_pr_segment, rng)
+    features_test, targets_test = gather_frames(dry_test, wet_test, frame, *indices, dtype)
 
-        for x in range(0+frame, train_frames_pr_segment+frame-2):
-            start_point = x + random_start      
-            features = dry_segment[start_point:start_point+frame]
-            target = wet_segment[start_point+frame-1]
-            
-            features_train[counter,:], targets_train[counter] = features, target
-            counter+= 1
+    return dry_test, wet_test, features_train, features_test, targets_train, targets_test
+
+# Change data to format expected by the model
+# Multi-genre version of create_dataset, for data.create_multi_genre_data.
+# output_files is a list of wet signals, one per genre. The frames are picked
+# once from the shared clean audio, wet_test is (segments, samples, genres)
+# and the targets are (frames, genres), one column per genre.
+@profiled("model_utils.create_multi_genre_dataset")
+def create_multi_genre_dataset(input_file, output_files, size_training, size_test, frame, sr, test_ratio, seed=None, dtype=np.float32, filters=None):
+    return create_dataset(input_file, list(output_files), size_training, size_test, frame, sr, test_ratio, seed, dtype, filters)
+
+# Copies the selected sequences out of the segments. Features and targets are
+# both (sequences, length, 1), the wet audio at every sample of the sequence.
+def gather_sequences(dry_segments, wet_segments, length, segment_index, starts, dtype=np.float32):
+    with stage("model_utils.gather_sequences") as s:
+        features = np.asarray(frame_segments(dry_segments, length)[segment_index, starts], dtype=dtype)
+        targets = np.asarray(frame_segments(wet_segments, length)[segment_index, starts], dtype=dtype)
+        s.add_array(features)
+        s.add_array(targets)
+        return features[..., None], targets[..., None]
+
+# Weights for training on sequences, 0 for the warmup samples at the start of
+# every sequence and 1 for the rest. Pass as sample_weight to model.fit.
+def sequence_weights(count, length, warmup):
+    weights = np.ones((count, length), dtype=np.float32)
+    weights[:, :warmup] = 0.0
+    return weights
+
+# Change data to format expected by the model
+# Sequence version, for models that return a prediction for every timestep
+# Each example is warmup + sequence_length contiguous samples from a random
+# place in a segment, with the wet audio at every sample as target. The model
+# starts each example from a zero state, the warmup samples let the state
+# settle and are left out of the loss through sequence_weights.
+# Gradients only flow back through one example, which makes sequence_length
+# the truncation length of backpropagation through time.
+# dtype and filters work as in create_dataset.
+@profiled("model_utils.create_sequence_dataset")
+def create_sequence_dataset(input_file, output_file, size_training, size_test, sequence_length, warmup, sr, test_ratio, seed=None, dtype=np.float32, filters=None):
+    rng = _rng(seed)
+    input_file, output_file = _apply_filters(input_file, output_file, filters)
+    dry_train, dry_test, wet_train, wet_test = split_segments(input_file, output_file, sr, test_ratio, dtype)
+    segment_size = sr * 5
+    length = warmup + sequence_length
+
+    # Creating the training set (randomly pulling sequences from all segments in train set)
+    if size_training > 0:
+        indices = random_frame_indices(dry_train.shape[0], segment_size, length, size_training, rng)
+    else:
+        indices = (np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+    features_train, targets_train = gather_sequences(dry_train, wet_train, length, *indices, dtype)
+
+    # Creating the testing set (randomly pulling sequences from segments in test set)
+    indices = random_frame_indices(dry_test.shape[0], segment_size, length, size_test, rng)
+    features_test, targets_test = gather_sequences(dry_test, wet_test, length, *indices, dtype)
 
-    # Creating the testing set (sequentiually pulling frames and target value from segments in test set)
-    features_test = np.zeros((size_test, frame))
-    targets_test = np.zeros((size_test))
-    counter = 0
-    
-    for i in range(0,dry_test.shape[0]):
-        dry_segment = dry_test[i]
-        wet_segment = wet_test[i]
-        random_start = random.randint(0,dry_segment.size-test_frames_pr_segment-frame-1)
-        
-        for x in range(0+frame, test_frames_pr_segment+frame-1):
-            start_point = x + random_start      
-            features = dry_segment[start_point:start_point+frame]
-            target = wet_segment[start_point+frame-1]
-            
-            features_test[counter,:], targets_test[counter] = features, target
-            counter+= 1 
-            
     return dry_test, wet_test, features_train, features_test, targets_train, targets_test
 
 # Function used later in the notebook
 # Function to prepare audio for the model to predict, as the model expects 
 # the input of sequentially ordered frames
+# Row i holds the frame ending at sample i, so there is one frame per sample.
+# The result is a read-only view over the padded audio.
+@profiled("model_utils.prepare_audio_seq")
 def prepare_audio_seq(dry_test, index, frame):    
-    audio = dry_test[index]
-    counter = 0
+    audio = np.asarray(dry_test[index], dtype=np.float32)
     audio = np.pad(audio, (frame-1,0))
-    audio = audio[0:audio.size-frame+1]
-    results = np.zeros((audio.size, frame))
-
-    for i in range(0+frame,audio.size-frame-1):
-            segment = audio[i-frame:i]
-            results[counter,:] = segment
-            counter+= 1
-    
-    return results
\ No newline at end of file
+    return frame_segments(audio, frame)
+
+# Model Wrappers
+
+# Gives a keras model the predict(features, batch_size) signature of the
+# numpy_lstm and TFLite models, without the progress bar. With direct=True the
+# model is called directly instead of through model.predict, which has a large
+# fixed cost per call that small blocks cannot afford.
+def keras_predictor(model, direct=False):
+    return _KerasPredictor(model, direct)
+
+class _KerasPredictor:
+
+    def __init__(self, model, direct):
+        self.model = model
+        self._call = None
+
+        if direct:
+            import tensorflow as tf
+            self._call = tf.function(lambda features: model(features, training=False), reduce_retracing=True)
+
+    def predict(self, features, batch_size=None):
+        if self._call is None:
+            return self.model.predict(features, batch_size=batch_size, verbose=0)
+
+        return self._call(np.asarray(features, dtype=np.float32)[..., None]).numpy()
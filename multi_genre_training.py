@@ -0,0 +1,345 @@
+import numpy as np
+import tensorflow as tf
+
+import argparse, os, time
+
+import data
+import model_utils
+from shards import safe_name
+from sweep import build_model
+
+# Trains the LSTM models of several genres in one run.
+#
+# The notebook trains one model with 16 hidden units per genre, and each step
+# of such a small model is too little work to keep the CPU busy. Here the
+# genres share the clean input from data.create_multi_genre_data and their
+# models run side by side as one model: every LSTM layer is genres times as
+# wide, and its weights are masked to a block diagonal so each genre only
+# sees its own units. The recurrent loop, which is most of the cost of these
+# small models, then runs once for all genres, each step doing one wider
+# matmul instead of several tiny ones. The genres stay independent, with one
+# output, loss and early stopping per genre, and end up with the weights
+# they would get trained on their own.
+#
+# The per-genre models are plain notebook models (sweep.build_model). Their
+# initial weights are copied into the joint model, and the trained weights
+# are copied back out, so each genre is saved as its own .keras file that
+# works with render.py, numpy_lstm and quantization.py.
+#
+# Example:
+#   python multi_genre_training.py --genres Metal " Rock" "Rock & Roll" --epochs 50 --compare
+
+GENRES = ["Metal", " Rock", "Rock & Roll"]
+
+# Model names the notebook saves each genre under
+MODEL_NAMES = {"Metal": "Metal", " Rock": "Rock", "Rock & Roll": "Rock_N_Roll"}
+
+# Name of a genre's model and its file in dataset/models.
+def model_name(genre):
+    return MODEL_NAMES.get(genre, safe_name(genre))
+
+# Builds the joint model of several genre models.
+#
+# Input:
+#   genre_models - List of tf.keras.Model
+#       Models from sweep.build_model, all with the same frame, hidden units
+#       and number of layers. Their weights are the starting point.
+#   learning_rate - Float - Default 0.001
+#   jit_compile - Boolean - Default True
+#       Compile the training step with XLA, which roughly halves the cost of
+#       the recurrent loop on CPU.
+#
+# Output:
+#   joint - tf.keras.Model
+#       Compiled model with one output per genre, named like the genre models,
+#       each trained on mean absolute error.
+def build_joint_model(genre_models, learning_rate=0.001, jit_compile=True):
+    first = genre_models[0]
+    lstm_layers = _lstm_layers(first)
+    hidden_units = lstm_layers[0].units
+    count = len(genre_models)
+
+    # Units of genre g are g * hidden_units to (g + 1) * hidden_units in every
+    # gate, a weight belongs to a genre when both its ends are in that genre
+    groups = np.repeat(np.arange(count), hidden_units)
+    gate_mask = np.tile(groups[:, None] == groups[None, :], (1, 4)).astype(np.float32)
+    head_mask = (groups[:, None] == np.arange(count)[None, :]).astype(np.float32)
+
+    inputs = tf.keras.layers.Input(shape=first.inputs[0].shape[1:])
+    x = inputs
+
+    for i, layer in enumerate(lstm_layers):
+        # The first layer reads the shared input, every unit may see it
+        x = tf.keras.layers.LSTM(
+            hidden_units * count, activation='tanh', return_sequences=layer.return_sequences,
+            kernel_constraint=None if i == 0 else _BlockMask(gate_mask),
+            recurrent_constraint=_BlockMask(gate_mask), name='layer%djoint' % (i + 1)
+        )(x)
+
+    x = tf.keras.layers.Dense(count, kernel_constraint=_BlockMask(head_mask), name='headsjoint')(x)
+    outputs = {model.name: tf.keras.layers.Lambda(lambda y, g=g: y[:, g:g + 1], name=model.name)(x)
+               for g, model in enumerate(genre_models)}
+
+    joint = tf.keras.Model(inputs, outputs, name='joint')
+    joint.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+        loss={model.name: 'mean_absolute_error' for model in genre_models},
+        jit_compile=jit_compile
+    )
+
+    _set_joint_weights(joint, [model.get_weights() for model in genre_models])
+
+    return joint
+
+# Early stopping for every genre of a joint model, the same rule as
+# tf.keras.callbacks.EarlyStopping(monitor='loss', patience=5,
+# restore_best_weights=True) in the notebook. A genre that stopped keeps its
+# best weights aside while the others go on, training ends when all stopped.
+class GenreEarlyStopping(tf.keras.callbacks.Callback):
+
+    # Input:
+    #   names - List of String
+    #       Output names of the joint model, in order of the genres.
+    #   monitor - String - Default "loss"
+    #       "loss" or "val_loss", read per genre as e.g. "Metal_loss".
+    #   patience - Integer - Default 5
+    def __init__(self, names, monitor="loss", patience=5):
+        super().__init__()
+        self.names = names
+        self.monitor = monitor
+        self.patience = patience
+
+    def on_train_begin(self, logs=None):
+        self.best = {name: np.inf for name in self.names}
+        self.wait = {name: 0 for name in self.names}
+        self.best_weights = {name: None for name in self.names}
+        self.stopped_epoch = {name: None for name in self.names}
+
+    def on_epoch_end(self, epoch, logs=None):
+        prefix = "val_" if self.monitor.startswith("val_") else ""
+
+        for g, name in enumerate(self.names):
+            if self.stopped_epoch[name] is not None:
+                continue
+
+            value = logs[prefix + name + "_loss"]
+
+            if value < self.best[name]:
+                self.best[name] = value
+                self.wait[name] = 0
+                self.best_weights[name] = _genre_weights(self.model, g, len(self.names))
+            else:
+                self.wait[name] += 1
+                if self.wait[name] >= self.patience and epoch > 0:
+                    self.stopped_epoch[name] = epoch
+
+        if all(epoch is not None for epoch in self.stopped_epoch.values()):
+            self.model.stop_training = True
+
+# Trains several genre models together on the same clean frames.
+#
+# Input:
+#   genre_models - List of tf.keras.Model
+#       Models from sweep.build_model, trained in place.
+#   features_train - np.array
+#       (frames, frame) clean frames, from model_utils.create_multi_genre_dataset.
+#   targets_train - np.array
+#       (frames, genres) targets, one column per model.
+#   epochs - Integer
+#       Most epochs, every genre stops early on its own.
+#   batch_size - Integer - Default 64
+#   patience - Integer - Default 5
+#   validation_split - Float - Default 0.15
+#   learning_rate - Float - Default 0.001
+#   jit_compile - Boolean - Default True
+#   verbose - Integer - Default 2
+#
+# Output:
+#   history - dict
+#       Keras history of the joint model, with per-genre losses such as
+#       "Metal_loss" and "val_Metal_loss", and the seconds of every epoch.
+#       The first epoch includes compiling the model.
+#   stopped_epoch - dict
+#       Model name -> epoch its training stopped, None if it ran all epochs.
+def train_genres(genre_models, features_train, targets_train, epochs, batch_size=64, patience=5, validation_split=0.15, learning_rate=0.001, jit_compile=True, verbose=2):
+    joint = build_joint_model(genre_models, learning_rate, jit_compile)
+    names = [model.name for model in genre_models]
+    targets = {name: targets_train[:, g] for g, name in enumerate(names)}
+
+    stopper = GenreEarlyStopping(names, patience=patience)
+    timer = _EpochTimer()
+    history = joint.fit(
+        features_train,
+        targets,
+        batch_size=batch_size,
+        shuffle=False,
+        epochs=epochs,
+        callbacks=[stopper, timer],
+        validation_split=validation_split,
+        verbose=verbose,
+    )
+
+    for g, model in enumerate(genre_models):
+        weights = stopper.best_weights[model.name]
+        model.set_weights(weights if weights is not None else _genre_weights(joint, g, len(genre_models)))
+
+    history.history["seconds"] = timer.seconds
+    return history.history, stopper.stopped_epoch
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the LSTM models of several genres in one run and save one .keras file per genre.")
+    parser.add_argument("--genres", nargs="+", default=GENRES)
+    parser.add_argument("--effect-data", default=os.path.join("dataset", "effectData.csv"))
+    parser.add_argument("--file-data", default=os.path.join("dataset", "fileData.csv"))
+    parser.add_argument("--sr", type=int, default=22050)
+    parser.add_argument("--duration", type=int, default=120)
+    parser.add_argument("--frame", type=int, default=64)
+    parser.add_argument("--hidden-units", type=int, default=16)
+    parser.add_argument("--single-layer", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--epochs", type=int, default=50)
+    parser.add_argument("--test-ratio", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--models-dir", default=os.path.join("dataset", "models"))
+    parser.add_argument("--compare", action="store_true", help="Also time training the first genre on its own")
+    args = parser.parse_args()
+
+    signal, wets = data.create_multi_genre_data(args.genres, args.effect_data, args.file_data, mu_comp=False, srate=args.sr,
+                                                duration=args.duration, type="random", seed=args.seed)
+
+    # Dataset sizes as in the notebook
+    size_training = int((len(signal) / args.frame) * (1 - args.test_ratio))
+    size_test = int((len(signal) / args.frame) * args.test_ratio)
+
+    _, _, features_train, features_test, targets_train, targets_test = model_utils.create_multi_genre_dataset(
+        signal, wets, size_training, size_test, args.frame, args.sr, args.test_ratio, seed=args.seed
+    )
+
+    os.makedirs(args.models_dir, exist_ok=True)
+
+    genre_models = [build_model(args.frame, args.hidden_units, not args.single_layer, model_name(genre)) for genre in args.genres]
+
+    history, stopped_epoch = train_genres(genre_models, features_train, targets_train, args.epochs, args.batch_size)
+    joint_seconds = _epoch_seconds(history["seconds"])
+
+    print("Trained {} genres in {:.1f} seconds, {:.2f} s per epoch after the first".format(
+        len(genre_models), sum(history["seconds"]), joint_seconds))
+
+    for g, model in enumerate(genre_models):
+        mae = model.evaluate(features_test, targets_test[:, g], batch_size=4096, verbose=0)
+        path = os.path.join(args.models_dir, model.name + ".keras")
+        model.save(path)
+        print("{:<12} stopped at epoch {}, test MAE {:.4f}, saved {}".format(model.name, stopped_epoch[model.name], mae, path))
+
+    if args.compare:
+        # One genre as the notebook trains it, and compiled with XLA like the
+        # joint model. The first epoch, which compiles, is left out of both.
+        for label, jit_compile in [("as in the notebook", False), ("with XLA", True)]:
+            tf.keras.backend.clear_session()
+            single = build_model(args.frame, args.hidden_units, not args.single_layer, model_name(args.genres[0]))
+            if jit_compile:
+                single.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=0.001), loss='mean_absolute_error',
+                               jit_compile=True)
+
+            timer = _EpochTimer()
+            single.fit(features_train, targets_train[:, 0], batch_size=args.batch_size, shuffle=False,
+                       epochs=_COMPARE_EPOCHS, validation_split=0.15, callbacks=[timer], verbose=0)
+            single_seconds = _epoch_seconds(timer.seconds)
+
+            print("One genre {}: {:.2f} s per epoch, all {} genres together: {:.2f}x that".format(
+                label, single_seconds, len(genre_models), joint_seconds / single_seconds))
+
+# -----------------------------------------------------------------------
+# Helper functions below are designed to be used only in this module.
+
+# Epochs the single genre models of --compare are timed for
+_COMPARE_EPOCHS = 3
+
+# Records the seconds every epoch takes
+class _EpochTimer(tf.keras.callbacks.Callback):
+
+    def on_train_begin(self, logs=None):
+        self.seconds = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.seconds.append(time.perf_counter() - self._start)
+
+# Mean seconds per epoch without the first one, which includes compiling
+def _epoch_seconds(seconds):
+    return float(np.mean(seconds[1:] if len(seconds) > 1 else seconds))
+
+# Zeroes the weights between genres after every update. They start at zero
+# and are reset after each step, so no genre ever reads another's units.
+class _BlockMask(tf.keras.constraints.Constraint):
+
+    def __init__(self, mask):
+        self.mask = mask
+
+    def __call__(self, w):
+        return w * tf.cast(self.mask, w.dtype)
+
+def _lstm_layers(model):
+    return [layer for layer in model.layers if isinstance(layer, tf.keras.layers.LSTM)]
+
+# Columns of genre g in an LSTM kernel of the joint model, the same hidden
+# units in each of the i, f, c and o gates
+def _gate_columns(g, hidden_units, count):
+    units = hidden_units * count
+    return np.concatenate([np.arange(gate * units + g * hidden_units, gate * units + (g + 1) * hidden_units)
+                           for gate in range(4)])
+
+# Weights of genre g in the order of its own model's get_weights
+def _genre_weights(joint, g, count):
+    lstm_layers = _lstm_layers(joint)
+    hidden_units = lstm_layers[0].units // count
+    rows = slice(g * hidden_units, (g + 1) * hidden_units)
+    columns = _gate_columns(g, hidden_units, count)
+    weights = []
+
+    for i, layer in enumerate(lstm_layers):
+        kernel, recurrent, bias = layer.get_weights()
+        kernel = kernel[:, columns] if i == 0 else kernel[rows, columns]
+        weights += [kernel, recurrent[rows, columns], bias[columns]]
+
+    kernel, bias = joint.get_layer('headsjoint').get_weights()
+    return weights + [kernel[rows, g:g + 1], bias[g:g + 1]]
+
+# Places the weights of every genre model into its block of the joint model,
+# everything outside the blocks is zero
+def _set_joint_weights(joint, genre_weights):
+    count = len(genre_weights)
+    lstm_layers = _lstm_layers(joint)
+    hidden_units = lstm_layers[0].units // count
+
+    for i, layer in enumerate(lstm_layers):
+        kernel, recurrent, bias = [np.zeros_like(w) for w in layer.get_weights()]
+
+        for g, weights in enumerate(genre_weights):
+            rows = slice(g * hidden_units, (g + 1) * hidden_units)
+            columns = _gate_columns(g, hidden_units, count)
+            genre_kernel, genre_recurrent, genre_bias = weights[3 * i:3 * i + 3]
+
+            if i == 0:
+                kernel[:, columns] = genre_kernel
+            else:
+                kernel[rows, columns] = genre_kernel
+            recurrent[rows, columns] = genre_recurrent
+            bias[columns] = genre_bias
+
+        layer.set_weights([kernel, recurrent, bias])
+
+    heads = joint.get_layer('headsjoint')
+    kernel, bias = [np.zeros_like(w) for w in heads.get_weights()]
+
+    for g, weights in enumerate(genre_weights):
+        rows = slice(g * hidden_units, (g + 1) * hidden_units)
+        kernel[rows, g] = weights[-2][:, 0]
+        bias[g] = weights[-1][0]
+
+    heads.set_weights([kernel, bias])
+
+if __name__ == "__main__":
+    main()
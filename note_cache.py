@@ -0,0 +1,153 @@
+import numpy as np
+
+import os, threading
+
+from profiling import stage
+
+# Disk-backed cache of decoded notes used by data.create_data.
+#
+# Each note is decoded and resampled once with librosa, then stored as a
+# float32 .npy file keyed by (fileID, srate, mu_comp). Later builds memory map
+# the file instead of decoding the WAV again. The cache is capped by total size
+# and evicts the least recently used notes first, using file modification times
+# so several processes can share one cache directory. Within a process the
+# cache is shared by the note loading threads of data.py, writes, size
+# bookkeeping and eviction run under a lock.
+
+DEFAULT_CACHE_DIR = os.path.join("dataset", "cache", "notes")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+class NoteCache:
+
+    # Input:
+    #   cache_dir - String - Default dataset/cache/notes
+    #       Folder the cached notes are written to. Created if missing.
+    #   max_bytes - Integer - Default 2 GiB
+    #       Size cap of the cache, least recently used notes are removed
+    #       once it is exceeded.
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    # Returns the decoded note for a wav file, decoding it on a cache miss.
+    #
+    # Input:
+    #   file - String
+    #       Path to the wav file of the note.
+    #   file_id - String
+    #       fileID of the note from fileData.csv.
+    #   srate - Integer
+    #       Sampling rate the note is loaded at.
+    #   mu_comp - Boolean
+    #       Whether the dataset being built uses mu's law compression.
+    #
+    # Output:
+    #   note - np.memmap
+    #       float32 samples of the note. Mapped copy-on-write, so callers can
+    #       modify it without touching the cache.
+    def load(self, file, file_id, srate, mu_comp):
+        path = self._path(file_id, srate, mu_comp)
+
+        try:
+            note = np.load(path, mmap_mode="c")
+            os.utime(path)
+            with self._lock:
+                self.hits += 1
+            return note
+        except (FileNotFoundError, ValueError):
+            pass
+
+        note = decode_note(file, srate)
+        return self._store(path, note.astype(np.float32, copy=False))
+
+    # Removes every cached note.
+    def clear(self):
+        with self._lock:
+            for path, _, _ in self._entries():
+                _remove(path)
+            self._size = 0
+
+    # -------------------------------------------------------------------
+    # Helper functions below are designed to be used only in this class.
+
+    def _path(self, file_id, srate, mu_comp):
+        name = "%s_%d_%d.npy" % (file_id, srate, int(mu_comp))
+        return os.path.join(self.cache_dir, name)
+
+    # Writes through a temporary file so readers never see partial notes, and
+    # maps the stored note before another thread's eviction can remove it
+    def _store(self, path, note):
+        tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, "wb") as f:
+            np.save(f, note)
+
+        with self._lock:
+            os.replace(tmp_path, path)
+            self.misses += 1
+
+            self._size += os.path.getsize(path)
+            if self._size > self.max_bytes:
+                self._evict(keep=path)
+
+            return np.load(path, mmap_mode="c")
+
+    # Called with the lock held
+    def _evict(self, keep):
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self._size = sum(size for _, _, size in entries)
+
+        for path, _, size in entries:
+            if self._size <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+
+            # Counted in the listing above and gone afterwards, even when
+            # another process removed it first
+            _remove(path)
+            self._size -= size
+
+    # Lists (path, last access, size) for all notes currently in the cache,
+    # skipping notes removed while listing
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npy"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+# Removes a file, False if it was already gone
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+# Reads a wav file and resamples it to srate, the same result as
+# librosa.load(file, sr=srate) but profiled as separate read and resample
+# stages.
+def decode_note(file, srate):
+    # Imported here so that cache hits never pay for importing librosa
+    import librosa as lib
+
+    with stage("decode.read") as s:
+        note, file_srate = lib.load(file, sr=None)
+        s.add_array(note)
+
+    if file_srate != srate:
+        with stage("decode.resample") as s:
+            note = lib.resample(note, orig_sr=file_srate, target_sr=srate)
+            s.add_array(note)
+
+    return note
@@ -0,0 +1,210 @@
+import h5py
+import numpy as np
+
+import io, json, zipfile
+
+# TensorFlow-free runtime for the saved LSTM effect models.
+#
+# Reads the layer config and weights straight out of a .keras archive
+# (dataset/models/<Genre>.keras) into NumPy arrays, then runs the LSTM and Dense
+# layers with plain NumPy. Only depends on numpy and h5py, so worker processes
+# that just apply effects start without importing TensorFlow.
+#
+# Two modes are supported:
+#   predict - Same as model.predict on (frames, frame) windows, as produced by
+#             model_utils.prepare_audio_seq.
+#   process - Carried-state streaming over many independent audio streams at
+#             once, one output sample per input sample (see
+#             streaming_inference.py for the TensorFlow version).
+
+_ACTIVATIONS = {
+    "tanh": np.tanh,
+    "sigmoid": lambda x: 0.5 * (np.tanh(0.5 * x) + 1.0),
+    "hard_sigmoid": lambda x: np.clip(x / 6.0 + 0.5, 0.0, 1.0),
+    "relu": lambda x: np.maximum(x, 0.0),
+    "linear": lambda x: x,
+}
+
+class NumpyLSTMModel:
+
+    # Input:
+    #   layers - List of dict
+    #       Layer descriptions as built by load_model.
+    #   name - String - Default ""
+    #       Name of the model.
+    def __init__(self, layers, name=""):
+        self.layers = layers
+        self.name = name
+
+    # Equivalent of model.predict for the windowed models.
+    #
+    # Input:
+    #   features - np.array
+    #       (frames, frame) or (frames, frame, 1) input windows.
+    #   batch_size - Integer - Default 4096
+    #       Windows processed at once, bounds the memory used.
+    #
+    # Output:
+    #   predictions - np.array
+    #       (frames, 1) predictions, the same shape model.predict returns.
+    def predict(self, features, batch_size=4096):
+        features = np.asarray(features, dtype=np.float32)
+        features = features.reshape(features.shape[0], features.shape[1], -1)
+        outputs = []
+
+        for i in range(0, features.shape[0], batch_size):
+            x = features[i:i + batch_size]
+
+            for layer in self.layers:
+                if layer["type"] == "lstm":
+                    x, _ = _run_lstm(layer, x, None)
+                    if not layer["return_sequences"]:
+                        x = x[:, -1]
+                else:
+                    x = _run_dense(layer, x)
+
+            outputs.append(x)
+
+        if not outputs:
+            return np.zeros((0, 1), dtype=np.float32)
+
+        return np.concatenate(outputs)
+
+    # Fresh (zero) state for a number of independent streams.
+    def initial_state(self, streams):
+        return [
+            (np.zeros((streams, layer["units"]), dtype=np.float32),
+             np.zeros((streams, layer["units"]), dtype=np.float32))
+            for layer in self.layers if layer["type"] == "lstm"
+        ]
+
+    # Processes the next block of every stream, carrying the LSTM state.
+    #
+    # Input:
+    #   blocks - np.array
+    #       (streams, samples) next block of audio for each stream.
+    #   state - List - Default None
+    #       State returned by the previous call, or None to start fresh.
+    #
+    # Output:
+    #   output - np.array
+    #       (streams, samples) one output sample per input sample.
+    #   state - List
+    #       State to pass to the next call.
+    def process(self, blocks, state=None):
+        blocks = np.asarray(blocks, dtype=np.float32)
+        if state is None:
+            state = self.initial_state(blocks.shape[0])
+
+        x = blocks[:, :, None]
+        new_state = []
+        lstm_index = 0
+
+        for layer in self.layers:
+            if layer["type"] == "lstm":
+                x, layer_state = _run_lstm(layer, x, state[lstm_index])
+                new_state.append(layer_state)
+                lstm_index += 1
+            else:
+                x = _run_dense(layer, x)
+
+        return x[:, :, 0], new_state
+
+# Loads a saved .keras LSTM model into a NumpyLSTMModel.
+#
+# Input:
+#   path - String
+#       Path to the .keras file, e.g. dataset/models/Metal.keras.
+#
+# Output:
+#   model - NumpyLSTMModel
+def load_model(path):
+    with zipfile.ZipFile(path) as archive:
+        config = json.loads(archive.read("config.json"))
+        weights = h5py.File(io.BytesIO(archive.read("model.weights.h5")), "r")
+
+    # Weights are stored per layer type in order: lstm, lstm_1, ..., dense
+    seen = {}
+    layers = []
+
+    for layer_config in config["config"]["layers"]:
+        class_name = layer_config["class_name"]
+        layer_settings = layer_config["config"]
+
+        if class_name == "InputLayer":
+            continue
+
+        group_name = class_name.lower()
+        count = seen.get(group_name, 0)
+        seen[group_name] = count + 1
+        if count > 0:
+            group_name += "_%d" % count
+
+        group = weights["layers"][group_name]
+
+        if class_name == "LSTM":
+            variables = group["cell"]["vars"]
+            bias = variables["2"][()] if layer_settings.get("use_bias", True) else 0.0
+            layers.append({
+                "type": "lstm",
+                "units": layer_settings["units"],
+                "kernel": variables["0"][()].astype(np.float32),
+                "recurrent_kernel": variables["1"][()].astype(np.float32),
+                "bias": np.asarray(bias, dtype=np.float32),
+                "activation": _ACTIVATIONS[layer_settings["activation"]],
+                "recurrent_activation": _ACTIVATIONS[layer_settings["recurrent_activation"]],
+                "return_sequences": layer_settings["return_sequences"],
+            })
+        elif class_name == "Dense":
+            variables = group["vars"]
+            bias = variables["1"][()] if layer_settings.get("use_bias", True) else 0.0
+            layers.append({
+                "type": "dense",
+                "kernel": variables["0"][()].astype(np.float32),
+                "bias": np.asarray(bias, dtype=np.float32),
+                "activation": _ACTIVATIONS[layer_settings["activation"]],
+            })
+        else:
+            raise ValueError("Unsupported layer in %s: %s" % (path, class_name))
+
+    weights.close()
+
+    return NumpyLSTMModel(layers, name=config["config"].get("name", ""))
+
+# -----------------------------------------------------------------------
+# Helper functions below are designed to be used only in this module.
+
+# Runs an LSTM layer over (batch, timesteps, features) input.
+# Returns the full output sequence and the final (h, c) state.
+def _run_lstm(layer, x, state):
+    units = layer["units"]
+    batch, timesteps, _ = x.shape
+    activation = layer["activation"]
+    recurrent_activation = layer["recurrent_activation"]
+    recurrent_kernel = layer["recurrent_kernel"]
+
+    # Input projections for every timestep in one matmul, time-major so each
+    # step reads a contiguous block. Gates are ordered i, f, c, o.
+    projected = np.ascontiguousarray(x.transpose(1, 0, 2)) @ layer["kernel"] + layer["bias"]
+
+    if state is None:
+        h = np.zeros((batch, units), dtype=np.float32)
+        c = np.zeros((batch, units), dtype=np.float32)
+    else:
+        h, c = state
+
+    outputs = np.empty((timesteps, batch, units), dtype=np.float32)
+
+    for t in range(timesteps):
+        z = projected[t] + h @ recurrent_kernel
+        gates = recurrent_activation(z)
+        g = activation(z[:, 2 * units:3 * units])
+
+        c = gates[:, units:2 * units] * c + gates[:, :units] * g
+        h = gates[:, 3 * units:] * activation(c)
+        outputs[t] = h
+
+    return outputs.transpose(1, 0, 2), (h, c)
+
+def _run_dense(layer, x):
+    return layer["activation"](x @ layer["kernel"] + layer["bias"])
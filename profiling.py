@@ -0,0 +1,258 @@
+import functools, json, os, threading, time, tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Opt-in stage timing for the dataset and inference pipeline.
+#
+# data.py, note_cache.py, model_utils.py and evaluation.py wrap their
+# expensive steps in stage(name) or decorate them with profiled(name). While
+# profiling is off stage returns a shared no-op context, so the only cost is a
+# function call. Turned on, every
+# stage records its wall time, call count, bytes it reported (decoded audio,
+# gathered frames) and the largest array it reported. With trace_memory=True it
+# also records the peak memory allocated inside the stage through tracemalloc,
+# which numpy reports its arrays to. That makes the code run noticeably slower.
+#
+# Example:
+#   import profiling
+#   with profiling.profile() as profiler:
+#       data.create_data("Metal", effect_data_path, file_data_path)
+#   profiler.print_report()
+#   profiler.save_trace("create_data.trace.json")  # open in chrome://tracing or Perfetto
+#
+# Stage times are wall times per thread, so stages that run in the note
+# loading threads can add up to more than the time of the call around them.
+# Memory peaks are process wide and include allocations of other threads.
+
+class Profiler:
+
+    # Input:
+    #   trace_memory - Boolean - Default False
+    #       Track the peak memory allocated in every stage with tracemalloc.
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.events = []
+        self.start_time = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        # Set by enable when it started tracemalloc for this profiler
+        self._started_tracing = False
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    # Totals per stage.
+    #
+    # Output:
+    #   report - dict
+    #       Stage name -> calls, seconds, bytes, largest_array and, when memory
+    #       is traced, peak_bytes.
+    def report(self):
+        totals = defaultdict(lambda: {"calls": 0, "seconds": 0.0, "bytes": 0, "largest_array": 0})
+
+        with self._lock:
+            events = list(self.events)
+
+        for event in events:
+            entry = totals[event["name"]]
+            entry["calls"] += 1
+            entry["seconds"] += event["seconds"]
+            entry["bytes"] += event["bytes"]
+            entry["largest_array"] = max(entry["largest_array"], event["largest_array"])
+
+            if "peak_bytes" in event:
+                entry["peak_bytes"] = max(entry.get("peak_bytes", 0), event["peak_bytes"])
+
+        return dict(sorted(totals.items(), key=lambda item: -item[1]["seconds"]))
+
+    def print_report(self):
+        print("{:<36} {:>8} {:>11} {:>12} {:>12} {:>12}".format("Stage", "Calls", "Seconds", "MB", "Largest MB", "Peak MB"))
+
+        for name, entry in self.report().items():
+            peak = "%.2f" % (entry["peak_bytes"] / 2 ** 20) if "peak_bytes" in entry else "-"
+            print("{:<36} {:>8} {:>11.4f} {:>12.2f} {:>12.2f} {:>12}".format(
+                name, entry["calls"], entry["seconds"], entry["bytes"] / 2 ** 20, entry["largest_array"] / 2 ** 20, peak))
+
+    def save_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    # Writes every stage call as a Chrome trace event, one row per thread.
+    def save_trace(self, path):
+        with self._lock:
+            events = list(self.events)
+
+        trace = [{
+            "name": event["name"],
+            "ph": "X",
+            "ts": event["start"] * 1e6,
+            "dur": event["seconds"] * 1e6,
+            "pid": os.getpid(),
+            "tid": event["thread"],
+            "args": {key: event[key] for key in ["bytes", "largest_array", "peak_bytes"] if key in event},
+        } for event in events]
+
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+    # -------------------------------------------------------------------
+    # Helper functions below are designed to be used only in this class.
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _record(self, event):
+        with self._lock:
+            self.events.append(event)
+
+_profiler = None
+
+# Starts recording stages, replacing any profiler already running.
+# tracemalloc is only started when nobody is tracing yet, and only tracing
+# started here is stopped again by disable.
+def enable(trace_memory=False):
+    global _profiler
+
+    # A replaced profiler hands over the tracing it started
+    started_tracing = _profiler is not None and _profiler._started_tracing
+
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        started_tracing = True
+
+    _profiler = Profiler(trace_memory)
+    _profiler._started_tracing = started_tracing
+    return _profiler
+
+# Stops recording and returns the profiler that was running, if any.
+def disable():
+    global _profiler
+
+    profiler, _profiler = _profiler, None
+
+    if profiler is not None and profiler._started_tracing:
+        tracemalloc.stop()
+        profiler._started_tracing = False
+
+    return profiler
+
+def is_enabled():
+    return _profiler is not None
+
+# Records everything inside the with block.
+@contextmanager
+def profile(trace_memory=False):
+    profiler = enable(trace_memory)
+    try:
+        yield profiler
+    finally:
+        if _profiler is profiler:
+            disable()
+
+# Context for one stage. Stages can be nested and used from any thread.
+#
+# Example:
+#   with stage("data.decode") as s:
+#       note = decode(file)
+#       s.add_array(note)
+def stage(name):
+    if _profiler is None:
+        return _NULL_STAGE
+    return _profiler.stage(name)
+
+# Decorator recording every call of a function as a stage.
+def profiled(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return function(*args, **kwargs)
+
+            with _profiler.stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+# -----------------------------------------------------------------------
+# Helper functions below are designed to be used only in this module.
+
+class _Stage:
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.bytes = 0
+        self.largest_array = 0
+
+    # Counts bytes handled by the stage, e.g. decoded audio.
+    def add_bytes(self, count):
+        self.bytes += count
+
+    # Counts an array produced by the stage.
+    def add_array(self, array):
+        self.bytes += array.nbytes
+        self.largest_array = max(self.largest_array, array.nbytes)
+
+    def __enter__(self):
+        if self.profiler.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            stack = self.profiler._stack()
+
+            # The peak so far belongs to the stage around this one
+            if stack:
+                stack[-1].highest = max(stack[-1].highest, peak)
+            tracemalloc.reset_peak()
+
+            self.memory_start = current
+            self.highest = current
+            stack.append(self)
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        event = {
+            "name": self.name,
+            "start": self.start - self.profiler.start_time,
+            "seconds": end - self.start,
+            "thread": threading.get_ident(),
+            "bytes": self.bytes,
+            "largest_array": self.largest_array,
+        }
+
+        if self.profiler.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            stack = self.profiler._stack()
+            stack.pop()
+
+            self.highest = max(self.highest, peak)
+            event["peak_bytes"] = self.highest - self.memory_start
+
+            if stack:
+                stack[-1].highest = max(stack[-1].highest, self.highest)
+            tracemalloc.reset_peak()
+
+        self.profiler._record(event)
+        return False
+
+class _NullStage:
+
+    def add_bytes(self, count):
+        pass
+
+    def add_array(self, array):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
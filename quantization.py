@@ -0,0 +1,318 @@
+import numpy as np
+
+import argparse, os, time
+
+import evaluation
+import model_utils
+
+# Exports trained models to TFLite for faster CPU inference.
+#
+# Modes:
+#   float   - Plain float32 TFLite, the reference for the quantized modes.
+#   float16 - Weights stored as float16, computed in float32.
+#   dynamic - Dynamic range quantization, int8 weights with activations
+#             quantized on the fly.
+#   int8    - Full integer quantization, activation ranges calibrated on a
+#             set of real inputs, e.g. windows from dry_test.
+#
+# LSTM layers are unrolled over the frame before converting, so the whole
+# model becomes plain TFLite ops with a free batch dimension. The converter
+# only keeps the LSTM loop for a fixed batch size, and fails on it in int8.
+# Unrolling puts every timestep into the graph, so for the LSTM models every
+# mode writes a file several times larger than the .keras file, and int8 the
+# largest since each step also gets its own quantize ops. For these models
+# the modes trade accuracy for speed, not size, and the .keras file stays
+# the one to keep. The GAN generator is made of Dense layers and converts as
+# it is, there float16 and int8 do shrink the file.
+#
+# TFLiteModel has the same predict(features, batch_size) signature as the
+# keras and numpy_lstm models, so it can be used by evaluation.py, render.py
+# and realtime.py. compare_models scores every version of a model on the same
+# test audio with the model_utils metrics and times it.
+#
+# Example:
+#   python quantization.py dataset/models/Metal.keras --modes float16 dynamic int8
+
+MODES = ["float", "float16", "dynamic", "int8"]
+
+# Converts a keras model to TFLite and writes it to path.
+#
+# Input:
+#   model - tf.keras.Model
+#       Trained model, e.g. the LSTM from lstm_main_training or the GAN generator.
+#   path - String
+#       Where to write the .tflite file.
+#   mode - String - Default "dynamic"
+#       One of MODES.
+#   calibration - np.array - Default None
+#       Inputs used to calibrate the int8 activation ranges, in the shape the
+#       model takes. Required for mode "int8".
+#   input_shape - Tuple - Default None
+#       Shape of one input without the batch dimension. Only needed for models
+#       without an Input layer, such as the subclassed GAN generator.
+#
+# Output:
+#   size - Integer
+#       Size of the written file in bytes.
+def export_model(model, path, mode="dynamic", calibration=None, input_shape=None):
+    import tensorflow as tf
+    from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+
+    if mode not in MODES:
+        raise ValueError("Unknown mode %s, expected one of %s" % (mode, ", ".join(MODES)))
+    if mode == "int8" and calibration is None:
+        raise ValueError("int8 export needs calibration inputs")
+
+    if input_shape is None:
+        input_shape = tuple(model.inputs[0].shape[1:])
+
+    model = _unrolled(model)
+    spec = tf.TensorSpec((None,) + tuple(input_shape), tf.float32)
+    function = tf.function(lambda x: model(x, training=False)).get_concrete_function(spec)
+
+    # Weights are frozen into constants, the converter cannot read keras variables
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([convert_variables_to_constants_v2(function)])
+
+    if mode != "float":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    if mode == "int8":
+        calibration = np.asarray(calibration, dtype=np.float32).reshape((-1,) + tuple(input_shape))
+        converter.representative_dataset = lambda: ([calibration[i:i + 64]] for i in range(0, len(calibration), 64))
+
+    content = converter.convert()
+
+    with open(path, "wb") as f:
+        f.write(content)
+
+    return len(content)
+
+# Random windows from the test segments for calibrating int8 models.
+#
+# Input:
+#   dry_segments - np.array
+#       (segments, samples) clean audio, e.g. dry_test.
+#   frame - Integer
+#       Size of frame (in samples) the model expects.
+#   count - Integer - Default 1000
+#       Number of windows.
+#   seed - Integer - Default 0
+#
+# Output:
+#   windows - np.array
+#       (count, frame, 1) float32 windows.
+def calibration_frames(dry_segments, frame, count=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    segment_index, starts = model_utils.random_frame_indices(len(dry_segments), np.shape(dry_segments)[1], frame, count, rng)
+    windows = model_utils.frame_segments(np.asarray(dry_segments, dtype=np.float32), frame)
+    return windows[segment_index, starts][..., None]
+
+# A .tflite model with the predict signature of the keras models.
+class TFLiteModel:
+
+    # Input:
+    #   path - String
+    #       Path to a file written by export_model.
+    #   num_threads - Integer - Default None
+    #       Threads the interpreter may use, None lets it decide.
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        self.interpreter = _interpreter(path, num_threads)
+        self.interpreter.allocate_tensors()
+
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch = None
+
+    # Input:
+    #   features - np.array
+    #       (frames, frame) or (frames, frame, 1) windows, or whatever the
+    #       exported model takes with the batch first.
+    #   batch_size - Integer - Default 4096
+    #
+    # Output:
+    #   predictions - np.array
+    #       The same shape model.predict returns.
+    def predict(self, features, batch_size=4096):
+        shape = tuple(self._input["shape"][1:])
+        features = np.asarray(features, dtype=np.float32).reshape((-1,) + shape)
+        outputs = []
+
+        for i in range(0, len(features), batch_size):
+            batch = np.ascontiguousarray(features[i:i + batch_size])
+
+            # Resizing reallocates the tensors, so only do it when the batch changes
+            if len(batch) != self._batch:
+                self.interpreter.resize_tensor_input(self._input["index"], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch = len(batch)
+
+            self.interpreter.set_tensor(self._input["index"], batch)
+            self.interpreter.invoke()
+            outputs.append(self.interpreter.get_tensor(self._output["index"]))
+
+        if not outputs:
+            return np.zeros((0,) + tuple(self._output["shape"][1:]), dtype=np.float32)
+
+        return np.concatenate(outputs)
+
+def load_model(path, num_threads=None):
+    return TFLiteModel(path, num_threads)
+
+# Scores and times several versions of a model on the same test audio.
+#
+# Input:
+#   models - dict
+#       Name -> model with a predict(features, batch_size) method.
+#   inputs - List of np.array
+#       Model inputs for every test segment, e.g. from frame_inputs.
+#   targets - List of np.array
+#       Wet audio the output of every segment is scored against.
+#   sr - Integer
+#       Sampling rate, for the throughput.
+#   batch_size - Integer - Default 4096
+#   sizes - dict - Default None
+#       Name -> file size in bytes, added to the report when given.
+#   spectral - evaluation.SpectralEvaluator - Default None
+#       Evaluator with the targets as its reference, adds the spectral metrics
+#       to the report. The reference STFTs are computed once for all models.
+#
+# Output:
+#   report - dict
+#       Name -> esr, normalized_esr, mae, en_mae, seconds and throughput (seconds
+#       of audio per second), plus size_bytes when sizes are given and the
+#       evaluation.SPECTRAL_METRICS when spectral is given.
+def compare_models(models, inputs, targets, sr, batch_size=4096, sizes=None, spectral=None):
+    true = np.concatenate([np.reshape(target, -1) for target in targets])
+    report = {}
+
+    for name, model in models.items():
+        # Warm up outside the timing, the first call allocates and traces
+        model.predict(inputs[0][:batch_size], batch_size=batch_size)
+
+        start = time.perf_counter()
+        predicted = np.concatenate([np.reshape(model.predict(x, batch_size=batch_size), -1) for x in inputs])
+        seconds = time.perf_counter() - start
+
+        report[name] = {
+            "esr": float(model_utils.esr(true, predicted)),
+            "normalized_esr": float(model_utils.normalized_esr(true, predicted)),
+            "mae": float(np.mean(np.abs(true - predicted))),
+            "en_mae": float(model_utils.energy_normalized_mae(true, predicted)),
+            "seconds": seconds,
+            "throughput": len(true) / sr / seconds,
+        }
+
+        if sizes is not None and name in sizes:
+            report[name]["size_bytes"] = sizes[name]
+
+        if spectral is not None:
+            report[name].update(spectral.score(predicted.reshape(len(targets), -1))[0])
+
+    return report
+
+def print_report(report):
+    print("{:<10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>12} {:>10}".format(
+        "Model", "ESR", "Norm ESR", "MAE", "EN MAE", "MR-STFT", "Seconds", "Throughput", "KB"))
+
+    for name, entry in report.items():
+        size = "%.1f" % (entry["size_bytes"] / 1024) if "size_bytes" in entry else "-"
+        mr_stft = "%.6f" % entry["mr_stft"] if "mr_stft" in entry else "-"
+        print("{:<10} {:>10.6f} {:>10.6f} {:>10.6f} {:>10.6f} {:>10} {:>10.3f} {:>11.1f}x {:>10}".format(
+            name, entry["esr"], entry["normalized_esr"], entry["mae"], entry["en_mae"], mr_stft,
+            entry["seconds"], entry["throughput"], size))
+
+# Inputs of the windowed LSTM models for every test segment, one frame per sample.
+def frame_inputs(dry_segments, frame):
+    return [model_utils.prepare_audio_seq(dry_segments, i, frame=frame) for i in range(len(dry_segments))]
+
+# Inputs of the GAN generator for every test segment, the noise vector followed
+# by consecutive frame-long blocks, as apply_effect in gan_main_training feeds
+# it. The incomplete block at the end of a segment is dropped.
+def generator_inputs(dry_segments, frame, noise):
+    noise = np.asarray(noise, dtype=np.float32).reshape(1, -1)
+    inputs = []
+
+    for segment in dry_segments:
+        blocks = model_utils.segment_audio(segment, frame)
+        inputs.append(np.concatenate([np.repeat(noise, len(blocks), axis=0), blocks], axis=1))
+
+    return inputs
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a trained LSTM model to quantized TFLite files and compare them with the float model.")
+    parser.add_argument("model", help="Path to a .keras model, e.g. dataset/models/Metal.keras")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=["float16", "dynamic", "int8"])
+    parser.add_argument("--output-dir", help="Folder for the .tflite files, defaults to the folder of the model")
+    parser.add_argument("--clean", default=os.path.join("dataset", "experiments", "clean_data.wav"),
+                        help="Dry audio the notebook trained on, the test split is used for calibration and scoring")
+    parser.add_argument("--effect", default=os.path.join("dataset", "experiments", "effect_data.wav"))
+    parser.add_argument("--sr", type=int, default=22050)
+    parser.add_argument("--frame", type=int, default=64)
+    parser.add_argument("--test-ratio", type=float, default=0.2)
+    parser.add_argument("--calibration-frames", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    import librosa
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(args.model)
+    signal, _ = librosa.load(args.clean, sr=args.sr)
+    wet, _ = librosa.load(args.effect, sr=args.sr)
+
+    # Same split as the notebooks, so dry_test is audio the model was not trained on
+    _, dry_test, _, wet_test = model_utils.split_segments(signal, wet, args.sr, args.test_ratio)
+    calibration = calibration_frames(dry_test, args.frame, args.calibration_frames)
+
+    output_dir = args.output_dir or os.path.dirname(args.model)
+    name = os.path.splitext(os.path.basename(args.model))[0]
+
+    models = {"keras": model_utils.keras_predictor(model)}
+    sizes = {"keras": os.path.getsize(args.model)}
+
+    for mode in args.modes:
+        path = os.path.join(output_dir, "%s_%s.tflite" % (name, mode))
+        sizes[mode] = export_model(model, path, mode, calibration)
+        models[mode] = load_model(path, args.threads)
+        print("Wrote " + path)
+
+    report = compare_models(models, frame_inputs(dry_test, args.frame), list(wet_test), args.sr, sizes=sizes,
+                            spectral=evaluation.SpectralEvaluator(wet_test))
+    print_report(report)
+
+# -----------------------------------------------------------------------
+# Helper functions below are designed to be used only in this module.
+
+# Copy of the model with every LSTM unrolled over its timesteps. The TFLite
+# converter only lowers the LSTM loop when the batch size is fixed, which
+# would force padding every call to the same batch.
+def _unrolled(model):
+    import tensorflow as tf
+
+    if not any(isinstance(layer, tf.keras.layers.LSTM) for layer in model.layers):
+        return model
+
+    def clone(layer):
+        config = layer.get_config()
+        if isinstance(layer, tf.keras.layers.LSTM):
+            config["unroll"] = True
+        return layer.__class__.from_config(config)
+
+    unrolled = tf.keras.models.clone_model(model, clone_function=clone)
+    unrolled.set_weights(model.get_weights())
+    return unrolled
+
+# The LiteRT package replaces tf.lite.Interpreter, use it when it is installed
+def _interpreter(path, num_threads):
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+
+    return Interpreter(model_path=path, num_threads=num_threads)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import numpy as np
+
+import argparse, time
+
+# Block-based real-time processing with the trained genre models.
+#
+# BlockProcessor applies a frame model to audio arriving in blocks of any size,
+# as an audio callback would hand it over. The last frame - 1 input samples are
+# kept in a ring buffer, so every output sample is predicted from exactly the
+# frame samples ending at its input sample, the same as prepare_audio_seq over
+# the whole file. The output of a stream is therefore identical to offline
+# rendering, whatever the block sizes.
+#
+# Latency:
+#   The processor adds no algorithmic latency, output sample i belongs to input
+#   sample i of the same block. A host still has to collect a whole block before
+#   calling process, so the delay from input to output is the block duration
+#   (block_size / sr) plus the time process takes. Processing keeps up with
+#   real time when every block is processed within its own duration, e.g.
+#   2.9 ms for 64 samples or 23.2 ms for 512 samples at 22050 Hz. The stream
+#   harness below counts the blocks that miss that deadline.
+#
+# Example:
+#   python realtime.py dataset/models/Metal.keras guitar.wav --block-sizes 64 128 256 512
+
+class BlockProcessor:
+
+    # Input:
+    #   model
+    #       Frame model with a predict(features, batch_size) method taking
+    #       (frames, frame) windows, e.g. a numpy_lstm model. Keras models can
+    #       be wrapped with model_utils.keras_predictor(model, direct=True).
+    #   frame - Integer
+    #       Size of frame (in samples) the model expects.
+    #   max_block_size - Integer - Default 4096
+    #       Largest block process accepts, sets the size of the work buffer.
+    def __init__(self, model, frame, max_block_size=4096):
+        self.model = model
+        self.frame = frame
+        self.max_block_size = max_block_size
+
+        # The last frame - 1 input samples, oldest first starting at _position
+        self._ring = np.zeros(frame - 1, dtype=np.float32)
+        self._position = 0
+
+        # Context followed by the current block, allocated once
+        self._work = np.zeros(frame - 1 + max_block_size, dtype=np.float32)
+
+    # Processes the next block of audio.
+    #
+    # Input:
+    #   block - np.array
+    #       1 to max_block_size samples.
+    #
+    # Output:
+    #   output - np.array
+    #       One processed sample per input sample.
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float32).reshape(-1)
+        size = len(block)
+        context = self.frame - 1
+
+        if size > self.max_block_size:
+            raise ValueError("Block of %d samples is larger than max_block_size (%d)" % (size, self.max_block_size))
+        if size == 0:
+            return np.zeros(0, dtype=np.float32)
+
+        # Unroll the ring into the start of the work buffer, then append the block
+        tail = context - self._position
+        self._work[:tail] = self._ring[self._position:]
+        self._work[tail:context] = self._ring[:self._position]
+        self._work[context:context + size] = block
+
+        windows = np.lib.stride_tricks.sliding_window_view(self._work[:context + size], self.frame)
+        output = np.asarray(self.model.predict(windows, batch_size=size), dtype=np.float32).reshape(-1)
+
+        self._push(block)
+
+        return output
+
+    # Clears the context, call before starting a new stream.
+    def reset(self):
+        self._ring[:] = 0.0
+        self._position = 0
+
+    # -------------------------------------------------------------------
+    # Helper functions below are designed to be used only in this class.
+
+    # Writes the newest samples of a block into the ring, overwriting the oldest
+    def _push(self, block):
+        context = len(self._ring)
+        if context == 0:
+            return
+
+        block = block[-context:]
+        end = self._position + len(block)
+
+        if end <= context:
+            self._ring[self._position:end] = block
+        else:
+            split = context - self._position
+            self._ring[self._position:] = block[:split]
+            self._ring[:end - context] = block[split:]
+
+        self._position = end % context
+
+# Feeds audio through a processor block by block and times every block.
+#
+# Input:
+#   processor
+#       Object with a process(block) method, e.g. a BlockProcessor.
+#   audio - np.array
+#       Audio to stream.
+#   sr - Integer
+#       Sampling rate of the audio, sets the deadline of each block.
+#   block_size - Integer
+#       Samples per block. The last block may be shorter.
+#
+# Output:
+#   output - np.array
+#       Processed audio.
+#   stats - dict
+#       Block latency percentiles (p50, p95, p99, max) in milliseconds, the
+#       deadline in milliseconds, number of blocks, deadline misses and the
+#       real-time factor of the whole stream.
+def simulate_stream(processor, audio, sr, block_size):
+    audio = np.asarray(audio, dtype=np.float32)
+    output = np.empty(len(audio), dtype=np.float32)
+    latencies = []
+
+    for start in range(0, len(audio), block_size):
+        block = audio[start:start + block_size]
+
+        begin = time.perf_counter()
+        output[start:start + len(block)] = processor.process(block)
+        latencies.append(time.perf_counter() - begin)
+
+    latencies = np.array(latencies) * 1000.0
+    deadline = block_size / sr * 1000.0
+
+    stats = {
+        "block_size": block_size,
+        "sr": sr,
+        "blocks": len(latencies),
+        "deadline_ms": deadline,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(np.max(latencies)),
+        "deadline_misses": int(np.sum(latencies > deadline)),
+        "real_time_factor": float(np.sum(latencies) / (len(audio) / sr * 1000.0)),
+    }
+
+    return output, stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a wav file through a genre model in blocks and report block latency.")
+    parser.add_argument("model", help="Path to a .keras model, e.g. dataset/models/Metal.keras, or a .tflite model for --backend tflite")
+    parser.add_argument("audio", help="Wav file to stream")
+    parser.add_argument("--frame", type=int, default=64)
+    parser.add_argument("--block-sizes", type=int, nargs="+", default=[64, 128, 256, 512])
+    parser.add_argument("--rates", type=int, nargs="+", default=[22050, 44100])
+    parser.add_argument("--backend", choices=["numpy", "keras", "tflite"], default="numpy")
+    parser.add_argument("--seconds", type=float, default=None, help="Only stream the first seconds of the file")
+    args = parser.parse_args()
+
+    import librosa
+
+    if args.backend == "numpy":
+        import numpy_lstm
+        model = numpy_lstm.load_model(args.model)
+    elif args.backend == "tflite":
+        import quantization
+        model = quantization.load_model(args.model)
+    else:
+        import tensorflow as tf
+        import model_utils
+        model = model_utils.keras_predictor(tf.keras.models.load_model(args.model), direct=True)
+
+    print("{:>6} {:>6} {:>7} {:>9} {:>8} {:>8} {:>8} {:>8} {:>7} {:>6}".format(
+        "sr", "block", "blocks", "deadline", "p50", "p95", "p99", "max", "misses", "RTF"))
+
+    for sr in args.rates:
+        audio, _ = librosa.load(args.audio, sr=sr, duration=args.seconds)
+
+        for block_size in args.block_sizes:
+            processor = BlockProcessor(model, args.frame, max_block_size=block_size)
+
+            # Warm up outside the timed stream
+            processor.process(np.zeros(block_size, dtype=np.float32))
+            processor.reset()
+
+            _, stats = simulate_stream(processor, audio, sr, block_size)
+            print("{:>6} {:>6} {:>7} {:>7.2f}ms {:>6.2f}ms {:>6.2f}ms {:>6.2f}ms {:>6.2f}ms {:>7} {:>6.3f}".format(
+                sr, block_size, stats["blocks"], stats["deadline_ms"], stats["p50_ms"], stats["p95_ms"],
+                stats["p99_ms"], stats["max_ms"], stats["deadline_misses"], stats["real_time_factor"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import numpy as np
+
+import argparse, glob, multiprocessing, os, time
+from concurrent.futures import ProcessPoolExecutor
+
+# Renders whole wav files through a trained genre model.
+#
+# Every file is split into chunks, and each chunk carries the frame - 1 samples
+# before it as warm-up context. The models only look at the last frame samples,
+# so the chunks join without seams and the result matches predicting the whole
+# file at once. Chunks from all files handled by a worker are stacked into large
+# predict calls, and files are spread across a process pool.
+#
+# Example:
+#   python render.py recordings/ --genre Metal --workers 4
+
+# Loaded once per worker process by _init_worker
+_model = None
+
+# Renders the files in a group and writes the results.
+#
+# Input:
+#   files - List of String
+#       Wav files to render.
+#   output_dir - String
+#       Folder the rendered files are written to.
+#   genre - String
+#       Name added to the output file names.
+#   sr - Integer
+#       Sampling rate the files are loaded and written at.
+#   frame - Integer
+#       Size of frame (in samples) the model expects.
+#   chunk_size - Integer
+#       Number of output samples per chunk.
+#   frames_per_call - Integer
+#       Number of frames stacked into each predict call.
+#   batch_size - Integer
+#       Batch size used inside each predict call.
+#
+# Output:
+#   seconds - Float
+#       Seconds of audio rendered.
+def render_files(files, output_dir, genre, sr, frame, chunk_size, frames_per_call, batch_size):
+    import librosa
+    import soundfile as sf
+
+    audio = [librosa.load(file, sr=sr)[0] for file in files]
+    outputs = [np.zeros(len(a), dtype=np.float32) for a in audio]
+
+    # (file index, first sample) of every chunk, in order
+    chunks = [(i, start) for i, a in enumerate(audio) for start in range(0, len(a), chunk_size)]
+
+    # Stack as many chunks as fit into each predict call
+    chunks_per_batch = max(1, frames_per_call // chunk_size)
+
+    for b in range(0, len(chunks), chunks_per_batch):
+        batch = chunks[b:b + chunks_per_batch]
+        windows = [_chunk_windows(audio[i], start, chunk_size, frame) for i, start in batch]
+        predicted = _model.predict(np.concatenate(windows), batch_size=batch_size).reshape(-1)
+
+        position = 0
+        for (i, start), chunk_windows in zip(batch, windows):
+            length = len(chunk_windows)
+            outputs[i][start:start + length] = predicted[position:position + length]
+            position += length
+
+    for file, output in zip(files, outputs):
+        name = os.path.splitext(os.path.basename(file))[0]
+        # Float wav, the models can overshoot 1.0 and 16 bit output would clip
+        sf.write(os.path.join(output_dir, "%s_%s.wav" % (name, genre)), output, sr, subtype="FLOAT")
+
+    return sum(len(a) for a in audio) / sr
+
+# Lists the wav files in a mix of files and directories.
+def collect_files(inputs):
+    files = []
+
+    for path in inputs:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.wav"))))
+        else:
+            files.append(path)
+
+    return files
+
+def main():
+    parser = argparse.ArgumentParser(description="Render wav files through a trained genre model.")
+    parser.add_argument("inputs", nargs="+", help="Wav files or directories of wav files")
+    parser.add_argument("--genre", required=True, help="Model name in dataset/models, e.g. Metal")
+    parser.add_argument("--model", help="Path to the .keras or .tflite model, overrides --genre for loading")
+    parser.add_argument("--output-dir", default=os.path.join("dataset", "experiments", "rendered"))
+    parser.add_argument("--backend", choices=["numpy", "keras", "tflite"], default="numpy",
+                        help="numpy avoids importing TensorFlow in the workers, tflite runs a model from quantization.py")
+    parser.add_argument("--quantization", choices=["float", "float16", "dynamic", "int8"], default="float16",
+                        help="Which exported <genre>_<mode>.tflite model the tflite backend loads")
+    parser.add_argument("--sr", type=int, default=22050)
+    parser.add_argument("--frame", type=int, default=64)
+    parser.add_argument("--chunk-seconds", type=float, default=2.0)
+    parser.add_argument("--frames-per-call", type=int, default=262144, help="Frames stacked into each predict call")
+    parser.add_argument("--batch-size", type=int, default=4096, help="Batch size inside each predict call")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    if args.backend == "tflite":
+        default_path = os.path.join("dataset", "models", "%s_%s.tflite" % (args.genre, args.quantization))
+    else:
+        default_path = os.path.join("dataset", "models", args.genre + ".keras")
+
+    model_path = args.model or default_path
+    if (not os.path.isfile(model_path)):
+        print("Genre not found, make sure a model exists for it.")
+        return
+
+    files = collect_files(args.inputs)
+    if (len(files) == 0):
+        print("No wav files found.")
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    chunk_size = int(args.chunk_seconds * args.sr)
+    workers = max(1, min(args.workers, len(files)))
+
+    # Largest files first, dealt round robin so the workers get similar amounts of audio
+    files.sort(key=os.path.getsize, reverse=True)
+    groups = [files[i::workers] for i in range(workers)]
+
+    start = time.perf_counter()
+
+    # Spawn rather than fork, TensorFlow does not survive being forked
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                             initargs=(model_path, args.backend)) as pool:
+        jobs = [
+            pool.submit(render_files, group, args.output_dir, args.genre, args.sr,
+                        args.frame, chunk_size, args.frames_per_call, args.batch_size)
+            for group in groups
+        ]
+        seconds = sum(job.result() for job in jobs)
+
+    elapsed = time.perf_counter() - start
+    print("Rendered {} files, {:.1f} seconds of audio in {:.1f} seconds".format(len(files), seconds, elapsed))
+    print("Throughput: {:.2f} seconds of audio per second".format(seconds / elapsed))
+
+# -----------------------------------------------------------------------
+# Helper functions below are designed to be used only in this module.
+
+def _init_worker(model_path, backend):
+    global _model
+
+    if backend == "numpy":
+        import numpy_lstm
+        _model = numpy_lstm.load_model(model_path)
+    elif backend == "tflite":
+        import quantization
+        _model = quantization.load_model(model_path)
+    else:
+        import tensorflow as tf
+        import model_utils
+        _model = model_utils.keras_predictor(tf.keras.models.load_model(model_path))
+
+# Frames for one chunk, including the frame - 1 samples of context before it
+# (zeros at the start of the file). One frame per output sample.
+def _chunk_windows(audio, start, chunk_size, frame):
+    context = max(0, start - frame + 1)
+    padding = frame - 1 - (start - context)
+    segment = np.pad(audio[context:start + chunk_size], (padding, 0))
+    return np.lib.stride_tricks.sliding_window_view(segment, frame)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import numpy as np
+
+import argparse, glob, os, time
+from concurrent.futures import ProcessPoolExecutor
+
+# Packed store of pre-resampled, pre-trimmed dataset samples.
+#
+# A one-time conversion decodes every wav file of the sample tree at a target
+# rate and appends it to a single samples.bin per rate, with an index.npz that
+# holds the offset, length and silence trim boundaries of every fileID.
+# data.create_data reads notes from the store through a memory map, so building
+# a dataset needs no decoding, resampling or silence detection.
+#
+# Layout:
+#   dataset/store/<rate>/samples.bin - float32 or int16 samples, back to back
+#   dataset/store/<rate>/index.npz   - fileID, offset, length, trim_start, trim_end
+#
+# Example:
+#   python sample_store.py --rates 22050 4000
+
+DEFAULT_STORE_DIR = os.path.join("dataset", "store")
+
+class SampleStore:
+
+    # Input:
+    #   store_dir - String
+    #       Root folder of the store.
+    #   srate - Integer
+    #       Sampling rate to read, must have been converted already.
+    def __init__(self, store_dir, srate):
+        rate_dir = os.path.join(store_dir, str(srate))
+        index = np.load(os.path.join(rate_dir, "index.npz"))
+
+        self.srate = srate
+        self.dtype = np.dtype(str(index["dtype"]))
+        self.samples_path = os.path.join(rate_dir, "samples.bin")
+        self.offsets = index["offset"]
+        self.lengths = index["length"]
+        self.trims = np.stack([index["trim_start"], index["trim_end"]], axis=1)
+        self.rows = {file_id: row for row, file_id in enumerate(index["fileID"].tolist())}
+
+    def __contains__(self, file_id):
+        return file_id in self.rows
+
+    # Samples of a note as float32.
+    def load(self, file_id):
+        row = self.rows[file_id]
+
+        # Every note gets its own copy-on-write mapping, notes are faded in
+        # place once loaded and the same note can be drawn many times
+        note = np.memmap(self.samples_path, dtype=self.dtype, mode="c",
+                         offset=int(self.offsets[row]) * self.dtype.itemsize, shape=(int(self.lengths[row]),))
+
+        if self.dtype == np.int16:
+            return note.astype(np.float32) / 32768.0
+
+        return note
+
+    # (start, end) of the note without leading and trailing silence, the
+    # same indexes librosa.effects.trim returns.
+    def trim_bounds(self, file_id):
+        return self.trims[self.rows[file_id]]
+
+_stores = {}
+
+# Returns the store for a rate, or None if that rate was never converted.
+# Stores are opened once per process.
+def open_store(srate, store_dir=DEFAULT_STORE_DIR):
+    key = (os.path.abspath(store_dir), srate)
+
+    if key not in _stores:
+        if not os.path.exists(os.path.join(store_dir, str(srate), "index.npz")):
+            return None
+        _stores[key] = SampleStore(store_dir, srate)
+
+    return _stores[key]
+
+# Converts a sample tree into the store at one rate.
+#
+# Input:
+#   sample_dirs - List of String
+#       Sample folders to convert, e.g. dataset/monophonic/Samples. Every
+#       */*.wav file inside is included.
+#   srate - Integer
+#       Rate to resample to.
+#   store_dir - String
+#       Root folder of the store.
+#   dtype - String - Default "float32"
+#       float32 keeps samples exact, int16 halves the size.
+#   workers - Integer - Default None
+#       Number of decoding processes, None uses every core.
+#
+# Output:
+#   count - Integer
+#       Number of files converted.
+def build_store(sample_dirs, srate, store_dir=DEFAULT_STORE_DIR, dtype="float32", workers=None):
+    files = sorted(f for sample_dir in sample_dirs for f in glob.glob(os.path.join(sample_dir, "*", "*.wav")))
+    rate_dir = os.path.join(store_dir, str(srate))
+    os.makedirs(rate_dir, exist_ok=True)
+
+    file_ids = [os.path.splitext(os.path.basename(f))[0] for f in files]
+    offsets = np.zeros(len(files), dtype=np.int64)
+    lengths = np.zeros(len(files), dtype=np.int64)
+    trims = np.zeros((len(files), 2), dtype=np.int64)
+    offset = 0
+
+    samples_path = os.path.join(rate_dir, "samples.bin")
+    with open(samples_path + ".tmp", "wb") as out, ProcessPoolExecutor(workers) as pool:
+        decoded = pool.map(_decode, files, [srate] * len(files), chunksize=16)
+
+        for i, (note, trim) in enumerate(decoded):
+            if dtype == "int16":
+                note = np.clip(np.round(note * 32768.0), -32768, 32767).astype(np.int16)
+            else:
+                note = note.astype(np.float32)
+
+            out.write(note.tobytes())
+            offsets[i], lengths[i], trims[i] = offset, len(note), trim
+            offset += len(note)
+
+    np.savez(os.path.join(rate_dir, "index.tmp.npz"), fileID=np.array(file_ids), offset=offsets, length=lengths,
+             trim_start=trims[:, 0], trim_end=trims[:, 1], dtype=np.array(dtype))
+    os.replace(samples_path + ".tmp", samples_path)
+    os.replace(os.path.join(rate_dir, "index.tmp.npz"), os.path.join(rate_dir, "index.npz"))
+
+    _stores.pop((os.path.abspath(store_dir), srate), None)
+
+    return len(files)
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the dataset samples into a packed, pre-resampled store.")
+    parser.add_argument("--rates", type=int, nargs="+", default=[22050])
+    parser.add_argument("--poly", action="store_true", help="Also convert dataset/polyphonic/Samples")
+    parser.add_argument("--dtype", choices=["float32", "int16"], default="float32")
+    parser.add_argument("--output-dir", default=DEFAULT_STORE_DIR)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    sample_dirs = [os.path.join("dataset", "monophonic", "Samples")]
+    if args.poly:
+        sample_dirs.append(os.path.join("dataset", "polyphonic", "Samples"))
+
+    for srate in args.rates:
+        start = time.perf_counter()
+        count = build_store(sample_dirs, srate, args.output_dir, args.dtype, args.workers)
+        print("Converted {} files at {} Hz in {:.1f} seconds".format(count, srate, time.perf_counter() - start))
+
+# -----------------------------------------------------------------------
+# Helper functions below are designed to be used only in this module.
+
+def _decode(file, srate):
+    import librosa as lib
+
+    note, _ = lib.load(file, sr=srate)
+    _, trim = lib.effects.trim(note)
+
+    return note, trim
+
+if __name__ == "__main__":
+    main()
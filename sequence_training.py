@@ -0,0 +1,148 @@
+import numpy as np
+import tensorflow as tf
+
+import argparse, os, time
+
+import data
+import model_utils
+
+# Sequence-to-sequence training for the LSTM models.
+#
+# The frame models from lstm_main_training.ipynb run frame recurrent steps to
+# learn from a single target sample. The sequence models below return a
+# prediction for every timestep instead, and are trained with
+# model_utils.create_sequence_dataset on long stretches of audio where every
+# sample past the warmup is supervised. For the same number of recurrent steps
+# that is close to frame times more training targets.
+#
+# The layers are the same as in the frame models, so to_frame_model turns a
+# trained sequence model into one that works with prepare_audio_seq, render.py,
+# numpy_lstm and streaming_inference.
+#
+# Example:
+#   python sequence_training.py --genre Metal --epochs 20 --save dataset/models/Metal.keras
+
+# Builds a model that predicts one output sample for every input sample.
+#
+# Input:
+#   hidden_units - Integer - Default 16
+#       Number of hidden units in each LSTM layer.
+#   dual_layer - Boolean - Default True
+#       Use 2 LSTM layers instead of 1.
+#   name - String - Default "sequence_lstm"
+#       Name of the model, also used in the layer names.
+#   learning_rate - Float - Default 0.003
+#       Higher than for the frame models, every step averages the loss over
+#       many more targets so fewer steps are taken per epoch.
+#
+# Output:
+#   model - tf.keras.Model
+#       Compiled model taking (batch, samples, 1) audio of any length.
+def build_sequence_model(hidden_units=16, dual_layer=True, name="sequence_lstm", learning_rate=0.003):
+    model = tf.keras.Sequential(name=name)
+    model.add(tf.keras.layers.Input(shape=(None, 1)))
+
+    if dual_layer:
+        model.add(tf.keras.layers.LSTM(hidden_units, activation='tanh', return_sequences=True, name='layer1' + name))
+        model.add(tf.keras.layers.LSTM(hidden_units, activation='tanh', return_sequences=True, name='layer2' + name))
+    else:
+        model.add(tf.keras.layers.LSTM(hidden_units, activation='tanh', return_sequences=True, name='layer' + name))
+
+    model.add(tf.keras.layers.Dense(1))
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+        loss='mean_absolute_error'
+    )
+
+    return model
+
+# Copies the weights of a sequence model into a frame model, which predicts
+# the sample at the end of a (frame, 1) window like the notebook models.
+def to_frame_model(model, frame):
+    frame_model = tf.keras.Sequential(name=model.name)
+    frame_model.add(tf.keras.layers.Input(shape=(frame, 1)))
+
+    lstm_layers = [layer for layer in model.layers if isinstance(layer, tf.keras.layers.LSTM)]
+
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.LSTM):
+            frame_model.add(tf.keras.layers.LSTM(
+                layer.units, activation=layer.activation, recurrent_activation=layer.recurrent_activation,
+                return_sequences=layer is not lstm_layers[-1], name=layer.name
+            ))
+        elif isinstance(layer, tf.keras.layers.Dense):
+            frame_model.add(tf.keras.layers.Dense(layer.units, activation=layer.activation, name=layer.name))
+        else:
+            raise ValueError("Unsupported layer for a frame model: " + layer.name)
+
+    for layer, original in zip(frame_model.layers, model.layers):
+        layer.set_weights(original.get_weights())
+
+    frame_model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=0.001), loss='mean_absolute_error')
+
+    return frame_model
+
+# Predicts whole segments in one pass, one output per input sample.
+def predict_segments(model, segments, batch_size=16):
+    segments = np.asarray(segments, dtype=np.float32)[..., None]
+    return model.predict(segments, batch_size=batch_size, verbose=0)[..., 0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Train a sequence LSTM model and report its test ESR.")
+    parser.add_argument("--genre", default="Metal")
+    parser.add_argument("--effect-data", default=os.path.join("dataset", "effectData.csv"))
+    parser.add_argument("--file-data", default=os.path.join("dataset", "fileData.csv"))
+    parser.add_argument("--sr", type=int, default=22050)
+    parser.add_argument("--duration", type=int, default=120)
+    parser.add_argument("--sequence-length", type=int, default=128, help="Supervised samples per example")
+    parser.add_argument("--warmup", type=int, default=32, help="Unsupervised samples before each example")
+    parser.add_argument("--hidden-units", type=int, default=16)
+    parser.add_argument("--single-layer", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--learning-rate", type=float, default=0.003)
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--frame", type=int, default=64, help="Frame of the saved frame model")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="Save the trained model converted to a frame model, e.g. dataset/models/Metal.keras")
+    args = parser.parse_args()
+
+    signal, wet = data.create_data(args.genre, args.effect_data, args.file_data, mu_comp=False, srate=args.sr,
+                                   duration=args.duration, type="random", seed=args.seed)
+
+    # As many sequences as it takes to cover the training audio once per epoch
+    test_ratio = 0.2
+    size_training = int(len(signal) * (1 - test_ratio) / args.sequence_length)
+    size_test = int(len(signal) * test_ratio / args.sequence_length)
+
+    dry_test, wet_test, features_train, features_test, targets_train, targets_test = model_utils.create_sequence_dataset(
+        signal, wet, size_training, size_test, args.sequence_length, args.warmup, args.sr, test_ratio, seed=args.seed
+    )
+    length = args.warmup + args.sequence_length
+
+    name = "sequence_" + args.genre.strip().replace(" ", "_").replace("&", "N")
+    model = build_sequence_model(args.hidden_units, not args.single_layer, name, args.learning_rate)
+    callback_stop = tf.keras.callbacks.EarlyStopping(monitor='loss', patience=5, restore_best_weights=True)
+
+    start = time.perf_counter()
+    model.fit(
+        features_train,
+        targets_train,
+        sample_weight=model_utils.sequence_weights(len(features_train), length, args.warmup),
+        validation_data=(features_test, targets_test, model_utils.sequence_weights(len(features_test), length, args.warmup)),
+        batch_size=args.batch_size,
+        epochs=args.epochs,
+        callbacks=[callback_stop],
+        verbose=2,
+    )
+    elapsed = time.perf_counter() - start
+
+    predicted = predict_segments(model, dry_test)
+
+    print("Training took {:.1f} seconds".format(elapsed))
+    print("Test ESR: {:.4f}".format(model_utils.esr(np.asarray(wet_test), predicted)))
+
+    if args.save:
+        to_frame_model(model, args.frame).save(args.save)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import numpy as np
+
+import argparse, json, os, re, time
+from concurrent.futures import ProcessPoolExecutor
+
+import data
+from filters import notebook_filters
+from catalog import load_catalog
+
+# Bulk dataset generation into memory-mappable .npy shards.
+#
+# Builds the clean/effect audio of many genres at once across a process pool
+# and writes each genre as a pair of aligned .npy files, plus a manifest.json
+# describing all of them. Training code can then memory map a genre's data with
+# load_shard instead of regenerating it or decoding wav files.
+#
+# Audio is stored as float32, or as int8 mu-law codes when mu_comp is on
+# (librosa's codes are signed, -128 to 127, so int8 holds them unchanged).
+#
+# Example:
+#   python shards.py --duration 600 --type random --workers 8
+
+DEFAULT_SHARD_DIR = os.path.join("dataset", "experiments", "shards")
+
+# Generates the dataset of a single genre into a shard.
+#
+# Input:
+#   genre - String
+#       Genre name, must be same from list in effectData.csv name.
+#   effect_data_path - String
+#       Path to effect data csv file.
+#   file_data_path - String
+#       Path to file data csv file.
+#   shard_dir - String
+#       Folder the shard files are written to.
+#   seed - Integer
+#       Seed for the note choices of this genre.
+#   mu_comp, srate, duration, type, filters
+#       Same as data.create_data. Filters run over the chunks as they are
+#       generated, so the whole genre is filtered in the same single pass.
+#   workers - Integer - Default 1
+#       Threads loading notes for this shard. Shards already run one per
+#       process, so the processes times this should not exceed the cores.
+#
+# Output:
+#   entry - dict
+#       Manifest entry of the shard, None if the genre could not be built.
+#       Nothing is left in shard_dir for a genre without notes.
+def generate_shard(genre, effect_data_path, file_data_path, shard_dir, seed, mu_comp=False, srate=22050, duration=120, type="random", filters=None, workers=1):
+    name = safe_name(genre)
+    dtype = np.int8 if mu_comp else np.float32
+    max_length = duration * srate
+
+    paths = {kind: os.path.join(shard_dir, "%s_%s.npy" % (name, kind)) for kind in ["clean", "effect"]}
+    tmp_paths = {kind: path + ".tmp" for kind, path in paths.items()}
+    arrays = {kind: np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(max_length,))
+              for kind, path in tmp_paths.items()}
+
+    length = 0
+    chunks = data.create_data_chunks(genre, effect_data_path, file_data_path, mu_comp=mu_comp, srate=srate,
+                                     duration=duration, type=type, compact=True, seed=seed, workers=workers,
+                                     filters=filters)
+
+    for clean_chunk, effect_chunk in chunks:
+        arrays["clean"][length:length + len(clean_chunk)] = clean_chunk
+        arrays["effect"][length:length + len(effect_chunk)] = effect_chunk
+        length += len(clean_chunk)
+
+    for array in arrays.values():
+        array.flush()
+    arrays.clear()
+
+    # Only a shard holding data replaces the files, empty ones are removed
+    if length == 0:
+        for tmp_path in tmp_paths.values():
+            os.remove(tmp_path)
+        return None
+
+    for kind in paths:
+        os.replace(tmp_paths[kind], paths[kind])
+
+    return {
+        "clean": os.path.basename(paths["clean"]),
+        "effect": os.path.basename(paths["effect"]),
+        "length": length,
+        "srate": srate,
+        "dtype": np.dtype(dtype).name,
+        "mu_comp": mu_comp,
+        "duration": duration,
+        "type": type,
+        "seed": seed,
+        "filtered": filters is not None,
+    }
+
+# Memory maps the clean and effect audio of a genre.
+#
+# Output:
+#   clean_audio - np.memmap
+#   effect_audio - np.memmap
+#       Read-only, the same layout create_data returns.
+def load_shard(genre, shard_dir=DEFAULT_SHARD_DIR):
+    entry = read_manifest(shard_dir)[genre]
+    length = entry["length"]
+
+    clean_audio = np.load(os.path.join(shard_dir, entry["clean"]), mmap_mode="r")[:length]
+    effect_audio = np.load(os.path.join(shard_dir, entry["effect"]), mmap_mode="r")[:length]
+
+    return clean_audio, effect_audio
+
+def read_manifest(shard_dir=DEFAULT_SHARD_DIR):
+    path = os.path.join(shard_dir, "manifest.json")
+
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+# Genre name usable in file names, e.g. "Rock & Roll" -> "Rock_Roll"
+def safe_name(genre):
+    return re.sub(r"[^A-Za-z0-9]+", "_", genre).strip("_")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate datasets for many genres into .npy shards.")
+    parser.add_argument("--genres", nargs="*", help="Genres to build, defaults to every genre in effectData.csv")
+    parser.add_argument("--effect-data", default=os.path.join("dataset", "effectData.csv"))
+    parser.add_argument("--file-data", default=os.path.join("dataset", "fileData.csv"))
+    parser.add_argument("--output-dir", default=DEFAULT_SHARD_DIR)
+    parser.add_argument("--type", default="random", choices=["scale", "random", "pentatonic"])
+    parser.add_argument("--duration", type=int, default=120)
+    parser.add_argument("--sr", type=int, default=22050)
+    parser.add_argument("--mu-law", action="store_true")
+    parser.add_argument("--filtered", action="store_true", help="Apply the notebooks' highpass and lowpass filters")
+    parser.add_argument("--seed", type=int, default=0, help="Base seed, each genre adds its position in effectData.csv")
+    parser.add_argument("--workers", type=int, default=None, help="Genres built at once, defaults to the number of cores")
+    args = parser.parse_args()
+
+    # Seeds depend on the genre's place in the full list, so selecting fewer
+    # genres does not change the data generated for each of them
+    all_genres = [g for g in load_catalog(args.effect_data, args.file_data).effects.genre.dropna().unique() if g.strip()]
+    genres = args.genres or all_genres
+    seeds = {genre: args.seed + all_genres.index(genre) for genre in genres if genre in all_genres}
+
+    for genre in genres:
+        if genre not in seeds:
+            print("Genre could not be found, double check string format: '%s'" % genre)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    start = time.perf_counter()
+
+    # Cores left over when there are fewer genres than cores go to the note
+    # loading threads of each process, so processes times threads fit the cores
+    cores = os.cpu_count() or 1
+    processes = max(1, min(args.workers or cores, len(seeds)))
+    threads = max(1, cores // processes)
+    entries = {}
+
+    with ProcessPoolExecutor(processes) as pool:
+        jobs = {
+            genre: pool.submit(generate_shard, genre, args.effect_data, args.file_data, args.output_dir, seed,
+                               args.mu_law, args.sr, args.duration, args.type,
+                               notebook_filters() if args.filtered else None, threads)
+            for genre, seed in seeds.items()
+        }
+
+        # A failed genre is reported and skipped, the others still go into the manifest
+        for genre, job in jobs.items():
+            try:
+                entries[genre] = job.result()
+            except Exception as error:
+                print("Genre '%s' failed: %s" % (genre, error))
+
+    manifest = read_manifest(args.output_dir)
+    manifest.update({genre: entry for genre, entry in entries.items() if entry is not None})
+
+    manifest_path = os.path.join(args.output_dir, "manifest.json")
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    built = sum(entry is not None for entry in entries.values())
+    print("Generated {} of {} genres in {:.1f} seconds".format(built, len(seeds), time.perf_counter() - start))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import numpy as np
+import tensorflow as tf
+
+import argparse, time
+
+import model_utils
+
+# Stateful streaming inference for the trained LSTM models.
+#
+# The windowed predictor (prepare_audio_seq followed by model.predict) reruns
+# the LSTM over a full frame for every output sample, so each input sample goes
+# through the recurrence frame times. The engine below copies the trained
+# weights into a stateful copy of the model that steps through the audio once,
+# carrying the hidden and cell state from one block to the next.
+#
+# The carried state sees all previous audio rather than only the last frame
+# samples, so the output is close to, but not bit identical with, the windowed
+# predictor. compare_with_windowed reports how close, and self_check runs that
+# comparison on a small random model so it needs no trained model or audio:
+#   python streaming_inference.py --self-check
+
+class StatefulEngine:
+
+    # Input:
+    #   model - tf.keras.Model
+    #       Trained LSTM model from the notebooks, LSTM layers followed by a
+    #       Dense output layer.
+    def __init__(self, model):
+        self.model = to_stateful(model)
+
+        # XLA fuses the per-timestep recurrence, which is where all the time goes
+        # with a batch of one. It compiles once per distinct block length.
+        self._predict = tf.function(self.model, jit_compile=True)
+
+    # Processes the next block of audio.
+    #
+    # Input:
+    #   block - np.array
+    #       Audio samples of any length.
+    #
+    # Output:
+    #   output - np.array
+    #       One predicted sample per input sample.
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float32).reshape(1, -1, 1)
+        return self._predict(block).numpy().reshape(-1)
+
+    # Clears the carried state, call before starting a new audio file.
+    def reset(self):
+        for layer in self.model.layers:
+            if isinstance(layer, tf.keras.layers.LSTM):
+                layer.reset_state()
+
+    # Processes a whole file block by block.
+    # The last block is zero padded so every block has the same length.
+    def process_audio(self, audio, block_size=4096):
+        self.reset()
+        padded = np.zeros(-(-len(audio) // block_size) * block_size, dtype=np.float32)
+        padded[:len(audio)] = audio
+        output = np.empty(len(padded), dtype=np.float32)
+
+        for i in range(0, len(padded), block_size):
+            output[i:i + block_size] = self.process(padded[i:i + block_size])
+
+        return output[:len(audio)]
+
+# Builds a stateful copy of a trained LSTM model that takes sequences of any
+# length and returns one output per timestep.
+def to_stateful(model):
+    stateful = tf.keras.Sequential(name=model.name + "_stateful")
+    stateful.add(tf.keras.layers.Input(batch_shape=(1, None, 1)))
+
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.LSTM):
+            stateful.add(tf.keras.layers.LSTM(
+                layer.units, activation=layer.activation, recurrent_activation=layer.recurrent_activation,
+                return_sequences=True, stateful=True, name=layer.name
+            ))
+        elif isinstance(layer, tf.keras.layers.Dense):
+            stateful.add(tf.keras.layers.Dense(layer.units, activation=layer.activation, name=layer.name))
+        else:
+            raise ValueError("Unsupported layer for streaming inference: " + layer.name)
+
+    for layer, original in zip(stateful.layers, model.layers):
+        layer.set_weights(original.get_weights())
+
+    return stateful
+
+# Times the engine on some audio.
+#
+# Output:
+#   real_time_factor - Float
+#       Processing time divided by the duration of the audio, below 1.0 means
+#       faster than real time.
+def real_time_factor(engine, audio, sr, block_size=4096):
+    # Warm up so compiling the block is not counted
+    engine.process(np.zeros(block_size, dtype=np.float32))
+
+    start = time.perf_counter()
+    engine.process_audio(audio, block_size)
+    elapsed = time.perf_counter() - start
+
+    return elapsed / (len(audio) / sr)
+
+# Compares the engine with the windowed predictor on the same audio.
+#
+# Output:
+#   results - dict
+#       esr and max_error between the two outputs, plus the time each took.
+def compare_with_windowed(model, audio, frame, block_size=4096):
+    audio = np.asarray(audio, dtype=np.float32)
+
+    start = time.perf_counter()
+    prepared_audio = model_utils.prepare_audio_seq(audio[None, :], index=0, frame=frame)
+    windowed = model.predict(prepared_audio, batch_size=4096, verbose=0).flatten()
+    windowed_time = time.perf_counter() - start
+
+    engine = StatefulEngine(model)
+    engine.process(np.zeros(block_size, dtype=np.float32))
+    start = time.perf_counter()
+    streamed = engine.process_audio(audio, block_size)
+    streamed_time = time.perf_counter() - start
+
+    return {
+        "esr": float(model_utils.esr(windowed, streamed)),
+        "max_error": float(np.max(np.abs(windowed - streamed))),
+        "windowed_time": windowed_time,
+        "streamed_time": streamed_time,
+    }
+
+# Checks the engine against the windowed predictor on a small random LSTM
+# built in memory and on synthetic audio, and that the output does not depend
+# on the block size.
+#
+# Input:
+#   tolerance - Float - Default 0.05
+#       Largest ESR against the windowed predictor that is accepted.
+#   seed - Integer - Default 0
+#
+# Output:
+#   results - dict
+#       The results of compare_with_windowed plus block_size_error, the largest
+#       difference between streaming in blocks of 1024 and of 256 samples.
+#       Raises AssertionError when either check fails.
+def self_check(tolerance=0.05, seed=0, sr=22050, frame=32):
+    tf.keras.utils.set_random_seed(seed)
+
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(frame, 1)),
+        tf.keras.layers.LSTM(8, activation='tanh', return_sequences=True),
+        tf.keras.layers.LSTM(8, activation='tanh', return_sequences=False),
+        tf.keras.layers.Dense(1),
+    ])
+
+    # A decaying note with some noise, one second long
+    t = np.arange(sr) / sr
+    noise = np.random.default_rng(seed).standard_normal(sr)
+    audio = (0.5 * np.sin(2 * np.pi * 220 * t) * np.exp(-2 * t) + 0.05 * noise).astype(np.float32)
+
+    results = compare_with_windowed(model, audio, frame, block_size=1024)
+
+    engine = StatefulEngine(model)
+    results["block_size_error"] = float(np.max(np.abs(engine.process_audio(audio, 1024) - engine.process_audio(audio, 256))))
+
+    if results["esr"] > tolerance:
+        raise AssertionError("Streaming ESR %.6f against the windowed predictor is above %.6f" % (results["esr"], tolerance))
+    if results["block_size_error"] > 1e-5:
+        raise AssertionError("Streaming output changes with the block size by %.6f" % results["block_size_error"])
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream audio through a trained LSTM model and report its real-time factor.")
+    parser.add_argument("model", nargs="?", help="Path to a .keras model, e.g. dataset/models/Metal.keras")
+    parser.add_argument("audio", nargs="?", help="Wav file to process")
+    parser.add_argument("--sr", type=int, default=22050)
+    parser.add_argument("--frame", type=int, default=64)
+    parser.add_argument("--block-size", type=int, default=4096)
+    parser.add_argument("--tolerance", type=float, default=0.05,
+                        help="Largest ESR against the windowed predictor that is accepted")
+    parser.add_argument("--self-check", action="store_true",
+                        help="Check the engine on a small random model instead, needs no model or audio")
+    args = parser.parse_args()
+
+    if args.self_check:
+        try:
+            results = self_check(args.tolerance)
+        except AssertionError as error:
+            print(error)
+            raise SystemExit(1)
+
+        print("Self check passed, ESR {:.6f}, max absolute difference {:.6f}, block size difference {:.6f}".format(
+            results["esr"], results["max_error"], results["block_size_error"]))
+        return
+
+    if args.model is None or args.audio is None:
+        parser.error("model and audio are required without --self-check")
+
+    import librosa
+
+    model = tf.keras.models.load_model(args.model)
+    audio, _ = librosa.load(args.audio, sr=args.sr)
+
+    results = compare_with_windowed(model, audio, args.frame, args.block_size)
+    duration = len(audio) / args.sr
+
+    print("Audio length: {:.2f} seconds at {} Hz".format(duration, args.sr))
+    print("Windowed real-time factor: {:.4f}".format(results["windowed_time"] / duration))
+    print("Streaming real-time factor: {:.4f}".format(results["streamed_time"] / duration))
+    print("ESR against windowed predictor: {:.6f}".format(results["esr"]))
+    print("Max absolute difference: {:.6f}".format(results["max_error"]))
+
+    if results["esr"] > args.tolerance:
+        print("Streaming output does not match the windowed predictor within tolerance.")
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+import numpy as np
+import pandas as pd
+
+import argparse, hashlib, itertools, multiprocessing, os, shutil, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import data
+import model_utils
+from filters import combine_taps, notebook_filters
+from shards import safe_name
+
+# Parallel hyperparameter sweeps for the LSTM models.
+#
+# Runs every combination of the notebook parameters (frame, hidden_units,
+# batch_size_para, dual_layer, sequential_input) as a separate training job.
+# The audio is generated once, and every distinct (frame, sequential_input)
+# dataset is built once into .npy files that the jobs memory map read-only,
+# so no job regenerates or copies data. Jobs run across a process pool, each
+# limited to a fixed number of TensorFlow threads so the pool fills the
+# machine without the jobs fighting over cores.
+#
+# Results go into the same experiments-<genre>.csv the notebook writes, one row
+# per job, rewritten atomically after every job so an interrupted sweep keeps
+# everything finished so far. Each row also records the data and training
+# settings (epochs, duration, sample rate, test ratio, seed, filters), and a
+# job is only skipped when the file has it with the same settings.
+#
+# Example:
+#   python sweep.py --genre Metal --frames 32 64 128 --hidden-units 8 16 32 --threads-per-job 2
+
+DEFAULT_SWEEP_DIR = os.path.join("dataset", "experiments", "sweep")
+
+# Columns of the experiments csv, the notebook's columns followed by the ones
+# the sweep adds
+RESULT_COLUMNS = [
+    'Model Name', 'Effect', 'Frame', 'Sequential Input', 'Training Dataset',
+    'Hidden Units', 'Batch Size', 'Epochs', 'MAE', 'R2', 'Inference Time',
+    'EN MAE', 'Dual Layer', 'ESR', 'Training Time', 'Duration', 'Sample Rate',
+    'Test Ratio', 'Seed', 'Filters'
+]
+
+# Settings a result depends on besides the job's own parameters, a finished
+# job is only reused when all of them match
+SETTING_COLUMNS = ['Epochs', 'Duration', 'Sample Rate', 'Test Ratio', 'Seed', 'Filters']
+
+# Every combination of the parameter lists.
+#
+# Input:
+#   grid - dict
+#       Parameter name -> list of values, e.g. {"frame": [32, 64], "hidden_units": [16]}.
+#
+# Output:
+#   jobs - List of dict
+#       One dict of parameters per combination.
+def expand_grid(grid):
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+# Builds the datasets of a genre for every distinct (frame, sequential) pair,
+# or reuses them if an earlier sweep already did.
+#
+# Input:
+#   genre - String
+#       Genre name, must be same from list in effectData.csv name.
+#   effect_data_path, file_data_path - String
+#       Paths to the effect and file data csv files.
+#   pairs - List of Tuple
+#       (frame, sequential) pairs to build.
+#   sweep_dir - String
+#       Folder the datasets are written to.
+#   sr, duration, test_ratio, seed
+#       Same as in the notebook, seed also picks the notes.
+#   filters - List of np.array - Default None
+#       FIR filters applied to the audio, see filters.py.
+#
+# Output:
+#   paths - dict
+#       (frame, sequential) -> folder of the dataset. The folder name holds
+#       every setting that changes the arrays, including a digest of the
+#       csv files and the filter taps, so a dataset is only reused when it
+#       would be built the same.
+def build_datasets(genre, effect_data_path, file_data_path, pairs, sweep_dir, sr=22050, duration=120, test_ratio=0.2, seed=0, filters=None):
+    source = _digest(_read_bytes(effect_data_path), _read_bytes(file_data_path))
+    paths = {
+        pair: os.path.join(sweep_dir, _dataset_name(genre, sr, duration, seed, test_ratio, filters_id(filters), source, *pair))
+        for pair in pairs
+    }
+    missing = [pair for pair, path in paths.items() if not os.path.isdir(path)]
+
+    if not missing:
+        return paths
+
+    signal, wet = data.create_data(genre, effect_data_path, file_data_path, mu_comp=False, srate=sr,
+                                   duration=duration, type="random", seed=seed, filters=filters)
+
+    # Same sizes as the notebook
+    for frame, sequential in missing:
+        training_size = int((len(signal) / frame) * (1 - test_ratio))
+        testing_size = int((len(signal) / frame) * test_ratio)
+
+        if sequential:
+            arrays = model_utils.create_sequential_dataset(signal, wet, training_size, testing_size, frame, sr, seed=seed,
+                                                           test_ratio=test_ratio)
+        else:
+            arrays = model_utils.create_dataset(signal, wet, training_size, testing_size, frame, sr=sr,
+                                                test_ratio=test_ratio, seed=seed)
+
+        # Written to a temporary folder and renamed, a folder that exists is complete
+        path = paths[(frame, sequential)]
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        for name, array in zip(_DATASET_ARRAYS, arrays):
+            np.save(os.path.join(tmp_path, name + ".npy"), array)
+
+        os.replace(tmp_path, path)
+
+    return paths
+
+# Memory maps a dataset written by build_datasets.
+#
+# Output:
+#   arrays - dict
+#       dry_test, wet_test, features_train, features_test, targets_train and
+#       targets_test, as returned by model_utils.create_dataset. Read-only.
+def load_dataset(path):
+    return {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in _DATASET_ARRAYS}
+
+# The model from lstm_main_training.ipynb.
+#
+# Input:
+#   frame - Integer
+#       Size of frame (in samples) fed to the model.
+#   hidden_units - Integer
+#       Number of hidden units in each LSTM layer.
+#   dual_layer - Boolean
+#       Use 2 LSTM layers instead of 1.
+#   name - String
+#       Name of the model, also used in the layer names.
+#
+# Output:
+#   model - tf.keras.Model
+#       Compiled model.
+def build_model(frame, hidden_units, dual_layer, name):
+    import tensorflow as tf
+
+    model = tf.keras.Sequential(name=name)
+    model.add(tf.keras.layers.Input(shape=(frame, 1)))
+
+    if dual_layer:
+        model.add(tf.keras.layers.LSTM(hidden_units, activation='tanh', return_sequences=True, name='layer1' + name))
+        model.add(tf.keras.layers.LSTM(hidden_units, activation='tanh', return_sequences=False, name='layer2' + name))
+    else:
+        model.add(tf.keras.layers.LSTM(hidden_units, activation='tanh', return_sequences=False, name='layer' + name))
+
+    model.add(tf.keras.layers.Dense(1))
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
+        loss='mean_absolute_error'
+    )
+
+    return model
+
+# Trains and scores one model, runs inside a worker process.
+#
+# Input:
+#   job - dict
+#       frame, hidden_units, batch_size, dual_layer and sequential.
+#   genre - String
+#   dataset_path - String
+#       Folder of the dataset from build_datasets.
+#   epochs - Integer
+#       Most epochs, training stops early like in the notebook.
+#   sr - Integer
+#   models_dir - String - Default None
+#       Folder the trained model is saved to, not saved when None.
+#
+# Output:
+#   row - dict
+#       Results in RESULT_COLUMNS.
+def train_job(job, genre, dataset_path, epochs, sr, models_dir=None):
+    import tensorflow as tf
+    import evaluation
+
+    arrays = load_dataset(dataset_path)
+    name = job_name(genre, job)
+
+    tf.keras.backend.clear_session()
+    model = build_model(job["frame"], job["hidden_units"], job["dual_layer"], safe_name(genre))
+
+    start = time.perf_counter()
+    callback_stop = tf.keras.callbacks.EarlyStopping(monitor='loss', patience=5, restore_best_weights=True)
+    model.fit(
+        arrays["features_train"],
+        arrays["targets_train"],
+        batch_size=job["batch_size"],
+        shuffle=False,
+        epochs=epochs,
+        callbacks=[callback_stop],
+        validation_split=0.15,
+        verbose=0,
+    )
+    training_time = time.perf_counter() - start
+
+    dry_test, wet_test = arrays["dry_test"], arrays["wet_test"]
+    overall, _, inference = evaluation.evaluate_model(model_utils.keras_predictor(model), dry_test, wet_test, job["frame"])
+
+    if models_dir is not None:
+        model.save(os.path.join(models_dir, name + ".keras"))
+
+    return {
+        'Model Name': name,
+        'Effect': genre,
+        'Frame': job["frame"],
+        'Sequential Input': job["sequential"],
+        'Training Dataset': len(arrays["features_train"]),
+        'Hidden Units': job["hidden_units"],
+        'Batch Size': job["batch_size"],
+        'Epochs': epochs,
+        'MAE': overall["mae"],
+        'R2': overall["r2"],
+        # Seconds per second of audio, as in the notebook
+        'Inference Time': inference / (dry_test.size / sr),
+        'EN MAE': overall["en_mae"],
+        'Dual Layer': job["dual_layer"],
+        'ESR': overall["esr"],
+        'Training Time': training_time,
+    }
+
+# Name of a job's model, unique within a genre's sweep.
+def job_name(genre, job):
+    return "%s_f%d_h%d_b%d_%s_%s" % (
+        safe_name(genre), job["frame"], job["hidden_units"], job["batch_size"],
+        "dual" if job["dual_layer"] else "single", "seq" if job["sequential"] else "random")
+
+# Short name of a set of filters for the csv and dataset folders, the same
+# taps always give the same name.
+def filters_id(filters):
+    if filters is None:
+        return "unfiltered"
+    return "fir" + _digest(combine_taps(filters).tobytes())
+
+# Reads an experiments csv, empty when it does not exist yet.
+def read_results(path):
+    if not os.path.isfile(path):
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    return pd.read_csv(path)
+
+# Adds rows to an experiments csv. The file is written to a temporary file
+# and renamed over the old one, so it is never seen half written.
+#
+# Output:
+#   results - pd.DataFrame
+#       Every row in the file.
+def append_results(path, rows):
+    results = read_results(path)
+    rows = pd.DataFrame(rows)
+    results = rows if results.empty else pd.concat([results, rows], ignore_index=True)
+
+    results.to_csv(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+
+    return results
+
+# Runs a whole sweep.
+#
+# Input:
+#   genre - String
+#   grid - dict
+#       Parameter lists for expand_grid, with the keys frame, hidden_units,
+#       batch_size, dual_layer and sequential.
+#   results_path - String
+#       Experiments csv the results are added to.
+#   effect_data_path, file_data_path - String
+#   epochs - Integer - Default 50
+#   sr, duration, test_ratio, seed
+#       Same as in the notebook.
+#   filters - List of np.array - Default None
+#       FIR filters applied to the audio, see filters.py.
+#   workers - Integer - Default None
+#       Jobs run at once, defaults to the cores divided by threads_per_job.
+#   threads_per_job - Integer - Default 1
+#       TensorFlow threads each job may use.
+#   sweep_dir - String - Default DEFAULT_SWEEP_DIR
+#       Folder for the shared datasets.
+#   models_dir - String - Default None
+#       Folder the trained models are saved to, not saved when None.
+#
+# Output:
+#   results - pd.DataFrame
+#       The whole experiments csv after the sweep.
+def run_sweep(genre, grid, results_path, effect_data_path, file_data_path, epochs=50, sr=22050, duration=120,
+              test_ratio=0.2, seed=0, filters=None, workers=None, threads_per_job=1, sweep_dir=DEFAULT_SWEEP_DIR, models_dir=None):
+    settings = {
+        'Epochs': epochs, 'Duration': duration, 'Sample Rate': sr,
+        'Test Ratio': test_ratio, 'Seed': seed, 'Filters': filters_id(filters),
+    }
+    done = _finished_jobs(read_results(results_path), settings)
+    jobs = [job for job in expand_grid(grid) if job_name(genre, job) not in done]
+
+    if not jobs:
+        print("Every job is already in " + results_path + " with these settings")
+        return read_results(results_path)
+
+    os.makedirs(sweep_dir, exist_ok=True)
+    if models_dir is not None:
+        os.makedirs(models_dir, exist_ok=True)
+
+    pairs = sorted({(job["frame"], job["sequential"]) for job in jobs})
+    paths = build_datasets(genre, effect_data_path, file_data_path, pairs, sweep_dir, sr, duration, test_ratio, seed, filters)
+
+    # Largest models first, so the pool does not end waiting on one of them
+    jobs.sort(key=lambda job: job["frame"] * job["hidden_units"] * (2 if job["dual_layer"] else 1), reverse=True)
+
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 1) // threads_per_job)
+    workers = min(workers, len(jobs))
+
+    results = None
+    start = time.perf_counter()
+
+    # Spawn rather than fork, TensorFlow does not survive being forked
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(threads_per_job,)) as pool:
+        futures = {
+            pool.submit(train_job, job, genre, paths[(job["frame"], job["sequential"])], epochs, sr, models_dir): job
+            for job in jobs
+        }
+
+        for i, future in enumerate(as_completed(futures)):
+            name = job_name(genre, futures[future])
+
+            try:
+                row = future.result()
+            except Exception as error:
+                print("[{}/{}] {} failed: {}".format(i + 1, len(jobs), name, error))
+                continue
+
+            row.update(settings)
+            results = append_results(results_path, [row])
+            print("[{}/{}] {} MAE {:.4f} R2 {:.4f} ESR {:.4f} ({:.0f} s)".format(
+                i + 1, len(jobs), name, row['MAE'], row['R2'], row['ESR'], time.perf_counter() - start))
+
+    return results if results is not None else read_results(results_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Train every combination of LSTM parameters in parallel.")
+    parser.add_argument("--genre", default="Metal")
+    parser.add_argument("--frames", type=int, nargs="+", default=[64])
+    parser.add_argument("--hidden-units", type=int, nargs="+", default=[16])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[64])
+    parser.add_argument("--dual-layer", choices=["true", "false"], nargs="+", default=["true"])
+    parser.add_argument("--sequential", choices=["true", "false"], nargs="+", default=["false"])
+    parser.add_argument("--epochs", type=int, default=50)
+    parser.add_argument("--duration", type=int, default=120)
+    parser.add_argument("--sr", type=int, default=22050)
+    parser.add_argument("--test-ratio", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--filtered", action="store_true", help="Apply the notebooks' highpass and lowpass filters")
+    parser.add_argument("--workers", type=int, default=None, help="Jobs run at once, defaults to cores / threads per job")
+    parser.add_argument("--threads-per-job", type=int, default=1)
+    parser.add_argument("--effect-data", default=os.path.join("dataset", "effectData.csv"))
+    parser.add_argument("--file-data", default=os.path.join("dataset", "fileData.csv"))
+    parser.add_argument("--results", help="Experiments csv, defaults to dataset/experiments/experiments-<genre>.csv")
+    parser.add_argument("--sweep-dir", default=DEFAULT_SWEEP_DIR)
+    parser.add_argument("--models-dir", default=None, help="Save every trained model to this folder")
+    args = parser.parse_args()
+
+    grid = {
+        "frame": args.frames,
+        "hidden_units": args.hidden_units,
+        "batch_size": args.batch_sizes,
+        "dual_layer": [value == "true" for value in args.dual_layer],
+        "sequential": [value == "true" for value in args.sequential],
+    }
+    results_path = args.results or os.path.join("dataset", "experiments", "experiments-" + args.genre + ".csv")
+
+    results = run_sweep(args.genre, grid, results_path, args.effect_data, args.file_data, args.epochs, args.sr,
+                        args.duration, args.test_ratio, args.seed, notebook_filters() if args.filtered else None, args.workers, args.threads_per_job,
+                        args.sweep_dir, args.models_dir)
+
+    print(results.sort_values('MAE').to_string(index=False))
+
+# -----------------------------------------------------------------------
+# Helper functions below are designed to be used only in this module.
+
+_DATASET_ARRAYS = ["dry_test", "wet_test", "features_train", "features_test", "targets_train", "targets_test"]
+
+def _dataset_name(genre, sr, duration, seed, test_ratio, filters, source, frame, sequential):
+    return "%s_%d_%ds_seed%d_test%g_%s_%s_f%d_%s" % (
+        safe_name(genre), sr, duration, seed, test_ratio, filters, source, frame, "seq" if sequential else "random")
+
+def _read_bytes(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+def _digest(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()[:10]
+
+# Settings of a row in a comparable form
+def _settings_key(row):
+    return (int(row['Epochs']), int(row['Duration']), int(row['Sample Rate']),
+            float(row['Test Ratio']), int(row['Seed']), str(row['Filters']))
+
+# Names of the jobs in the results that ran with the given settings. Rows
+# without the setting columns, e.g. from the notebook or an older sweep, never
+# match.
+def _finished_jobs(results, settings):
+    if any(column not in results for column in SETTING_COLUMNS):
+        return set()
+
+    key = _settings_key(settings)
+    complete = results.dropna(subset=SETTING_COLUMNS)
+    return {row['Model Name'] for _, row in complete.iterrows() if _settings_key(row) == key}
+
+# Limits the threads of a worker before TensorFlow is imported
+def _init_worker(threads):
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
+
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+if __name__ == "__main__":
+    main()